@@ -0,0 +1,43 @@
+"""Compare the latency of spawning a backend against connecting to a daemon.
+
+Each sample times how long it takes a fresh client to get its first answer
+from the backend, which is what every ``passacre`` invocation pays.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from passacre._backend_capnp import DaemonClient, SubprocessClient
+from passacre.schema import multibase_of_schema
+
+
+schema = multibase_of_schema([[32, 'printable']])
+
+
+def first_answer_latency(client):
+    start = time.time()
+    client.entropy_bits(schema)
+    return time.time() - start
+
+
+def median(xs):
+    xs = sorted(xs)
+    return xs[len(xs) // 2]
+
+
+def main(runs=50):
+    socket_path = os.path.join(tempfile.mkdtemp(), 'backend.sock')
+    # Start the daemon before timing anything so every sample is a warm connect.
+    first_answer_latency(DaemonClient(socket_path, idle_timeout=60))
+
+    cold = [first_answer_latency(SubprocessClient()) for _ in range(runs)]
+    warm = [first_answer_latency(DaemonClient(socket_path)) for _ in range(runs)]
+    for name, samples in [('cold spawn', cold), ('warm connect', warm)]:
+        print('%-12s  median %7.2fms  min %7.2fms  max %7.2fms' % (
+            name, median(samples) * 1000, min(samples) * 1000, max(samples) * 1000))
+    print('speedup: %.1fx' % (median(cold) / median(warm),))
+
+
+main(*map(int, sys.argv[1:]))
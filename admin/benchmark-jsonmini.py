@@ -0,0 +1,80 @@
+"""Compare jsonmini parsing through the JSON fast path against the grammar.
+
+The first rows time parsing typical stored values. The last row times
+``SqliteConfig.get_all_sites`` on a config with the given number of sites,
+each with a couple of config values.
+"""
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from passacre.config import SqliteConfig
+from passacre import jsonmini
+
+
+schema_file = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'passacre', 'schema.sql')
+
+values = [
+    ('int', '10'),
+    ('schema', '[[32, "printable"]]'),
+    ('object', '{"enabled": true, "iterations": 10, "method": "keccak"}'),
+]
+
+
+def build_config(path, n_sites):
+    db = sqlite3.connect(path)
+    with open(schema_file) as infile:
+        db.executescript(infile.read())
+    config = SqliteConfig()
+    config._db = db
+    config.add_schema('32-printable', [[32, 'printable']])
+    schema_id, _ = config.get_schema('32-printable')
+    config.add_site('default', schema_id)
+    config.bulk_load(
+        {'site': 'site%d.example.com' % (e,), 'schema': [[8 + e % 16, 'alphanumeric']],
+         'increment': e % 3, 'method': 'keccak'}
+        for e in range(n_sites))
+    db.close()
+
+
+def time_it(f, runs):
+    start = time.time()
+    for _ in range(runs):
+        f()
+    return (time.time() - start) / runs
+
+
+def main(n_sites=20000, runs=1000):
+    fast_parse = jsonmini.parse
+    print('%-14s %12s %12s %8s' % ('what', 'grammar', 'fast path', 'speedup'))
+    for name, value in values:
+        grammar = time_it(lambda: jsonmini._parse_grammar(value), runs)
+        fast = time_it(lambda: fast_parse(value), runs)
+        print('%-14s %10.1fus %10.1fus %7.0fx' % (
+            name, grammar * 1e6, fast * 1e6, grammar / fast))
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, 'passacre.sqlite')
+        build_config(path, n_sites)
+        config = SqliteConfig()
+        with open(path, 'rb') as infile:
+            config.read(infile)
+        jsonmini.parse = jsonmini._parse_grammar
+        try:
+            grammar = time_it(config.get_all_sites, 1)
+        finally:
+            jsonmini.parse = fast_parse
+        fast = time_it(config.get_all_sites, 1)
+        print('%-14s %11.2fs %11.2fs %7.0fx' % (
+            'get_all_sites', grammar, fast, grammar / fast))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+main(*map(int, sys.argv[1:]))
@@ -0,0 +1,59 @@
+"""Time ``MultiBase`` on long schemas, digit by digit and divided in halves.
+
+Each row is one schema length, from a short password to a keyfile-sized
+schema, alternating printable characters, lowercase letters and a separator.
+"""
+
+import random
+import string
+import sys
+import time
+
+from passacre.multibase import MultiBase
+
+
+printable = string.digits + string.ascii_letters + string.punctuation
+lengths = [32, 128, 512, 2048, 8192, 32768, 100000]
+
+
+class DigitByDigit(MultiBase):
+    __slots__ = ()
+    divide_threshold = float('inf')
+
+
+class Dividing(MultiBase):
+    __slots__ = ()
+    divide_threshold = 0
+
+
+def time_it(f, runs):
+    start = time.time()
+    for _ in range(runs):
+        f()
+    return (time.time() - start) / runs
+
+
+def main(max_length=100000):
+    print('%8s %-8s %12s %12s %8s' % ('digits', 'what', 'by digit', 'divided', 'speedup'))
+    for length in lengths:
+        if length > max_length:
+            break
+        bases = [(printable, string.ascii_lowercase, '-')[e % 3] for e in range(length)]
+        runs = max(1, 2000 // length)
+        rows = []
+        for cls in [DigitByDigit, Dividing]:
+            build = time_it(lambda: cls(bases), runs)
+            mb = cls(bases)
+            n = random.randint(0, mb.max_encodable_value)
+            encoded = mb.encode(n)
+            rows.append([
+                build,
+                time_it(lambda: mb.encode(n), runs),
+                time_it(lambda: mb.decode(encoded), runs),
+            ])
+        for what, slow, fast in zip(['build', 'encode', 'decode'], *rows):
+            print('%8d %-8s %10.2fms %10.2fms %7.1fx' % (
+                length, what, slow * 1e3, fast * 1e3, slow / fast))
+
+
+main(*map(int, sys.argv[1:]))
@@ -0,0 +1,74 @@
+"""Compare ``MultiBase`` against a MultiBase that recomputes everything.
+
+The reference is how ``MultiBase`` worked before it precomputed its largest
+encodable value and kept a table per base for decoding.
+"""
+
+import random
+import string
+import sys
+import time
+
+from passacre.multibase import MultiBase
+
+
+printable = string.digits + string.ascii_letters + string.punctuation
+
+
+class ReferenceMultiBase(object):
+    def __init__(self, bases):
+        self.bases = bases
+
+    @property
+    def max_encodable_value(self):
+        ret = 1
+        for base in self.bases:
+            ret *= len(base)
+        return ret - 1
+
+    def encode(self, n):
+        if n > self.max_encodable_value:
+            raise ValueError(n)
+        ret = []
+        for base in reversed(self.bases):
+            n, d = divmod(n, len(base))
+            ret.append(base[d])
+        ret.reverse()
+        return ''.join(ret)
+
+    def decode(self, x):
+        ret = 0
+        for base, d in zip(self.bases, x):
+            ret = (ret * len(base)) + base.index(d)
+        return ret
+
+
+def time_it(f, runs):
+    start = time.time()
+    for _ in range(runs):
+        f()
+    return (time.time() - start) / runs
+
+
+def main(n_values=10000, runs=5):
+    print('%-20s %12s %12s %8s' % ('what', 'reference', 'compiled', 'speedup'))
+    for length in [8, 32, 128]:
+        bases = [printable] * length
+        reference, compiled = ReferenceMultiBase(bases), MultiBase(bases)
+        ns = [random.randint(0, compiled.max_encodable_value) for _ in range(n_values)]
+        xs = compiled.encode_many(ns)
+        rows = [
+            ('encode', lambda: [reference.encode(n) for n in ns],
+             lambda: compiled.encode_many(ns)),
+            ('decode', lambda: [reference.decode(x) for x in xs],
+             lambda: compiled.decode_many(xs)),
+        ]
+        for name, slow, fast in rows:
+            slow_time = time_it(slow, runs) / n_values
+            fast_time = time_it(fast, runs) / n_values
+            print('%-20s %10.2fus %10.2fus %7.1fx' % (
+                '%s %d printable' % (name, length), slow_time * 1e6, fast_time * 1e6,
+                slow_time / fast_time))
+
+
+main(*map(int, sys.argv[1:]))
@@ -0,0 +1,35 @@
+"""Compare in-process derivation against the backend subprocess.
+
+Each row times ``hash_site`` at a given iteration count through both clients.
+The subprocess timings include a fresh backend spawn, as a ``passacre`` run
+would pay.
+"""
+
+import sys
+import time
+
+from passacre._backend_capnp import SubprocessClient
+from passacre._backend_python import PythonClient
+from passacre.generator import hash_site
+
+
+def time_hash_site(client, method, iterations, runs):
+    start = time.time()
+    for _ in range(runs):
+        hash_site('passacre', 'example.com', {'method': method, 'iterations': iterations}, client=client)
+    return (time.time() - start) / runs
+
+
+def main(runs=5):
+    print('%-7s %10s %12s %12s' % ('method', 'iterations', 'python', 'subprocess'))
+    for method in ['keccak', 'skein']:
+        for iterations in [0, 1, 10, 100]:
+            python = time_hash_site(PythonClient(), method, iterations, runs)
+            subprocess = sum(
+                time_hash_site(SubprocessClient(), method, iterations, 1)
+                for _ in range(runs)) / runs
+            print('%-7s %10d %10.2fms %10.2fms' % (
+                method, iterations, python * 1000, subprocess * 1000))
+
+
+main(*map(int, sys.argv[1:]))
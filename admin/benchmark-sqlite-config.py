@@ -0,0 +1,78 @@
+"""Compare site lookups through each sqlite connection profile.
+
+A config with the given number of sites is built in a temporary directory,
+then random sites are looked up through a connection opened as before the
+tuned profile, through each ``SqliteConfig`` mode, and through a snapshot.
+"""
+
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from passacre.config import SqliteConfig
+
+
+schema_file = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'passacre', 'schema.sql')
+
+
+class UntunedSqliteConfig(SqliteConfig):
+    "A connection set up the way ``SqliteConfig.read`` used to."
+
+    def _connect(self, path, mode):
+        return sqlite3.connect(path, check_same_thread=False)
+
+
+def build_config(path, n_sites):
+    db = sqlite3.connect(path)
+    with open(schema_file) as infile:
+        db.executescript(infile.read())
+    config = SqliteConfig()
+    config._db = db
+    config.add_schema('32-printable', [[32, 'printable']])
+    schema_id, _ = config.get_schema('32-printable')
+    config.add_site('default', schema_id)
+    config.bulk_load(
+        {'site': 'site%d.example.com' % (e,), 'schema': [[8 + e % 16, 'alphanumeric']],
+         'increment': e % 3}
+        for e in range(n_sites))
+    db.close()
+
+
+def lookups_per_second(config_class, path, mode, sites, snapshot=False):
+    config = config_class()
+    with open(path, 'rb') as infile:
+        config.read(infile, mode=mode)
+    if snapshot:
+        config.enable_snapshot()
+    start = time.time()
+    for site in sites:
+        config.get_site_without_password(site)
+    return len(sites) / (time.time() - start)
+
+
+def main(n_sites=20000, n_lookups=20000):
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempdir, 'passacre.sqlite')
+        build_config(path, n_sites)
+        sites = ['site%d.example.com' % (random.randrange(n_sites),) for _ in range(n_lookups)]
+        print('%-8s %-6s %14s' % ('profile', 'mode', 'lookups/s'))
+        for name, config_class, mode in [
+                ('untuned', UntunedSqliteConfig, None),
+                ('tuned', SqliteConfig, None),
+                ('tuned', SqliteConfig, 'read'),
+                ('tuned', SqliteConfig, 'write'),
+                ('snapshot', SqliteConfig, 'read'),
+        ]:
+            print('%-8s %-6s %14.0f' % (name, mode, lookups_per_second(
+                config_class, path, mode, sites, snapshot=name == 'snapshot')))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+main(*map(int, sys.argv[1:]))
@@ -2,39 +2,190 @@ extern crate capnp;
 extern crate capnp_rpc;
 extern crate gj;
 extern crate gjio;
+extern crate libc;
 extern crate passacre;
 
+use std::cell::Cell;
+use std::fs::{File, OpenOptions};
+use std::io::Write;
+use std::os::unix::io::AsRawFd;
+use std::os::unix::net::UnixStream;
+use std::path::Path;
+use std::rc::Rc;
+use std::time::{Duration, Instant};
+
 use capnp_rpc::{RpcSystem, twoparty, rpc_twoparty_capnp};
-use gj::EventLoop;
+use gj::{EventLoop, Promise, TaskReaper, TaskSet};
 
 use passacre::passacre_capnp::toplevel;
+use passacre::rpc::StandardToplevel;
 
-fn main() {
-    let args: Vec<String> = ::std::env::args().collect();
-    if args.len() != 2 {
-        println!("usage: {} <fd>", args[0]);
-        return;
+fn serve(stream: ::gjio::SocketStream, toplevel: StandardToplevel) -> Promise<(), ::capnp::Error> {
+    let toplevel = toplevel::ToClient::new(toplevel).from_server::<::capnp_rpc::Server>();
+    let mut network = twoparty::VatNetwork::new(
+        stream.clone(), stream, rpc_twoparty_capnp::Side::Server, Default::default());
+    let disconnect_promise = network.on_disconnect();
+    let rpc_system = RpcSystem::new(Box::new(network), Some(toplevel.client));
+    disconnect_promise.attach(rpc_system)
+}
+
+struct Reaper;
+
+impl TaskReaper<(), ::capnp::Error> for Reaper {
+    fn task_failed(&mut self, error: ::capnp::Error) {
+        let _ = writeln!(::std::io::stderr(), "connection failed: {}", error);
+    }
+}
+
+#[derive(Clone)]
+struct Activity {
+    connections: Rc<Cell<usize>>,
+    last_active: Rc<Cell<Instant>>,
+}
+
+impl Activity {
+    fn new() -> Activity {
+        Activity {
+            connections: Rc::new(Cell::new(0)),
+            last_active: Rc::new(Cell::new(Instant::now())),
+        }
     }
 
+    fn connected(&self) {
+        self.connections.set(self.connections.get() + 1);
+    }
+
+    fn disconnected(&self) {
+        self.connections.set(self.connections.get() - 1);
+        self.last_active.set(Instant::now());
+    }
+
+    fn idle_for(&self, timeout: Duration) -> bool {
+        self.connections.get() == 0 && self.last_active.get().elapsed() >= timeout
+    }
+}
+
+fn accept_loop(mut listener: ::gjio::SocketListener,
+               mut tasks: TaskSet<(), ::capnp::Error>,
+               toplevel: StandardToplevel,
+               activity: Activity) -> Promise<(), ::std::io::Error> {
+    listener.accept().then(move |stream| {
+        activity.connected();
+        let connection_activity = activity.clone();
+        tasks.add(serve(stream, toplevel.clone()).then_else(move |r| {
+            connection_activity.disconnected();
+            Promise::result(r)
+        }));
+        accept_loop(listener, tasks, toplevel, activity)
+    })
+}
+
+fn idle_loop(timer: ::gjio::Timer, timeout: Duration, activity: Activity) -> Promise<(), ::std::io::Error> {
+    timer.after_delay(timeout).then(move |()| {
+        if activity.idle_for(timeout) {
+            Promise::ok(())
+        } else {
+            idle_loop(timer, timeout, activity)
+        }
+    })
+}
+
+fn serve_fd(fd: &str) {
+    let fd: ::gjio::RawDescriptor = fd.parse().expect("invalid fd");
     EventLoop::top_level(move |wait_scope| -> Result<(), ::capnp::Error> {
         let mut event_port = try!(::gjio::EventPort::new());
         let stream = {
             let network = event_port.get_network();
-            let fd: ::gjio::RawDescriptor = args[1].parse().expect("invalid fd");
             unsafe { network.wrap_raw_socket_descriptor(fd) }.expect("couldn't adopt fd")
         };
-        let disconnect_promise = {
-            let toplevel =
-                toplevel::ToClient::new(passacre::rpc::StandardToplevel).from_server::<::capnp_rpc::Server>();
-            let mut network = twoparty::VatNetwork::new(
-                stream.clone(), stream, rpc_twoparty_capnp::Side::Server, Default::default());
-            let disconnect_promise = network.on_disconnect();
-            let rpc_system = RpcSystem::new(Box::new(network), Some(toplevel.client));
-            disconnect_promise.attach(rpc_system)
-        };
+        serve(stream, StandardToplevel::new()).wait(wait_scope, &mut event_port)?;
+        Ok(())
+    }).expect("top level error");
+}
 
-        disconnect_promise.wait(wait_scope, &mut event_port)?;
+/// Take an exclusive lock on a file beside the socket, held for as long as the
+/// returned file is open. Returns `None` if another daemon already holds it.
+fn lock_socket_path(path: &Path) -> Option<File> {
+    let mut lock_path = path.as_os_str().to_owned();
+    lock_path.push(".lock");
+    let lock = OpenOptions::new().create(true).write(true).open(&lock_path)
+        .expect("couldn't open the socket's lock file");
+    if unsafe { ::libc::flock(lock.as_raw_fd(), ::libc::LOCK_EX | ::libc::LOCK_NB) } == 0 {
+        Some(lock)
+    } else {
+        None
+    }
+}
 
+fn serve_listening(path: &str, idle_timeout: &str) {
+    let idle_timeout = Duration::from_secs(idle_timeout.parse().expect("invalid idle timeout"));
+    let path = ::std::path::PathBuf::from(path);
+    // Daemons started at the same time race for the lock; the losers exit and
+    // their clients connect to the winner. The lock is held until the socket
+    // is removed again.
+    let _lock = match lock_socket_path(&path) {
+        Some(lock) => lock,
+        None => return,
+    };
+    if UnixStream::connect(&path).is_ok() {
+        return;
+    }
+    // Nothing holds the lock or is listening, so anything at this path is
+    // stale.
+    let _ = ::std::fs::remove_file(&path);
+    EventLoop::top_level(move |wait_scope| -> Result<(), ::capnp::Error> {
+        let mut event_port = try!(::gjio::EventPort::new());
+        let listener = {
+            let network = event_port.get_network();
+            let mut address = try!(network.get_unix_address(&path));
+            try!(address.listen())
+        };
+        let activity = Activity::new();
+        // Every connection shares one toplevel, and so one word list cache.
+        let accepting = accept_loop(
+            listener, TaskSet::new(Box::new(Reaper)), StandardToplevel::new(), activity.clone());
+        let idling = idle_loop(event_port.get_timer(), idle_timeout, activity);
+        let result = accepting.exclusive_join(idling).wait(wait_scope, &mut event_port);
+        let _ = ::std::fs::remove_file(&path);
+        result?;
         Ok(())
     }).expect("top level error");
 }
+
+fn main() {
+    let args: Vec<String> = ::std::env::args().collect();
+    match args.len() {
+        2 => serve_fd(&args[1]),
+        4 if args[1] == "--listen" => serve_listening(&args[2], &args[3]),
+        _ => {
+            println!("usage: {0} <fd>\n       {0} --listen <socket path> <idle seconds>", args[0]);
+        },
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use std::time::Duration;
+
+    use super::{Activity, lock_socket_path};
+
+    #[test]
+    fn test_lock_socket_path_is_exclusive() {
+        let path = ::std::env::temp_dir().join("passacre-backend-lock-test.sock");
+        let lock = lock_socket_path(&path).expect("couldn't take an unheld lock");
+        assert!(lock_socket_path(&path).is_none());
+        drop(lock);
+        assert!(lock_socket_path(&path).is_some());
+    }
+
+    #[test]
+    fn test_activity_idle_for() {
+        let activity = Activity::new();
+        assert!(activity.idle_for(Duration::from_secs(0)));
+        activity.connected();
+        assert!(!activity.idle_for(Duration::from_secs(0)));
+        activity.disconnected();
+        assert!(activity.idle_for(Duration::from_secs(0)));
+        assert!(!activity.idle_for(Duration::from_secs(60)));
+    }
+}
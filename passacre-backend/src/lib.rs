@@ -7,6 +7,7 @@
 #![cfg_attr(test, plugin(fnconcat))]
 
 extern crate capnp;
+extern crate capnp_rpc;
 #[macro_use] extern crate gj;
 extern crate libc;
 extern crate ramp;
@@ -37,6 +38,8 @@ pub mod rpc;
 mod deps;
 mod multibase;
 mod passacre;
+mod word_cache;
 pub use ::error::PassacreError;
 pub use ::passacre::{Algorithm, Kdf, PassacreGenerator, SCRYPT_BUFFER_SIZE};
-pub use ::multibase::{Base, MultiBase};
+pub use ::multibase::{Base, MultiBase, WordList};
+pub use ::word_cache::WordListCache;
@@ -4,9 +4,12 @@
  */
 
 use std::borrow::Cow;
+use std::cmp::Ordering;
 use std::collections::BTreeMap;
-use std::io::BufRead;
-use std::{fs, io, path, str};
+use std::io::{BufRead, Read};
+use std::os::unix::io::AsRawFd;
+use std::rc::Rc;
+use std::{fs, io, path, ptr, slice, str};
 
 use ramp::Int;
 
@@ -36,6 +39,160 @@ fn factorial(n: usize) -> Int {
         |acc, i| acc * Int::from(i))
 }
 
+const COMPILED_WORDS_MAGIC: &'static [u8] = b"passacre-words\0\0";
+
+fn u64_of_le_bytes(bytes: &[u8]) -> u64 {
+    bytes.iter().rev().fold(0, |acc, b| (acc << 8) | (*b as u64))
+}
+
+/// A read-only memory mapping of a whole file.
+struct Mmap {
+    ptr: *mut ::libc::c_void,
+    len: usize,
+}
+
+impl Mmap {
+    fn of_file(file: &fs::File) -> PassacreResult<Mmap> {
+        let len = file.metadata()?.len();
+        if len == 0 || len > usize::max_value() as u64 {
+            fail!(UserError);
+        }
+        let len = len as usize;
+        let ptr = unsafe {
+            ::libc::mmap(ptr::null_mut(), len, ::libc::PROT_READ, ::libc::MAP_PRIVATE,
+                         file.as_raw_fd(), 0)
+        };
+        if ptr == ::libc::MAP_FAILED {
+            fail!(io::Error::last_os_error());
+        }
+        Ok(Mmap { ptr: ptr, len: len })
+    }
+
+    fn as_slice(&self) -> &[u8] {
+        unsafe { slice::from_raw_parts(self.ptr as *const u8, self.len) }
+    }
+}
+
+impl Drop for Mmap {
+    fn drop(&mut self) {
+        unsafe { ::libc::munmap(self.ptr, self.len) };
+    }
+}
+
+/// A word list compiled by `passacre words compile`, read in place.
+///
+/// The file is memory-mapped, and only its header is checked when it's
+/// opened; each word is checked when it's looked up. Like every cached word
+/// list, a compiled one should be replaced rather than rewritten in place.
+pub struct CompiledWords {
+    mmap: Mmap,
+    count: usize,
+    table: usize,
+    blob: usize,
+}
+
+impl CompiledWords {
+    fn of_file(file: &fs::File) -> PassacreResult<CompiledWords> {
+        let mmap = Mmap::of_file(file)?;
+        let table = COMPILED_WORDS_MAGIC.len() + 8;
+        let (count, blob) = {
+            let data = mmap.as_slice();
+            if data.len() < table || !data.starts_with(COMPILED_WORDS_MAGIC) {
+                fail!(UserError);
+            }
+            let count = u64_of_le_bytes(&data[table - 8..table]);
+            if count >= ((data.len() - table) / 8) as u64 {
+                fail!(UserError);
+            }
+            (count as usize, table + (count as usize + 1) * 8)
+        };
+        Ok(CompiledWords {
+            mmap: mmap,
+            count: count,
+            table: table,
+            blob: blob,
+        })
+    }
+
+    fn get(&self, i: usize) -> PassacreResult<&str> {
+        if i >= self.count {
+            fail!(UserError);
+        }
+        let data = self.mmap.as_slice();
+        let offset = |j: usize| {
+            let at = self.table + j * 8;
+            u64_of_le_bytes(&data[at..at + 8])
+        };
+        let (start, end) = (offset(i), offset(i + 1));
+        if start > end || end > (data.len() - self.blob) as u64 {
+            fail!(UserError);
+        }
+        match str::from_utf8(&data[self.blob + start as usize..self.blob + end as usize]) {
+            Ok(s) => Ok(s),
+            _ => fail!(UserError),
+        }
+    }
+}
+
+/// A word list: either read line by line, or compiled.
+pub enum WordList {
+    Lines(Vec<String>),
+    Compiled(CompiledWords),
+}
+
+impl WordList {
+    pub fn len(&self) -> usize {
+        match self {
+            &WordList::Lines(ref words) => words.len(),
+            &WordList::Compiled(ref words) => words.count,
+        }
+    }
+
+    pub fn get(&self, i: usize) -> PassacreResult<&str> {
+        match self {
+            &WordList::Lines(ref words) => match words.get(i) {
+                Some(s) => Ok(s.as_str()),
+                None => fail!(UserError),
+            },
+            &WordList::Compiled(ref words) => words.get(i),
+        }
+    }
+}
+
+impl PartialEq for WordList {
+    fn eq(&self, other: &WordList) -> bool {
+        self.cmp(other) == Ordering::Equal
+    }
+}
+
+impl Eq for WordList {}
+
+impl PartialOrd for WordList {
+    fn partial_cmp(&self, other: &WordList) -> Option<Ordering> {
+        Some(self.cmp(other))
+    }
+}
+
+impl Ord for WordList {
+    fn cmp(&self, other: &WordList) -> Ordering {
+        (0..self.len()).map(|i| self.get(i).ok())
+            .cmp((0..other.len()).map(|i| other.get(i).ok()))
+    }
+}
+
+/// Read a word list from a file with one word per line, or from a compiled
+/// word list, which is memory-mapped instead of read.
+pub fn read_words_from_path(path: &path::Path) -> PassacreResult<WordList> {
+    let mut infile = fs::File::open(path)?;
+    let mut head = Vec::with_capacity(COMPILED_WORDS_MAGIC.len());
+    (&mut infile).take(COMPILED_WORDS_MAGIC.len() as u64).read_to_end(&mut head)?;
+    if head == COMPILED_WORDS_MAGIC {
+        return Ok(WordList::Compiled(CompiledWords::of_file(&infile)?));
+    }
+    let reader = io::BufReader::new(io::Cursor::new(head).chain(infile));
+    Ok(WordList::Lines(reader.lines().collect::<io::Result<Vec<String>>>()?))
+}
+
 fn length_one_string(c: char) -> String {
     let mut ret = String::with_capacity(c.len_utf8());
     ret.push(c);
@@ -75,12 +232,12 @@ impl Base {
 
 #[derive(Clone, PartialEq, Eq, PartialOrd, Ord)]
 struct Words {
-    words: Vec<String>,
+    words: Rc<WordList>,
     length: Int,
 }
 
 impl Words {
-    fn new(words: Vec<String>) -> Words {
+    fn new(words: Rc<WordList>) -> Words {
         let length = Int::from(words.len());
         Words {
             words: words,
@@ -172,6 +329,10 @@ impl MultiBase {
     }
 
     pub fn set_words(&mut self, words: Vec<String>) -> PassacreResult<()> {
+        self.set_shared_words(Rc::new(WordList::Lines(words)))
+    }
+
+    pub fn set_shared_words(&mut self, words: Rc<WordList>) -> PassacreResult<()> {
         if self.words.is_some() {
             fail!(UserError);
         }
@@ -180,9 +341,8 @@ impl MultiBase {
     }
 
     pub fn load_words_from_path(&mut self, path: &path::Path) -> PassacreResult<()> {
-        let infile = fs::File::open(path)?;
-        let lines = io::BufReader::new(infile).lines().collect::<io::Result<Vec<String>>>()?;
-        self.set_words(lines)
+        let words = read_words_from_path(path)?;
+        self.set_shared_words(Rc::new(words))
     }
 
     fn bases_ref_vec(&self) -> Vec<(&Base, &Int, usize)> {
@@ -211,7 +371,7 @@ impl MultiBase {
                 &Base::Characters(ref cs) => borrow_string(&cs[usize::from(&d)]),
                 &Base::Words => {
                     match &self.words {
-                        &Some(ref w) => borrow_string(&w.words[usize::from(&d)]),
+                        &Some(ref w) => Cow::Borrowed(w.words.get(usize::from(&d))?),
                         &None => fail!(UserError),
                     }
                 },
@@ -251,8 +411,12 @@ mod tests {
 
     use ramp::Int;
 
+    use std::fs;
+    use std::io::Write;
+    use std::path::PathBuf;
+
     use error::PassacreErrorKind::*;
-    use super::{Base, MultiBase, length_one_string};
+    use super::{Base, MultiBase, length_one_string, read_words_from_path};
 
     #[test]
     fn test_no_words_base_without_words() {
@@ -260,6 +424,46 @@ mod tests {
         assert_eq!(b.add_base(Base::Words).unwrap_err().kind, UserError);
     }
 
+    fn write_words(name: &str, contents: &[u8]) -> PathBuf {
+        let path = ::std::env::temp_dir().join(name);
+        fs::File::create(&path).unwrap().write_all(contents).unwrap();
+        path
+    }
+
+    const COMPILED_SPAM_EGGS: &'static [u8] = b"passacre-words\0\0\x02\0\0\0\0\0\0\0\
+        \0\0\0\0\0\0\0\0\x04\0\0\0\0\0\0\0\x08\0\0\0\0\0\0\0spameggs";
+
+    #[test]
+    fn test_read_compiled_words() {
+        let path = write_words("passacre-multibase-compiled", COMPILED_SPAM_EGGS);
+        let words = read_words_from_path(&path).unwrap();
+        assert_eq!(words.len(), 2);
+        assert_eq!(words.get(0).unwrap(), "spam");
+        assert_eq!(words.get(1).unwrap(), "eggs");
+        assert_eq!(words.get(2).unwrap_err().kind, UserError);
+        let mut b = MultiBase::new();
+        b.load_words_from_path(&path).unwrap();
+        b.add_base(Base::Words).unwrap();
+        assert_eq!(b.encode(Int::from(1)).unwrap(), "eggs");
+        fs::remove_file(&path).unwrap();
+    }
+
+    #[test]
+    fn test_read_truncated_compiled_words() {
+        let path = write_words(
+            "passacre-multibase-truncated", &COMPILED_SPAM_EGGS[..COMPILED_SPAM_EGGS.len() - 16]);
+        assert_eq!(read_words_from_path(&path).err().unwrap().kind, UserError);
+        fs::remove_file(&path).unwrap();
+    }
+
+    #[test]
+    fn test_read_plain_words() {
+        let path = write_words("passacre-multibase-plain", b"spam\neggs\n");
+        let words = read_words_from_path(&path).unwrap();
+        assert_eq!((words.len(), words.get(1).unwrap()), (2, "eggs"));
+        fs::remove_file(&path).unwrap();
+    }
+
     macro_rules! multibase_tests {
         ($constructor:ident,
          $max_value:expr,
@@ -75,6 +75,7 @@ pub enum Kdf {
         r: u32,
         p: u32,
     },
+    Precomputed(Vec<u8>),
 }
 
 impl Kdf {
@@ -84,27 +85,54 @@ impl Kdf {
         }
     }
 
-    pub fn derive(&mut self, username: &[u8], password: &[u8]) -> PassacreResult<Vec<u8>> {
+    /// Run `f` on the KDF's output for `username` and `password`.
+    ///
+    /// The output is only ever borrowed: precomputed output isn't copied, and
+    /// scrypt's output is zeroed as soon as `f` returns.
+    pub fn with_output<F, T>(&mut self, username: &[u8], password: &[u8], f: F) -> PassacreResult<T>
+        where F: FnOnce(&[u8]) -> PassacreResult<T>
+    {
         match self {
             &mut Kdf::Scrypt { n, r, p } => {
                 testing_fail!(n == 99 && r == 99 && p == 99, ScryptError);
                 let mut scrypt_result = vec![0u8; SCRYPT_BUFFER_SIZE];
-                {
-                    decompose!(username);
-                    decompose!(password);
-                    decompose!(mut scrypt_result);
-                    check_eq!(0, ScryptError,
-                              unsafe {
-                                  ::deps::crypto_scrypt(password.0, password.1, username.0, username.1,
-                                                        n, r, p, scrypt_result.0, scrypt_result.1)
-                              });
-                }
-                Ok(scrypt_result)
-            }
+                let ret = scrypt_into(n, r, p, username, password, &mut scrypt_result)
+                    .and_then(|()| f(&scrypt_result[..]));
+                wipe(&mut scrypt_result[..]);
+                ret
+            },
+            &mut Kdf::Precomputed(ref output) => f(&output[..]),
         }
     }
 }
 
+fn scrypt_into(n: u64, r: u32, p: u32, username: &[u8], password: &[u8],
+               scrypt_result: &mut [u8]) -> PassacreResult<()> {
+    decompose!(username);
+    decompose!(password);
+    decompose!(mut scrypt_result);
+    check_eq!(0, ScryptError,
+              unsafe {
+                  ::deps::crypto_scrypt(password.0, password.1, username.0, username.1,
+                                        n, r, p, scrypt_result.0, scrypt_result.1)
+              });
+    Ok(())
+}
+
+/// Overwrite key material with zeros in a way that won't be optimized out.
+pub fn wipe(bytes: &mut [u8]) {
+    for b in bytes.iter_mut() {
+        unsafe { ::std::ptr::write_volatile(b, 0) };
+    }
+}
+
+impl Drop for Kdf {
+    fn drop(&mut self) {
+        if let &mut Kdf::Precomputed(ref mut output) = self {
+            wipe(&mut output[..]);
+        }
+    }
+}
 
 const SKEIN_512_BLOCK_BYTES: usize = 64;
 
@@ -215,9 +243,10 @@ impl PassacreGenerator {
             State::Initialized | State::KdfSelected => (),
             _ => fail!(UserError),
         }
-        if self.kdf.is_some() {
-            let derived = try!(self.kdf.as_mut().unwrap().derive(username, password));
-            try!(self.absorb(&derived[..]));
+        if let Some(mut kdf) = self.kdf.take() {
+            // Dropping the KDF at the end of this block wipes precomputed
+            // output too.
+            try!(kdf.with_output(username, password, |derived| self.absorb(derived)));
         } else {
             if !username.is_empty() {
                 try!(self.absorb(username));
@@ -330,3 +359,66 @@ impl Rng for PassacreGenerator {
             | ((ret[3] as u32) << 24)
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::{Algorithm, Kdf, PassacreGenerator, wipe};
+
+    // scrypt of "passacre" with "user" as the salt, at N=16, r=1, p=1.
+    const SCRYPT_OUTPUT: &'static str = concat!(
+        "833cbee7f6ec132449e8fa9dbcef87cd18d358a23c21f18d5ee722e7dcf3f731",
+        "780ff92b73972033151f67df7f32f56339ddd46f075957e016000bda1f202aac");
+
+    fn hex(bytes: &[u8]) -> String {
+        bytes.iter().map(|b| format!("{:02x}", b)).collect()
+    }
+
+    fn scrypt_output() -> Vec<u8> {
+        Kdf::new_scrypt(16, 1, 1).with_output(b"user", b"passacre", |o| Ok(o.to_vec())).unwrap()
+    }
+
+    fn generate(algorithm: u32, kdf: Kdf) -> String {
+        let mut gen = PassacreGenerator::new(Algorithm::of_c_uint(algorithm).unwrap()).unwrap();
+        gen.use_kdf(kdf).unwrap();
+        gen.absorb_username_password_site(b"user", b"passacre", b"example.com").unwrap();
+        gen.absorb_null_rounds(1).unwrap();
+        let mut output = [0u8; 32];
+        gen.squeeze(&mut output).unwrap();
+        hex(&output)
+    }
+
+    #[test]
+    fn test_wipe() {
+        let mut bytes = vec![1u8, 2, 3];
+        wipe(&mut bytes[..]);
+        assert_eq!(bytes, vec![0, 0, 0]);
+    }
+
+    #[test]
+    fn test_scrypt_output() {
+        assert_eq!(hex(&scrypt_output()), SCRYPT_OUTPUT);
+    }
+
+    #[test]
+    fn test_precomputed_output_is_borrowed() {
+        let output = scrypt_output();
+        let ptr = output.as_ptr();
+        let mut kdf = Kdf::Precomputed(output);
+        let seen = kdf.with_output(b"", b"", |o| Ok((o.as_ptr(), hex(o)))).unwrap();
+        assert_eq!(seen, (ptr, SCRYPT_OUTPUT.to_owned()));
+    }
+
+    #[test]
+    fn test_precomputed_matches_scrypt() {
+        // The same output as the pure-python backend's.
+        let expected = [
+            "aa73479c698a1fbbd89ec821d2d61d9d8cfb6505e34886c2618be212c003ba26",
+            "dc0e9f2b639ad9665b6d239219c780a1e12719aa367224a81f6f8be63a76410b",
+        ];
+        for (algorithm, expected) in expected.iter().enumerate() {
+            let algorithm = algorithm as u32;
+            assert_eq!(generate(algorithm, Kdf::new_scrypt(16, 1, 1)), *expected);
+            assert_eq!(generate(algorithm, Kdf::Precomputed(scrypt_output())), *expected);
+        }
+    }
+}
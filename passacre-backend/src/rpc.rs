@@ -1,18 +1,38 @@
+use std::cell::RefCell;
+use std::path::Path;
+use std::rc::Rc;
+
 use capnp::capability::Promise;
 use capnp;
 
 use super::error::PassacreResult;
 use super::multibase::{Base, MultiBase};
-use super::passacre_capnp::{derivation_parameters, deriver, schema, schema_utils, toplevel};
+use super::passacre_capnp::{
+    compiled_schema, derivation_parameters, deriver, key_deriver, schema, schema_compiler,
+    schema_utils, toplevel, user_input, word_list_cache};
 use super::passacre::{Algorithm, Kdf, PassacreGenerator};
+use super::word_cache::WordListCache;
 
-pub struct StandardToplevel;
+/// The backend's capability. Clones share one word list cache, so a cache
+/// created once per process lasts for every connection the process serves.
+#[derive(Clone)]
+pub struct StandardToplevel {
+    words: Rc<RefCell<WordListCache>>,
+}
+
+impl StandardToplevel {
+    pub fn new() -> StandardToplevel {
+        StandardToplevel {
+            words: Rc::new(RefCell::new(WordListCache::new())),
+        }
+    }
+}
 
 impl deriver::Server for StandardToplevel {
     fn derive(&mut self,
               params: deriver::DeriveParams,
               mut results: deriver::DeriveResults) -> Promise<(), capnp::Error> {
-        let output = match derive(&params) {
+        let output = match derive(&params, &self.words) {
             Ok(v) => v,
             Err(e) => return Promise::err(e.into()),
         };
@@ -21,13 +41,17 @@ impl deriver::Server for StandardToplevel {
     }
 }
 
-fn derive(params: &deriver::DeriveParams) -> PassacreResult<String> {
+fn derive(params: &deriver::DeriveParams, words: &RefCell<WordListCache>) -> PassacreResult<String> {
     let params = params.get()?;
     let site = params.get_site()?;
-    let derivation = site.get_derivation()?;
-    let input = params.get_user_input()?;
-    let mut gen = generator_of_parameters(&derivation)?;
-    let mb = multibase_of_schema(&site.get_schema()?)?;
+    let mb = multibase_of_schema(&site.get_schema()?, words)?;
+    derive_with_multibase(&site.get_derivation()?, &params.get_user_input()?, &mb)
+}
+
+fn derive_with_multibase(derivation: &derivation_parameters::Reader,
+                         input: &user_input::Reader,
+                         mb: &MultiBase) -> PassacreResult<String> {
+    let mut gen = generator_of_parameters(derivation)?;
     let mut nulls = derivation.get_increment();
     use super::passacre_capnp::derivation_parameters::kdf::Which::*;
     match derivation.get_kdf().which()? {
@@ -40,6 +64,8 @@ fn derive(params: &deriver::DeriveParams) -> PassacreResult<String> {
                 p: s.get_p(),
             })?
         },
+        // The generator's copy is wiped when the generator is dropped.
+        Precomputed(d) => gen.use_kdf(Kdf::Precomputed(d?.to_vec()))?,
     };
     gen.absorb_username_password_site(
         input.get_username()?.as_bytes(),
@@ -62,7 +88,7 @@ impl schema_utils::Server for StandardToplevel {
     fn entropy_bits(&mut self,
                     params: schema_utils::EntropyBitsParams,
                     mut results: schema_utils::EntropyBitsResults) -> Promise<(), capnp::Error> {
-        let mb = match multibase_of_schema(&pry!(pry!(params.get()).get_schema())) {
+        let mb = match multibase_of_schema(&pry!(pry!(params.get()).get_schema()), &self.words) {
             Ok(v) => v,
             Err(e) => return Promise::err(e.into()),
         };
@@ -71,7 +97,7 @@ impl schema_utils::Server for StandardToplevel {
     }
 }
 
-fn multibase_of_schema(schema: &schema::Reader) -> PassacreResult<MultiBase> {
+fn multibase_of_schema(schema: &schema::Reader, words: &RefCell<WordListCache>) -> PassacreResult<MultiBase> {
     let mut ret = MultiBase::new();
     let mut loaded_words = false;
     for i in schema.get_value()?.iter() {
@@ -85,7 +111,10 @@ fn multibase_of_schema(schema: &schema::Reader) -> PassacreResult<MultiBase> {
                 if !loaded_words {
                     use super::passacre_capnp::word_list::source::Which::*;
                     match schema.get_words()?.get_source().which()? {
-                        FilePath(s) => ret.load_words_from_path(::std::path::Path::new(s?))?,
+                        FilePath(s) => {
+                            let cached = words.borrow_mut().get(Path::new(s?))?;
+                            ret.set_shared_words(cached)?
+                        },
                         _ => fail!(super::error::PassacreErrorKind::UserError),
                     }
                     loaded_words = true;
@@ -93,7 +122,7 @@ fn multibase_of_schema(schema: &schema::Reader) -> PassacreResult<MultiBase> {
                 Base::Words
             },
             Separator(s) => Base::Separator(s?.into()),
-            Subschema(s) => Base::NestedBase(multibase_of_schema(&s?)?),
+            Subschema(s) => Base::NestedBase(multibase_of_schema(&s?, words)?),
         };
         for _ in 1..i.get_repeat() {
             ret.add_base(b.clone())?;
@@ -106,4 +135,115 @@ fn multibase_of_schema(schema: &schema::Reader) -> PassacreResult<MultiBase> {
     Ok(ret)
 }
 
+impl word_list_cache::Server for StandardToplevel {
+    fn preload_words(&mut self,
+                     params: word_list_cache::PreloadWordsParams,
+                     mut results: word_list_cache::PreloadWordsResults) -> Promise<(), capnp::Error> {
+        let path = pry!(pry!(params.get()).get_path());
+        let words = match self.words.borrow_mut().get(Path::new(path)) {
+            Ok(v) => v,
+            Err(e) => return Promise::err(e.into()),
+        };
+        results.get().set_count(words.len() as u64);
+        Promise::ok(())
+    }
+
+    fn invalidate_words(&mut self,
+                        params: word_list_cache::InvalidateWordsParams,
+                        _: word_list_cache::InvalidateWordsResults) -> Promise<(), capnp::Error> {
+        let path = pry!(pry!(params.get()).get_path());
+        let mut words = self.words.borrow_mut();
+        if path.is_empty() {
+            words.clear();
+        } else {
+            words.invalidate(Path::new(path));
+        }
+        Promise::ok(())
+    }
+
+    fn word_cache_stats(&mut self,
+                        _: word_list_cache::WordCacheStatsParams,
+                        mut results: word_list_cache::WordCacheStatsResults) -> Promise<(), capnp::Error> {
+        let words = self.words.borrow();
+        let mut stats = results.get().init_stats();
+        stats.set_hits(words.hits());
+        stats.set_misses(words.misses());
+        stats.set_entries(words.len() as u64);
+        Promise::ok(())
+    }
+}
+
+impl schema_compiler::Server for StandardToplevel {
+    fn compile_schema(&mut self,
+                      params: schema_compiler::CompileSchemaParams,
+                      mut results: schema_compiler::CompileSchemaResults) -> Promise<(), capnp::Error> {
+        let mb = match multibase_of_schema(&pry!(pry!(params.get()).get_schema()), &self.words) {
+            Ok(v) => v,
+            Err(e) => return Promise::err(e.into()),
+        };
+        let compiled = compiled_schema::ToClient::new(CompiledSchema { mb: mb })
+            .from_server::<::capnp_rpc::Server>();
+        results.get().set_compiled(compiled);
+        Promise::ok(())
+    }
+}
+
+/// A schema turned into a `MultiBase` once, for any number of derivations.
+///
+/// Any word list is read when the schema is compiled, so later changes to the
+/// words file aren't seen by an existing handle. Clients drop the handles
+/// using a word list when they invalidate it, and compile the schema again.
+pub struct CompiledSchema {
+    mb: MultiBase,
+}
+
+impl compiled_schema::Server for CompiledSchema {
+    fn derive(&mut self,
+              params: compiled_schema::DeriveParams,
+              mut results: compiled_schema::DeriveResults) -> Promise<(), capnp::Error> {
+        let output = match derive_compiled(&params, &self.mb) {
+            Ok(v) => v,
+            Err(e) => return Promise::err(e.into()),
+        };
+        results.get().set_derived(&output);
+        Promise::ok(())
+    }
+
+    fn entropy_bits(&mut self,
+                    _: compiled_schema::EntropyBitsParams,
+                    mut results: compiled_schema::EntropyBitsResults) -> Promise<(), capnp::Error> {
+        results.get().set_bits(self.mb.entropy_bits() as u64);
+        Promise::ok(())
+    }
+}
+
+fn derive_compiled(params: &compiled_schema::DeriveParams, mb: &MultiBase) -> PassacreResult<String> {
+    let params = params.get()?;
+    derive_with_multibase(&params.get_derivation()?, &params.get_user_input()?, mb)
+}
+
+impl key_deriver::Server for StandardToplevel {
+    fn derive_key(&mut self,
+                  params: key_deriver::DeriveKeyParams,
+                  mut results: key_deriver::DeriveKeyResults) -> Promise<(), capnp::Error> {
+        match derive_key(&params, &mut results) {
+            Ok(()) => Promise::ok(()),
+            Err(e) => Promise::err(e.into()),
+        }
+    }
+}
+
+fn derive_key(params: &key_deriver::DeriveKeyParams,
+              results: &mut key_deriver::DeriveKeyResults) -> PassacreResult<()> {
+    let params = params.get()?;
+    let s = params.get_scrypt()?;
+    let mut kdf = Kdf::new_scrypt(s.get_n(), s.get_r(), s.get_p());
+    // The key is copied straight from scrypt's buffer, which is then wiped,
+    // into the response.
+    kdf.with_output(params.get_username()?.as_bytes(), params.get_password()?.as_bytes(), |key| {
+        results.get().set_key(key);
+        Ok(())
+    })
+}
+
 impl toplevel::Server for StandardToplevel {}
@@ -0,0 +1,188 @@
+/*
+ * Copyright (c) Aaron Gallagher <_@habnab.it>
+ * See COPYING for details.
+ */
+
+use std::collections::HashMap;
+use std::path::{Path, PathBuf};
+use std::rc::Rc;
+use std::time::SystemTime;
+use std::fs;
+
+use error::PassacreResult;
+use multibase::{WordList, read_words_from_path};
+
+
+#[derive(Clone, PartialEq, Eq, Debug)]
+struct FileKey {
+    modified: SystemTime,
+    len: u64,
+}
+
+impl FileKey {
+    fn of_path(path: &Path) -> PassacreResult<FileKey> {
+        let metadata = fs::metadata(path)?;
+        Ok(FileKey {
+            modified: metadata.modified()?,
+            len: metadata.len(),
+        })
+    }
+}
+
+struct CachedWords {
+    key: FileKey,
+    words: Rc<WordList>,
+}
+
+/// Word lists read from files, kept until the file they came from changes.
+///
+/// A cached list is only reused while its file's modification time and size
+/// are the same as when it was read, so edits to a word list are picked up
+/// without having to invalidate it explicitly. Compiled word lists are
+/// memory-mapped rather than read, so caching one costs next to nothing.
+pub struct WordListCache {
+    entries: HashMap<PathBuf, CachedWords>,
+    hits: u64,
+    misses: u64,
+}
+
+impl WordListCache {
+    pub fn new() -> WordListCache {
+        WordListCache {
+            entries: HashMap::new(),
+            hits: 0,
+            misses: 0,
+        }
+    }
+
+    pub fn get(&mut self, path: &Path) -> PassacreResult<Rc<WordList>> {
+        let key = FileKey::of_path(path)?;
+        if let Some(cached) = self.entries.get(path) {
+            if cached.key == key {
+                self.hits += 1;
+                return Ok(cached.words.clone());
+            }
+        }
+        self.misses += 1;
+        let words = Rc::new(read_words_from_path(path)?);
+        self.entries.insert(path.to_path_buf(), CachedWords {
+            key: key,
+            words: words.clone(),
+        });
+        Ok(words)
+    }
+
+    pub fn invalidate(&mut self, path: &Path) {
+        self.entries.remove(path);
+    }
+
+    pub fn clear(&mut self) {
+        self.entries.clear();
+    }
+
+    pub fn hits(&self) -> u64 {
+        self.hits
+    }
+
+    pub fn misses(&self) -> u64 {
+        self.misses
+    }
+
+    pub fn len(&self) -> usize {
+        self.entries.len()
+    }
+}
+
+
+#[cfg(test)]
+mod tests {
+    use std::fs;
+    use std::io::Write;
+    use std::path::PathBuf;
+
+    use multibase::WordList;
+    use super::WordListCache;
+
+    fn write_words(name: &str, contents: &str) -> PathBuf {
+        let path = ::std::env::temp_dir().join(name);
+        fs::File::create(&path).unwrap().write_all(contents.as_bytes()).unwrap();
+        path
+    }
+
+    fn words_of(words: &WordList) -> Vec<&str> {
+        (0..words.len()).map(|i| words.get(i).unwrap()).collect()
+    }
+
+    #[test]
+    fn test_cache_hits_and_misses() {
+        let path = write_words("passacre-word-cache-hits", "spam\neggs\n");
+        let mut cache = WordListCache::new();
+        assert_eq!(words_of(&cache.get(&path).unwrap()), vec!["spam", "eggs"]);
+        assert_eq!(words_of(&cache.get(&path).unwrap()), vec!["spam", "eggs"]);
+        assert_eq!((cache.hits(), cache.misses(), cache.len()), (1, 1, 1));
+        fs::remove_file(&path).unwrap();
+    }
+
+    #[test]
+    fn test_cache_rereads_changed_file() {
+        let path = write_words("passacre-word-cache-changed", "spam\neggs\n");
+        let mut cache = WordListCache::new();
+        cache.get(&path).unwrap();
+        write_words("passacre-word-cache-changed", "spam\neggs\nsausage\n");
+        assert_eq!(cache.get(&path).unwrap().len(), 3);
+        assert_eq!((cache.hits(), cache.misses()), (0, 2));
+        fs::remove_file(&path).unwrap();
+    }
+
+    #[test]
+    fn test_cache_reads_compiled_words() {
+        let path = write_words(
+            "passacre-word-cache-compiled",
+            concat!("passacre-words\0\0", "\x02\0\0\0\0\0\0\0",
+                    "\0\0\0\0\0\0\0\0", "\x04\0\0\0\0\0\0\0", "\x08\0\0\0\0\0\0\0",
+                    "spameggs"));
+        let mut cache = WordListCache::new();
+        match *cache.get(&path).unwrap() {
+            WordList::Compiled(_) => (),
+            _ => panic!("compiled word list read line by line"),
+        }
+        assert_eq!(words_of(&cache.get(&path).unwrap()), vec!["spam", "eggs"]);
+        fs::remove_file(&path).unwrap();
+    }
+
+    #[test]
+    fn test_cache_invalidate() {
+        let path = write_words("passacre-word-cache-invalidate", "spam\n");
+        let mut cache = WordListCache::new();
+        cache.get(&path).unwrap();
+        cache.invalidate(&path);
+        assert_eq!(cache.len(), 0);
+        cache.get(&path).unwrap();
+        assert_eq!((cache.hits(), cache.misses()), (0, 2));
+        fs::remove_file(&path).unwrap();
+    }
+
+    #[test]
+    fn test_cache_clear() {
+        let spam = write_words("passacre-word-cache-clear-spam", "spam\n");
+        let eggs = write_words("passacre-word-cache-clear-eggs", "eggs\n");
+        let mut cache = WordListCache::new();
+        cache.get(&spam).unwrap();
+        cache.get(&eggs).unwrap();
+        assert_eq!(cache.len(), 2);
+        cache.clear();
+        assert_eq!(cache.len(), 0);
+        assert_eq!(words_of(&cache.get(&eggs).unwrap()), vec!["eggs"]);
+        assert_eq!((cache.hits(), cache.misses()), (0, 3));
+        fs::remove_file(&spam).unwrap();
+        fs::remove_file(&eggs).unwrap();
+    }
+
+    #[test]
+    fn test_cache_missing_file() {
+        let path = ::std::env::temp_dir().join("passacre-word-cache-nonextant");
+        let mut cache = WordListCache::new();
+        assert!(cache.get(&path).is_err());
+        assert_eq!((cache.hits(), cache.misses(), cache.len()), (0, 0, 0));
+    }
+}
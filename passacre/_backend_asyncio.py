@@ -0,0 +1,90 @@
+# Copyright (c) Aaron Gallagher <_@habnab.it>
+# See COPYING for details.
+
+import asyncio
+
+import capnp
+
+from passacre._backend_capnp import SubprocessClient
+
+
+class AsyncioClient(object):
+    """Drive a backend process from an asyncio event loop.
+
+    ``derive`` and ``entropy_bits`` are coroutines taking the same arguments
+    as the methods of ``SubprocessClient``. Instead of blocking in ``wait()``,
+    requests are sent straight away and the capnp event loop is pumped
+    whenever the backend's socket becomes readable, so any number of
+    derivations can be in flight on one loop at once. Calls go through the
+    same compiled schema handles as the wrapped client's. This needs a pycapnp
+    old enough to still have ``capnp.poll_once`` and ``then`` on promises.
+
+    At most ``max_in_flight`` requests are sent to the backend at a time;
+    further calls wait for a slot to free up. Cancelling a call cancels its
+    request.
+    """
+
+    _watched_fd = None
+    _in_flight = None
+
+    def __init__(self, loop=None, max_in_flight=64, client=None):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        if client is None:
+            client = SubprocessClient()
+        self._loop = loop
+        self._client = client
+        self._max_in_flight = max_in_flight
+
+    def _semaphore(self):
+        # Before Python 3.10, a semaphore is bound to the loop returned by
+        # get_event_loop() when it's created, so it's only created once this
+        # client's loop is running.
+        if self._in_flight is None:
+            self._in_flight = asyncio.Semaphore(self._max_in_flight)
+        return self._in_flight
+
+    def _watched_client(self):
+        capnp_client = self._client._active_client
+        fd = self._client._sock.fileno()
+        if fd != self._watched_fd:
+            self.close()
+            self._loop.add_reader(fd, capnp.poll_once)
+            self._watched_fd = fd
+        return capnp_client
+
+    async def _call(self, schema, method, args, extract):
+        async with self._semaphore():
+            future = self._loop.create_future()
+
+            def resolved(result):
+                if not future.done():
+                    future.set_result(extract(result))
+
+            def failed(exc):
+                if not future.done():
+                    future.set_exception(exc)
+
+            promise = self._client._call_compiled(
+                self._watched_client(), schema, method, *args).then(resolved, failed)
+            capnp.poll_once()
+            try:
+                return await future
+            except asyncio.CancelledError:
+                promise.cancel()
+                raise
+
+    async def derive(self, site, user_input):
+        return await self._call(
+            site['schema'], 'derive', (site['derivation'], user_input),
+            lambda result: result.derived)
+
+    async def entropy_bits(self, schema):
+        return await self._call(
+            schema, 'entropyBits', (), lambda result: result.bits)
+
+    def close(self):
+        "Stop watching the backend's socket."
+        if self._watched_fd is not None:
+            self._loop.remove_reader(self._watched_fd)
+            self._watched_fd = None
@@ -1,6 +1,14 @@
 from contextlib import closing
+import errno
+import itertools
+import json
+import multiprocessing
 import os
+import select
 import socket
+import stat
+import tempfile
+import time
 
 import capnp
 
@@ -12,35 +20,362 @@ except ImportError:
     import subprocess
 
 
+def _word_list_paths(schema):
+    "Find the paths of the word lists used by a schema or any of its subschemas."
+    paths = set()
+    source = (schema.get('words') or {}).get('source') or {}
+    if 'filePath' in source:
+        paths.add(source['filePath'])
+    for base in schema.get('value', ()):
+        subschema = base.get('value', {}).get('subschema')
+        if subschema is not None:
+            paths.update(_word_list_paths(subschema))
+    return paths
+
+
+class _ForgetOnFailure(object):
+    """A call made through a cached compiled schema handle.
+
+    If the call fails, the handle is dropped from the cache, so that a schema
+    that failed to compile (for example, because its words file was missing)
+    is compiled again on its next use instead of failing for as long as the
+    connection lasts.
+    """
+
+    def __init__(self, promise, compiled_schemata, key, compiled):
+        self._promise = promise
+        self._compiled_schemata = compiled_schemata
+        self._key = key
+        self._compiled = compiled
+
+    def _forget(self):
+        if self._compiled_schemata.get(self._key) is self._compiled:
+            del self._compiled_schemata[self._key]
+
+    def wait(self):
+        try:
+            return self._promise.wait()
+        except Exception:
+            self._forget()
+            raise
+
+    def then(self, resolved, failed):
+        def forget_and_fail(exc):
+            self._forget()
+            return failed(exc)
+
+        return self._promise.then(resolved, forget_and_fail)
+
+
 class SubprocessClient(object):
-    _proc = _sock = None
+    _proc = _sock = _client = None
     _backend = 'passacre-backend-{0}-{4}'.format(*os.uname())
 
-    def _reconnect(self):
+    def _spawn(self):
         if self._sock is not None:
             self._sock.close()
         if self._proc is not None:
             self._proc.wait()
+        self._client = None
         self._sock, remote = socket.socketpair()
         with closing(remote):
             with open(os.devnull, 'r+') as devnull:
                 self._proc = subprocess.Popen(
                     [self._backend, str(remote.fileno())],
                     stdin=devnull, pass_fds=[remote.fileno()])
+
+    def _bootstrap(self):
         self._sock_client = capnp.TwoPartyClient(self._sock)
         self._client = self._sock_client.bootstrap().cast_as(_passacre_capnp.Toplevel)
+        self._compiled_schemata = {}
+
+    def _compiled_schema(self, client, schema):
+        """Get a handle to ``schema`` as compiled by the backend.
+
+        Handles are cached by the schema's canonical JSON for as long as the
+        connection lasts, or until a call through them fails, so a schema
+        shared by many sites is only built once. Returns the cache key and the
+        handle.
+        The compileSchema call is pipelined: the first call using a handle
+        doesn't wait on a round trip of its own.
+        """
+
+        key = json.dumps(schema, sort_keys=True)
+        compiled = self._compiled_schemata.get(key)
+        if compiled is None:
+            compiled = self._compiled_schemata[key] = client.compileSchema(schema).compiled
+        return key, compiled
+
+    def _call_compiled(self, client, schema, method, *args):
+        key, compiled = self._compiled_schema(client, schema)
+        return _ForgetOnFailure(
+            getattr(compiled, method)(*args), self._compiled_schemata, key, compiled)
+
+    @property
+    def is_dead(self):
+        return self._proc is None or self._proc.poll() is not None
 
     @property
     def _active_client(self):
-        if self._proc is None or self._proc.poll() is not None:
-            self._reconnect()
+        if self.is_dead:
+            self._spawn()
+        if self._client is None:
+            self._bootstrap()
         return self._client
 
+    def prespawn(self):
+        """Start the backend ahead of its first use.
+
+        Only the process is started; the capnp connection is still set up by
+        the first call, so this is safe to run on another thread while the
+        calling thread does something else.
+        """
+
+        if self.is_dead:
+            self._spawn()
+
+    def derive(self, site, user_input):
+        return self._send_derives([(site, user_input)])[0].wait().derived
+
+    def derive_many(self, requests):
+        """Derive a batch of passwords over a single connection.
+
+        ``requests`` is an iterable of ``(site, user_input)`` pairs, as would be
+        passed to ``derive``. Every call is sent before any of them is waited
+        on, so the round trips are pipelined instead of being paid once per
+        password. Returns the derived passwords in the same order.
+        """
+
+        return [promise.wait().derived for promise in self._send_derives(requests)]
+
+    def _send_derives(self, requests):
+        client = self._active_client
+        return [
+            self._call_compiled(client, site['schema'], 'derive', site['derivation'], user_input)
+            for site, user_input in requests]
+
+    def entropy_bits(self, schema):
+        client = self._active_client
+        return self._call_compiled(client, schema, 'entropyBits').wait().bits
+
+    def derive_key(self, username, password, scrypt):
+        "Run only the scrypt KDF of a derivation, returning its output."
+        return self._active_client.deriveKey(scrypt, username, password).wait().key
+
+    def preload_words(self, path):
+        """Read a word list into the backend's cache ahead of its first use.
+
+        Returns the number of words in the list.
+        """
+
+        return self._active_client.preloadWords(path).wait().count
+
+    def invalidate_words(self, path=None):
+        """Drop a word list from the backend's cache, or every list if no path is given.
+
+        Compiled schemata keep the words they were compiled with, so the
+        handles of those using the list are dropped too, and the schemata are
+        compiled again on their next use.
+        """
+
+        self._active_client.invalidateWords(path or '').wait()
+        for key in list(self._compiled_schemata):
+            if path is None or path in _word_list_paths(json.loads(key)):
+                del self._compiled_schemata[key]
+
+    def word_cache_stats(self):
+        """Count the backend's word list cache hits, misses and entries.
+
+        Returns a dict with ``hits``, ``misses`` and ``entries`` keys. The
+        counters cover the life of the backend process.
+        """
+
+        stats = self._active_client.wordCacheStats().wait().stats
+        return {'hits': stats.hits, 'misses': stats.misses, 'entries': stats.entries}
+
+
+def daemon_socket_path(environ=os.environ):
+    """Find the path of the current user's shared backend socket.
+
+    The socket lives in ``$XDG_RUNTIME_DIR`` if that's set, and otherwise in a
+    ``passacre-<uid>`` directory under the system's temporary directory. That
+    directory is created if needed and must be owned by the current user and
+    inaccessible to anyone else, since whatever listens on the socket is
+    handed passwords.
+    """
+
+    uid = os.getuid()
+    runtime_dir = environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir is None:
+        runtime_dir = os.path.join(tempfile.gettempdir(), 'passacre-%d' % (uid,))
+        try:
+            os.mkdir(runtime_dir, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    st = os.lstat(runtime_dir)
+    if (not stat.S_ISDIR(st.st_mode) or st.st_uid != uid
+            or st.st_mode & (stat.S_IRWXG | stat.S_IRWXO)):
+        raise ValueError('%r must be a directory only accessible by uid %d' % (runtime_dir, uid))
+    return os.path.join(runtime_dir, 'passacre-backend.sock')
+
+
+class DaemonClient(SubprocessClient):
+    """Connect to a backend shared between processes over a Unix socket.
+
+    If no backend is listening on ``socket_path`` (by default, the path from
+    ``daemon_socket_path``), one is started in its own session. It stays
+    alive for ``idle_timeout`` seconds after its last client disconnects, so
+    later runs only pay for a connect instead of a fork, exec and bootstrap.
+    """
+
+    connect_timeout = 5
+
+    def __init__(self, socket_path=None, idle_timeout=300):
+        self._socket_path = socket_path
+        self.idle_timeout = idle_timeout
+
+    @property
+    def socket_path(self):
+        if self._socket_path is None:
+            self._socket_path = daemon_socket_path()
+        return self._socket_path
+
+    @property
+    def is_dead(self):
+        if self._sock is None:
+            return True
+        readable, _, _ = select.select([self._sock], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return not self._sock.recv(1, socket.MSG_PEEK)
+        except socket.error:
+            return True
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except socket.error:
+            sock.close()
+            return None
+        return sock
+
+    def _spawn_daemon(self):
+        with open(os.devnull, 'r+') as devnull:
+            self._proc = subprocess.Popen(
+                [self._backend, '--listen', self.socket_path, str(self.idle_timeout)],
+                stdin=devnull, stdout=devnull, start_new_session=True)
+
+    def _spawn(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        self._client = None
+        sock = self._connect()
+        if sock is None:
+            self._spawn_daemon()
+            deadline = time.time() + self.connect_timeout
+            while sock is None:
+                # A daemon exits cleanly straight away if another one started
+                # at the same time, so keep waiting for that one to listen.
+                if self._proc.poll() not in (None, 0) or time.time() > deadline:
+                    raise RuntimeError(
+                        "couldn't start a backend listening on %r" % (self.socket_path,))
+                time.sleep(0.005)
+                sock = self._connect()
+        self._sock = sock
+
+
+class PooledClient(object):
+    """Spread derivations across a pool of backend processes.
+
+    ``size`` backend processes are started lazily, defaulting to one per CPU.
+    Single ``derive`` and ``entropy_bits`` calls are handed to the workers in
+    turn, while ``derive_many`` splits its batch across every worker at once so
+    that the derivations run in parallel. A worker whose process has died is
+    respawned the next time it's used, and a call that failed because its
+    worker died is retried once on the respawned process.
+
+    This has the same interface as ``SubprocessClient``, so it can be assigned
+    to ``default_client``.
+    """
+
+    def __init__(self, size=None, client_factory=SubprocessClient):
+        if size is None:
+            size = multiprocessing.cpu_count()
+        if size < 1:
+            raise ValueError('a pool needs at least one worker, not %r' % (size,))
+        self._workers = [client_factory() for _ in range(size)]
+        self._next_worker = itertools.cycle(self._workers)
+
+    def _call(self, method, *args):
+        worker = next(self._next_worker)
+        try:
+            return getattr(worker, method)(*args)
+        except capnp.KjException:
+            if not worker.is_dead:
+                raise
+            return getattr(worker, method)(*args)
+
     def derive(self, site, user_input):
-        return self._active_client.derive(site, user_input).wait().derived
+        return self._call('derive', site, user_input)
 
     def entropy_bits(self, schema):
-        return self._active_client.entropyBits(schema).wait().bits
+        return self._call('entropy_bits', schema)
+
+    def derive_key(self, username, password, scrypt):
+        return self._call('derive_key', username, password, scrypt)
+
+    def prespawn(self):
+        for worker in self._workers:
+            worker.prespawn()
+
+    def preload_words(self, path):
+        counts = [worker.preload_words(path) for worker in self._workers]
+        return counts[0]
+
+    def invalidate_words(self, path=None):
+        for worker in self._workers:
+            worker.invalidate_words(path)
+
+    def word_cache_stats(self):
+        "Sum the word list cache counters of every worker."
+        ret = {'hits': 0, 'misses': 0, 'entries': 0}
+        for worker in self._workers:
+            for k, v in worker.word_cache_stats().items():
+                ret[k] += v
+        return ret
+
+    def derive_many(self, requests):
+        """Derive a batch of passwords across every worker in the pool.
+
+        This takes and returns the same values as
+        ``SubprocessClient.derive_many``. A batch smaller than the pool only
+        uses, and so only starts, as many workers as it has requests.
+        """
+
+        requests = list(requests)
+        workers = self._workers[:len(requests)]
+        n_workers = len(workers)
+        chunks = [requests[e::n_workers] for e in range(n_workers)]
+        promises = [
+            worker._send_derives(chunk)
+            for worker, chunk in zip(workers, chunks)]
+        results = [None] * len(requests)
+        for e, (worker, chunk, chunk_promises) in enumerate(zip(workers, chunks, promises)):
+            try:
+                derived = [promise.wait().derived for promise in chunk_promises]
+            except capnp.KjException:
+                if not worker.is_dead:
+                    raise
+                derived = worker.derive_many(chunk)
+            results[e::n_workers] = derived
+        return results
 
 
-default_client = SubprocessClient()
+if os.environ.get('PASSACRE_BACKEND_DAEMON'):
+    default_client = DaemonClient()
+else:
+    default_client = SubprocessClient()
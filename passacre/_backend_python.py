@@ -0,0 +1,386 @@
+# Copyright (c) Aaron Gallagher <_@habnab.it>
+# See COPYING for details.
+
+"""An in-process reimplementation of the backend's derivation.
+
+This reproduces ``passacre-backend`` exactly, so ``PythonClient`` can be
+passed as the ``client`` to ``passacre.generator.generate``. It's only fast
+enough for low iteration counts, but it avoids both the backend process and
+the round trips to it.
+"""
+
+import hashlib
+import os
+import struct
+
+from passacre.multibase import SchemaMultiBase
+from passacre.words import CompiledWords, compiled_words_magic
+
+
+_MASK = (1 << 64) - 1
+
+
+def _rotl(x, n):
+    return ((x << n) | (x >> (64 - n))) & _MASK
+
+
+def _keccak_round_constants():
+    ret = []
+    lfsr = 1
+    for _ in range(24):
+        rc = 0
+        for j in range(7):
+            if lfsr & 1:
+                rc |= 1 << ((1 << j) - 1)
+            lfsr <<= 1
+            if lfsr & 0x100:
+                lfsr ^= 0x171
+        ret.append(rc)
+    return ret
+
+
+def _keccak_rho_pi():
+    ret = []
+    x, y = 1, 0
+    for t in range(24):
+        ret.append((x + 5 * y, y + 5 * ((2 * x + 3 * y) % 5), ((t + 1) * (t + 2) // 2) % 64))
+        x, y = y, (2 * x + 3 * y) % 5
+    return ret
+
+
+_KECCAK_ROUND_CONSTANTS = _keccak_round_constants()
+_KECCAK_RHO_PI = _keccak_rho_pi()
+_KECCAK_ROWS = [(x, (x + 1) % 5, (x + 2) % 5) for x in range(5)]
+
+
+def _keccak_f(A):
+    B = [0] * 25
+    for rc in _KECCAK_ROUND_CONSTANTS:
+        C = [A[x] ^ A[x + 5] ^ A[x + 10] ^ A[x + 15] ^ A[x + 20] for x in range(5)]
+        D = [C[(x - 1) % 5] ^ _rotl(C[(x + 1) % 5], 1) for x in range(5)]
+        for x in range(5):
+            d = D[x]
+            for y in range(0, 25, 5):
+                A[x + y] ^= d
+        B[0] = A[0]
+        for src, dst, rot in _KECCAK_RHO_PI:
+            B[dst] = _rotl(A[src], rot)
+        for y in range(0, 25, 5):
+            for x, x1, x2 in _KECCAK_ROWS:
+                A[y + x] = B[y + x] ^ (~B[y + x1] & B[y + x2])
+        A[0] ^= rc
+
+
+class _KeccakSponge(object):
+    "Keccak with a 64-bit rate and 1536-bit capacity, one lane at a time."
+
+    def __init__(self):
+        self.state = [0] * 25
+        self.queue = bytearray()
+        self.squeezing = False
+        self.output = bytearray()
+
+    def absorb(self, data):
+        queue = self.queue
+        queue.extend(data)
+        n_blocks = len(queue) // 8
+        state = self.state
+        for lane in struct.unpack_from('<%dQ' % (n_blocks,), bytes(queue)):
+            state[0] ^= lane
+            _keccak_f(state)
+        del queue[:n_blocks * 8]
+
+    def absorb_nulls(self, n_bytes):
+        if self.queue:
+            fill = min(n_bytes, 8 - len(self.queue))
+            self.absorb(b'\0' * fill)
+            n_bytes -= fill
+        n_blocks, n_bytes = divmod(n_bytes, 8)
+        state = self.state
+        for _ in range(n_blocks):
+            _keccak_f(state)
+        self.queue.extend(b'\0' * n_bytes)
+
+    def squeeze(self, n_bytes):
+        state = self.state
+        if not self.squeezing:
+            block = self.queue + b'\x01' + b'\0' * (7 - len(self.queue))
+            block[7] |= 0x80
+            state[0] ^= struct.unpack('<Q', bytes(block))[0]
+            _keccak_f(state)
+            self.output = bytearray(struct.pack('<Q', state[0]))
+            self.squeezing = True
+        ret = bytearray()
+        while len(ret) < n_bytes:
+            if not self.output:
+                _keccak_f(state)
+                self.output = bytearray(struct.pack('<Q', state[0]))
+            taken = self.output[:n_bytes - len(ret)]
+            del self.output[:len(taken)]
+            ret.extend(taken)
+        return ret
+
+
+_SKEIN_KEY_SCHEDULE_CONSTANT = 0x1BD11BDAA9FC1A22
+_THREEFISH_512_ROTATIONS = [
+    (46, 36, 19, 37),
+    (33, 27, 14, 42),
+    (17, 49, 36, 39),
+    (44, 9, 54, 56),
+    (39, 30, 34, 24),
+    (13, 50, 10, 17),
+    (25, 29, 39, 43),
+    (8, 35, 56, 22),
+]
+_THREEFISH_512_PERMUTATION = (2, 1, 4, 7, 6, 5, 0, 3)
+
+
+def _threefish_512(key, tweak, block):
+    "Encrypt eight 64-bit words with Threefish-512."
+    k = list(key)
+    parity = _SKEIN_KEY_SCHEDULE_CONSTANT
+    for word in key:
+        parity ^= word
+    k.append(parity)
+    t = [tweak[0], tweak[1], tweak[0] ^ tweak[1]]
+    v = list(block)
+    for d in range(72):
+        if d % 4 == 0:
+            s = d // 4
+            v = [(v[i] + k[(s + i) % 9]) & _MASK for i in range(8)]
+            v[5] = (v[5] + t[s % 3]) & _MASK
+            v[6] = (v[6] + t[(s + 1) % 3]) & _MASK
+            v[7] = (v[7] + s) & _MASK
+        rotations = _THREEFISH_512_ROTATIONS[d % 8]
+        for j in range(4):
+            x0 = (v[2 * j] + v[2 * j + 1]) & _MASK
+            v[2 * j] = x0
+            v[2 * j + 1] = _rotl(v[2 * j + 1], rotations[j]) ^ x0
+        v = [v[i] for i in _THREEFISH_512_PERMUTATION]
+    v = [(v[i] + k[(18 + i) % 9]) & _MASK for i in range(8)]
+    v[5] = (v[5] + t[0]) & _MASK
+    v[6] = (v[6] + t[1]) & _MASK
+    v[7] = (v[7] + 18) & _MASK
+    return v
+
+
+def _words_of_bytes(b):
+    return list(struct.unpack('<8Q', bytes(b)))
+
+
+def _bytes_of_words(words):
+    return bytearray(struct.pack('<8Q', *words))
+
+
+_SKEIN_TYPE_CONFIG = 4
+_SKEIN_TYPE_MESSAGE = 48
+_SKEIN_TYPE_OUTPUT = 63
+_SKEIN_FIRST = 1 << 62
+_SKEIN_FINAL = 1 << 63
+
+
+class _SkeinUbi(object):
+    "Skein-512's unique block iteration, buffering the last block until the end."
+
+    def __init__(self, chain, type_):
+        self.chain = chain
+        self.position = 0
+        self.flags = _SKEIN_FIRST | (type_ << 56)
+        self.buffer = bytearray()
+
+    def _process(self, block, final=False):
+        self.position += len(block)
+        flags = self.flags | (_SKEIN_FINAL if final else 0)
+        plain = _words_of_bytes(block + b'\0' * (64 - len(block)))
+        cipher = _threefish_512(self.chain, (self.position, flags), plain)
+        self.chain = [c ^ p for c, p in zip(cipher, plain)]
+        self.flags &= ~_SKEIN_FIRST
+
+    def update(self, data):
+        self.buffer.extend(data)
+        n_blocks = (len(self.buffer) - 1) // 64
+        for e in range(n_blocks):
+            self._process(self.buffer[e * 64:(e + 1) * 64])
+        del self.buffer[:n_blocks * 64]
+
+    def final(self):
+        self._process(self.buffer, final=True)
+        return self.chain
+
+
+def _skein_512_initial_chain():
+    config = bytearray(struct.pack('<IHHQ16x', 0x33414853, 1, 0, 512))
+    ubi = _SkeinUbi([0] * 8, _SKEIN_TYPE_CONFIG)
+    ubi.update(config)
+    return ubi.final()
+
+
+_SKEIN_512_INITIAL_CHAIN = _skein_512_initial_chain()
+_PRNG_TWEAK = (0, 0x3f << 56)
+
+
+class _SkeinPrng(object):
+    "Skein-512 as a hash, then as the backend's Threefish-512 PRNG."
+
+    def __init__(self):
+        self.message = _SkeinUbi(_SKEIN_512_INITIAL_CHAIN, _SKEIN_TYPE_MESSAGE)
+        self.message.update(b'\0' * 64)
+        self.key = None
+        self.output = bytearray()
+
+    def absorb(self, data):
+        self.message.update(data)
+
+    def absorb_nulls(self, n_bytes):
+        self.message.update(b'\0' * n_bytes)
+
+    def _start_squeezing(self):
+        output = _SkeinUbi(self.message.final(), _SKEIN_TYPE_OUTPUT)
+        output.update(b'\0' * 8)
+        self.key = output.final()
+
+    def squeeze(self, n_bytes):
+        if self.key is None:
+            self._start_squeezing()
+        ret = bytearray()
+        while len(ret) < n_bytes:
+            if not self.output:
+                next_key = _threefish_512(self.key, _PRNG_TWEAK, [0] * 8)
+                self.output = _bytes_of_words(
+                    _threefish_512(self.key, _PRNG_TWEAK, [1] + [0] * 7))
+                self.key = next_key
+            taken = self.output[:n_bytes - len(ret)]
+            del self.output[:len(taken)]
+            ret.extend(taken)
+        ret.reverse()
+        return ret
+
+
+_generators = {
+    'keccak': _KeccakSponge,
+    'skein': _SkeinPrng,
+}
+
+
+def scrypt(username, password, n, r, p):
+    "The backend's scrypt KDF, with the username as the salt."
+    kdf = getattr(hashlib, 'scrypt', None)
+    if kdf is None:
+        raise NotImplementedError('scrypt requires hashlib.scrypt (Python 3.6+ with OpenSSL 1.1+)')
+    return kdf(password, salt=username, n=n, r=r, p=p, dklen=64, maxmem=256 * r * (n + p + 1))
+
+
+def read_words(path):
+    """Read a word list the same way the backend does: one word per line.
+
+    Compiled word lists are memory-mapped instead of read.
+    """
+
+    with open(path, 'rb') as infile:
+        if infile.read(len(compiled_words_magic)) == compiled_words_magic:
+            return CompiledWords.open(path)
+        infile.seek(0)
+        lines = infile.read().decode('utf-8').split('\n')
+    if not lines[-1]:
+        lines.pop()
+    return [line[:-1] if line.endswith('\r') else line for line in lines]
+
+
+class WordListCache(object):
+    """Word lists read by ``read_words``, kept until their file changes.
+
+    Like the backend's cache, a list is reused only while its file's
+    modification time and size are unchanged.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self.hits = self.misses = 0
+
+    def get(self, path):
+        st = os.stat(path)
+        key = st.st_mtime, st.st_size
+        cached = self._entries.get(path)
+        if cached is not None and cached[0] == key:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        words = read_words(path)
+        self._entries[path] = key, words
+        return words
+
+    def invalidate(self, path=None):
+        if path:
+            self._entries.pop(path, None)
+        else:
+            self._entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
+def _int_of_bytes(b):
+    ret = 0
+    for c in bytearray(b):
+        ret = (ret << 8) | c
+    return ret
+
+
+class PythonClient(object):
+    """Derive passwords in-process.
+
+    This has the same interface as ``SubprocessClient``.
+    """
+
+    def __init__(self):
+        self._words = WordListCache()
+
+    def _multibase(self, schema):
+        return SchemaMultiBase(schema, self._words.get)
+
+    def prespawn(self):
+        pass
+
+    def derive(self, site, user_input):
+        derivation = site['derivation']
+        gen = _generators[derivation['method']]()
+        mb = self._multibase(site['schema'])
+        kdf = derivation.get('kdf', {})
+        nulls = derivation.get('increment', 0) + kdf.get('nulls', 0)
+        username = user_input.get('username', '').encode('utf-8')
+        password = user_input['password'].encode('utf-8')
+        if 'precomputed' in kdf:
+            gen.absorb(kdf['precomputed'])
+        elif 'scrypt' in kdf:
+            s = kdf['scrypt']
+            gen.absorb(scrypt(username, password, s['n'], s['r'], s['p']))
+        else:
+            if username:
+                gen.absorb(username + b':')
+            gen.absorb(password)
+        gen.absorb(b':' + user_input['sitename'].encode('utf-8'))
+        gen.absorb_nulls(1024 * nulls)
+
+        required_bytes = mb.required_bytes()
+        while True:
+            n = _int_of_bytes(gen.squeeze(required_bytes))
+            if n <= mb.max_encodable_value:
+                return mb.encode(n)
+
+    def derive_many(self, requests):
+        return [self.derive(site, user_input) for site, user_input in requests]
+
+    def entropy_bits(self, schema):
+        return self._multibase(schema).entropy_bits()
+
+    def derive_key(self, username, password, s):
+        return scrypt(username.encode('utf-8'), password.encode('utf-8'), s['n'], s['r'], s['p'])
+
+    def preload_words(self, path):
+        return len(self._words.get(path))
+
+    def invalidate_words(self, path=None):
+        self._words.invalidate(path)
+
+    def word_cache_stats(self):
+        return self._words.stats()
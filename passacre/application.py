@@ -3,22 +3,27 @@
 
 from __future__ import unicode_literals, print_function
 
-from passacre._backend_capnp import default_client
 from passacre.compat import input, argparse, python_2_encode
-from passacre.config import load as load_config, SqliteConfig
-from passacre.generator import hash_site
+from passacre._backend_python import read_words
+from passacre.config import load as load_config, write_compiled_config, SqliteConfig
+from passacre.generator import KdfSession, hash_site, hash_sites
 from passacre.jsonmini import unparse as jdumps
-from passacre.schema import multibase_of_schema
+from passacre.schema import entropy_bits_of_multibase, multibase_of_schema
 from passacre.util import reify, dotify, nested_get, jloads, errormark
-from passacre import __version__, completion, features, yaml2sqlite
+from passacre.words import compile_words
+from passacre import __version__, _backend_capnp, completion, features, yaml2sqlite
 
 import atexit
 import collections
+import csv
 from getpass import getpass
+import itertools
+import json
 import math
 import operator
 import os
 import sys
+import threading
 import time
 import traceback
 
@@ -48,6 +53,62 @@ def prompt_password(confirm=False, getpass=getpass):
         raise ValueError("passwords don't match")
     return password
 
+class BackgroundTask(object):
+    """Run a function on a daemon thread.
+
+    ``result`` waits for the function to finish, then returns its value or
+    re-raises its exception. ``duration`` is how long the function ran and
+    ``waited`` is how long ``result`` blocked.
+    """
+
+    _value = _exception = None
+    waited = 0
+
+    def __init__(self, f, *a, **kw):
+        self._thread = threading.Thread(target=self._run, args=(f, a, kw))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, f, a, kw):
+        start = time.time()
+        try:
+            self._value = f(*a, **kw)
+        except BaseException as e:
+            self._exception = e
+        finally:
+            self.duration = time.time() - start
+
+    def result(self):
+        start = time.time()
+        self._thread.join()
+        self.waited += time.time() - start
+        if self._exception is not None:
+            raise self._exception
+        return self._value
+
+class DeferredConfirmation(object):
+    """Whether to confirm the password, decided the first time it's tested.
+
+    This lets the password prompt start before the config that can force
+    confirmation has finished loading; the truth value is only needed once the
+    password has been entered.
+    """
+
+    _value = None
+
+    def __init__(self, confirm, config_task):
+        self.confirm = confirm
+        self.config_task = config_task
+
+    def __bool__(self):
+        if self._value is None:
+            self._value = bool(
+                self.confirm
+                or self.config_task.result().global_config.get('always-confirm-passwords'))
+        return self._value
+
+    __nonzero__ = __bool__
+
 def is_likely_hashed_site(site):
     return len(site) == 48 and '.' not in site
 
@@ -60,6 +121,25 @@ def maybe_load_json(val):
     except ValueError:
         return val
 
+def csv_records(infile):
+    """Read site records from a CSV file with a header row.
+
+    Empty cells are left out. Cells other than the site and schema names are
+    parsed as jsonmini where possible; the schema is only parsed if it's a
+    list, so that it can be a schema value or a schema name.
+    """
+
+    for row in csv.DictReader(infile):
+        yield dict((k, csv_value(k, v)) for k, v in row.items() if v)
+
+def csv_value(k, v):
+    if k in ('site', 'schema-name'):
+        return v
+    value = maybe_load_json(v)
+    if k == 'schema' and not isinstance(value, list):
+        return v
+    return value
+
 def transform_args(transformations):
     def deco(f):
         def wrap(self, args):
@@ -93,7 +173,21 @@ class Passacre(object):
     _load_config = staticmethod(load_config)
     environ = os.environ
 
-    _config = _config_file = None
+    _config = _config_file = _config_mode = None
+    yaml_cache = True
+
+    # Actions that never modify the config, so it can be opened read-only.
+    _read_only_actions = set("""
+    generate
+    entropy
+    site
+    site_hash
+    schema
+    info
+    compile_config
+    words
+    words_compile
+    """.split())
 
     _subcommands = {
         'init': "initialize an sqlite config",
@@ -107,6 +201,7 @@ class Passacre(object):
             'set-name': "change a site's domain",
             'hash': "hash a site's name",
             'hash-all': "hash all non-hashed sites",
+            'import': "add sites in bulk from a CSV or JSON lines file",
         }),
         'schema': ("actions on schemata", {
             'add': "add a schema",
@@ -115,6 +210,10 @@ class Passacre(object):
             'set-name': "change a schema's name",
         }),
         'config': "view/change global configuration",
+        'compile-config': "compile the config for fast read-only lookups",
+        'words': ("actions on word lists", {
+            'compile': "compile a word list for fast loading",
+        }),
         'info': "information about the passacre environment",
     }
 
@@ -134,7 +233,8 @@ class Passacre(object):
                 '~/.passacre.yaml',
             ], 'rb', expanduser)
         with config_fobj:
-            self._config = self._load_config(config_fobj)
+            self._config = self._load_config(
+                config_fobj, mode=self._config_mode, cache=self.yaml_cache)
 
     def prompt_password(self, confirm):
         if self.config.global_config.get('always-confirm-passwords'):
@@ -159,7 +259,10 @@ class Passacre(object):
         curs.executescript(schema)
 
         if args.from_yaml:
-            yaml2sqlite.main(args.from_yaml.name, path)
+            progress = None
+            if self.verbose:
+                progress = lambda n_sites: sys.stderr.write('converted %d sites\n' % (n_sites,))
+            yaml2sqlite.main(args.from_yaml.name, path, progress=progress)
         else:
             config = SqliteConfig()
             config._db = db
@@ -191,14 +294,39 @@ class Passacre(object):
         ('override_config', jloads),
     ])
     def generate_action(self, args):
-        "Generate a password."
+        """Generate a password.
+
+        Loading the config, looking up the site and starting the backend all
+        happen in the background while the password is being typed.
+        """
+
+        config = BackgroundTask(lambda: self.config)
+        backend = BackgroundTask(_backend_capnp.default_client.prespawn)
         if args.site is None:
             args.site = self.prompt('Site: ')
-        password = self.prompt_password(args.confirm)
+        site_config = BackgroundTask(
+            lambda: config.result().get_site_without_password(args.site))
+        password = self._prompt_password(DeferredConfirmation(args.confirm, config))
+        prompted = time.time()
+        site_config.result()
+        backend.result()
+        if self.verbose:
+            self._report_startup(time.time() - prompted, [
+                ('loading config', config),
+                ('looking up site', site_config),
+                ('starting backend', backend),
+            ])
         password = self.config.generate_for_site(
-            args.username, password, args.site, args.override_config)
+            args.username, password, args.site, args.override_config,
+            config=site_config.result())
         self._process_generated_password(password, args)
 
+    def _report_startup(self, waited, tasks):
+        hidden = sum(task.duration for _, task in tasks) - waited
+        sys.stderr.write('startup: %s; %.1fms hidden behind the password prompt\n' % (
+            ', '.join('%s %.1fms' % (name, task.duration * 1000) for name, task in tasks),
+            max(hidden, 0) * 1000))
+
     def _process_generated_password(self, password, args):
         if getattr(args, 'copy', False):  # since the argument might not exist
             sys.stderr.write('password copied.\n')
@@ -227,18 +355,17 @@ class Passacre(object):
         """
 
         if args.schema:
-            entropy = [
-                (schema_name, self.config.multibase_of_schema(schema))
-                for schema_name, schema in self.config.get_all_schemata().items()
-            ]
+            entropy = list(self.config.get_all_schemata().items())
         else:
-            default_site = self.config.get_site('default')
-            entropy = [
-                (site, site_config['multibase'])
-                for site, site_config in self.config.get_all_sites().items()
-                if site_config['schema'] != default_site['schema'] or site == 'default'
-            ]
-        entropy = [(site, default_client.entropy_bits(schema)) for site, schema in entropy]
+            default_schema = self.config.get_site('default')['schema']
+            entropy = []
+            for schema, sites in self.config.get_sites_by_schema():
+                if schema != default_schema:
+                    entropy.extend((site, schema) for site in sites)
+                elif 'default' in sites:
+                    entropy.append(('default', schema))
+        entropy_bits = self._schema_entropy_bits()
+        entropy = [(site, entropy_bits(schema)) for site, schema in entropy]
         entropy.sort(key=operator.itemgetter(1, 0), reverse=True)
         entropy[:0] = [('schema' if args.schema else 'site', 'entropy (bits)'), ('', '')]
         max_site_len, max_bits_len = [
@@ -250,17 +377,39 @@ class Passacre(object):
             print('%*s   %*s' % (-max_site_len, site, max_bits_len, bits))
 
 
+    def _schema_entropy_bits(self):
+        """Make a function computing a schema's entropy, memoized by schema.
+
+        Entropy is computed locally, except for schemata with words, which
+        need the backend to read the words file.
+        """
+
+        memo = {}
+
+        def entropy_bits(schema):
+            key = json.dumps(schema, sort_keys=True)
+            bits = memo.get(key)
+            if bits is None:
+                multibase = self.config.multibase_of_schema(schema)
+                bits = entropy_bits_of_multibase(multibase)
+                if bits is None:
+                    bits = _backend_capnp.default_client.entropy_bits(multibase)
+                memo[key] = bits
+            return bits
+
+        return entropy_bits
+
     def site_args(self, subparser):
         subparser.add_argument('--by-schema', action='store_true',
                                help='list sites organized by schema')
         subparser.add_argument('--omit-hashed', action='store_true',
                                help="don't list hashed sites")
 
-        hash_group = subparser.add_argument_group('for {add,remove,set-schema}')
+        hash_group = subparser.add_argument_group('for {add,remove,set-schema,import}')
         hash_group.add_argument('-a', '--hashed', action='store_true',
                                 help='hash the site name')
 
-        confirm_group = subparser.add_argument_group('for {add,remove,set-schema,hash-all}')
+        confirm_group = subparser.add_argument_group('for {add,remove,set-schema,hash-all,import}')
         confirm_group.add_argument('-c', '--confirm', action='store_true',
                                    help='confirm prompted password')
 
@@ -331,19 +480,102 @@ class Passacre(object):
         ).completer = completion.HashMethodsCompleter()
         subparser.add_argument('-c', '--confirm', action='store_true',
                                help='confirm prompted password')
+        subparser.add_argument('-j', '--jobs', type=int,
+                               help='how many backend processes to hash with '
+                               '(default: one per CPU)')
+
+    hash_all_chunk_size = 1000
 
     @needs_mutable_config
     def site_hash_all_action(self, args):
-        """Hash all non-hashed sites."""
+        """Hash all non-hashed sites.
+
+        The sites are hashed in parallel across backend processes, and then
+        renamed in a single transaction.
+        """
 
         password = self.prompt_password(args.confirm)
         config = self.config.site_hashing
         if args.method is not None:
             config['method'] = args.method
-        for site in self.config.get_all_sites():
-            if site == 'default' or is_likely_hashed_site(site):
-                continue
-            self.config.rename_site(site, hash_site(password, site, config))
+        sites = [
+            site for site in self.config.get_all_sites()
+            if site != 'default' and not is_likely_hashed_site(site)]
+        client = self._hashing_client(args.jobs)
+
+        start = time.time()
+        hashed = []
+        with KdfSession(client) as kdf_session:
+            for e in range(0, len(sites), self.hash_all_chunk_size):
+                chunk = sites[e:e + self.hash_all_chunk_size]
+                hashed.extend(hash_sites(
+                    password, chunk, config, client=client, kdf_session=kdf_session))
+                self._report_hash_progress(len(hashed), len(sites), time.time() - start)
+        self.config.rename_sites(zip(sites, hashed))
+        if sites:
+            sys.stderr.write('renamed %d sites in %.1fs\n' % (len(sites), time.time() - start))
+
+    def _hashing_client(self, jobs):
+        if jobs == 1:
+            return _backend_capnp.default_client
+        return _backend_capnp.PooledClient(jobs)
+
+    def _report_hash_progress(self, done, total, elapsed):
+        sys.stderr.write('hashed %d/%d sites (%.0f sites/s)\n' % (
+            done, total, done / elapsed if elapsed else 0))
+
+
+    def site_import_args(self, subparser):
+        subparser.add_argument('infile', type=argparse.FileType('r'),
+                               help="the file to import from, or '-' for stdin")
+        subparser.add_argument('-f', '--format', choices=['csv', 'jsonl'],
+                               help='the format of the file (default: csv if '
+                               'the file name ends in .csv, otherwise jsonl)')
+        subparser.add_argument('-j', '--jobs', type=int,
+                               help='how many backend processes to hash with '
+                               '(default: one per CPU)')
+
+    @needs_mutable_config
+    def site_import_action(self, args):
+        """Add or replace sites in bulk.
+
+        Each record has a site name, and optionally a schema and config
+        values. CSV files have a header row naming the columns; JSON lines
+        files have one object per line. See ``SqliteConfig.bulk_load`` for
+        the keys. Everything is loaded in a single transaction.
+        """
+
+        format = args.format
+        if format is None:
+            format = 'csv' if args.infile.name.endswith('.csv') else 'jsonl'
+        if format == 'csv':
+            records = csv_records(args.infile)
+        else:
+            records = (json.loads(line) for line in args.infile if line.strip())
+        if args.hashed or self.config.site_hashing['enabled'] == 'always':
+            password = self.prompt_password(args.confirm)
+            records = self._hash_records(password, records, self._hashing_client(args.jobs))
+        start = time.time()
+        with args.infile:
+            n_sites = self.config.bulk_load(records)
+        sys.stderr.write('imported %d sites in %.1fs\n' % (n_sites, time.time() - start))
+
+    def _hash_records(self, password, records, client):
+        config = self.config.site_hashing
+        records = iter(records)
+        with KdfSession(client) as kdf_session:
+            while True:
+                chunk = list(itertools.islice(records, self.hash_all_chunk_size))
+                if not chunk:
+                    break
+                to_hash = [record for record in chunk if record['site'] != 'default']
+                hashed = hash_sites(
+                    password, [record['site'] for record in to_hash], config,
+                    client=client, kdf_session=kdf_session)
+                for record, site in zip(to_hash, hashed):
+                    record['site'] = site
+                for record in chunk:
+                    yield record
 
 
     def site_add_args(self, subparser):
@@ -501,6 +733,52 @@ class Passacre(object):
     site_config_action = config_action
 
 
+    def compile_config_args(self, subparser):
+        subparser.add_argument('outfile', type=argparse.FileType('wb'),
+                               help='where to write the compiled config')
+
+    def compile_config_action(self, args):
+        """Compile the config for fast read-only lookups.
+
+        Every site is filled out ahead of time and written in a format that is
+        memory-mapped and read in place. The compiled config can be used like
+        any other, but can't be modified.
+        """
+
+        with args.outfile:
+            write_compiled_config(self.config, args.outfile)
+
+
+    def words_action(self, args):
+        "Display the config's word list and how many words it has."
+
+        path = self.config.word_list_path
+        if path is None:
+            print('no words-file is configured')
+            return
+        print('%s: %d words' % (path, len(read_words(path))))
+
+
+    def words_compile_args(self, subparser):
+        subparser.add_argument('infile', type=argparse.FileType('rb'),
+                               help='the word list to compile'
+        ).completer = completion.FilesCompleter()
+        subparser.add_argument('outfile', type=argparse.FileType('wb'),
+                               help='where to write the compiled word list')
+
+    def words_compile_action(self, args):
+        """Compile a word list for fast loading.
+
+        The compiled word list can be used as the ``words-file`` anywhere a
+        word list can. It's memory-mapped and each word is only read when it's
+        used, so even very large word lists cost almost nothing to load.
+        """
+
+        with args.infile, args.outfile:
+            n_words = compile_words(args.infile, args.outfile)
+        if self.verbose:
+            print('compiled %d words' % (n_words,), file=sys.stderr)
+
     def info_action(self, args):
         print('passacre version ' + __version__)
         print()
@@ -580,6 +858,7 @@ class Passacre(object):
         if not action:
             parser.print_help()
             sys.exit(2)
+        self._config_mode = 'read' if action in self._read_only_actions else 'write'
         action_method = getattr(self, action + '_action')
         sys.excepthook = self.excepthook
         try:
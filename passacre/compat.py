@@ -17,6 +17,7 @@ if sys.version_info < (3,):  # pragma: nocover
         return s
     iterbytes = functools.partial(map, ord)
     hexlify = binascii.hexlify
+    from urllib import pathname2url
 else:  # pragma: nocover
     input = input
     unichr = chr
@@ -29,6 +30,7 @@ else:  # pragma: nocover
     iterbytes = iter
     def hexlify(s):
         return binascii.hexlify(s).decode()
+    from urllib.request import pathname2url
 
 
 import passacre._argparse as argparse
@@ -45,5 +47,5 @@ except ImportError:  # pragma: nocover
 
 __all__ = [
     'input', 'argparse', 'unichr', 'unicode', 'long', 'crochet_setup', 'wait_for_reactor',
-    'iterbytes', 'hexlify',
+    'iterbytes', 'hexlify', 'pathname2url',
 ]
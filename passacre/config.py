@@ -3,13 +3,19 @@
 
 from __future__ import unicode_literals, print_function
 
-from passacre.schema import multibase_of_schema
-from passacre.util import nested_set, jloads, jdumps, errormark
+from passacre.compat import pathname2url
+from passacre.schema import multibase_of_schema, string_types
+from passacre.util import LRUCache, nested_set, jloads, jdumps, errormark
 from passacre import features, generator
 
 import collections
+import contextlib
+import hashlib
+import itertools
 import json
+import operator
 import os
+import tempfile
 
 
 @errormark('verifying schema: {0!r}')
@@ -17,6 +23,11 @@ def verify_multibase_schema(schema):
     multibase_of_schema(schema)
 
 
+# Compiled multibases, shared between configs; see
+# ConfigBase.multibase_of_schema.
+multibase_cache = LRUCache(1024)
+
+
 global_config_options = set("""
 always-confirm-passwords
 method
@@ -33,9 +44,114 @@ iterations
 increment
 schema
 yubikey-slot
+inherits
 """.split())
 
 
+def inherits_of(values):
+    "The names of the sites a site's config values inherit from, in order."
+    inherits = values.get('inherits', [])
+    if isinstance(inherits, string_types):
+        return [inherits]
+    return inherits
+
+
+def find_inheritance_cycle(inherits):
+    """Find a cycle in a graph of site inheritance.
+
+    ``inherits`` maps site names to the names of the sites they inherit from.
+    Returns the sites in a cycle, starting and ending with the same site, or
+    ``None`` if there are no cycles.
+    """
+
+    done = set()
+    for start in inherits:
+        if start in done:
+            continue
+        path = []
+        on_path = set()
+        stack = [(start, iter(inherits.get(start, ())))]
+        path.append(start)
+        on_path.add(start)
+        while stack:
+            site, parents = stack[-1]
+            for parent in parents:
+                if parent in on_path:
+                    return path[path.index(parent):] + [parent]
+                if parent not in done:
+                    stack.append((parent, iter(inherits.get(parent, ()))))
+                    path.append(parent)
+                    on_path.add(parent)
+                    break
+            else:
+                stack.pop()
+                path.pop()
+                on_path.discard(site)
+                done.add(site)
+    return None
+
+
+def _inheritance_cycle_error(cycle):
+    return ValueError('sites inherit from each other in a cycle: %s' % (
+        ' -> '.join(cycle),))
+
+
+def _missing_parent_error(site, parent):
+    return ValueError('%r inherits from %r, which does not exist' % (site, parent))
+
+
+def check_inheritance(inherits, sites=None):
+    """Raise ``ValueError`` if a graph of site inheritance has a cycle.
+
+    If the names of every site are passed as ``sites``, also raise if a site
+    inherits from one that doesn't exist.
+    """
+
+    cycle = find_inheritance_cycle(inherits)
+    if cycle is not None:
+        raise _inheritance_cycle_error(cycle)
+    if sites is None:
+        return
+    for site, parents in inherits.items():
+        for parent in parents:
+            if parent not in sites:
+                raise _missing_parent_error(site, parent)
+
+
+def resolve_inherited(site, site_values, memo, dependents=None, _resolving=()):
+    """Merge a site's config values over those of the sites it inherits from.
+
+    ``site_values`` looks up a site's own config values, returning ``None`` for
+    sites that don't exist. Merged values are stored in ``memo``, so each site
+    is only merged once, and if ``dependents`` is passed, each site inherited
+    from is mapped there to the set of sites inheriting from it. Returns
+    ``None`` if ``site`` doesn't exist.
+    """
+
+    if site in memo:
+        return memo[site]
+    values = site_values(site)
+    if values is None:
+        return None
+    _resolving += site,
+    merged = {}
+    for parent in inherits_of(values):
+        if parent in _resolving:
+            raise _inheritance_cycle_error(
+                list(_resolving[_resolving.index(parent):]) + [parent])
+        parent_values = resolve_inherited(
+            parent, site_values, memo, dependents, _resolving)
+        if parent_values is None:
+            raise _missing_parent_error(site, parent)
+        merged.update(parent_values)
+        if dependents is not None:
+            dependents.setdefault(parent, set()).add(site)
+    merged.update(values)
+    merged.pop('inherits', None)
+    memo[site] = merged
+    return merged
+
+
 class ConfigBase(object):
     is_mutable_config = False
 
@@ -49,6 +165,38 @@ class ConfigBase(object):
         }
         self.global_config = {}
         self.word_list_path = None
+        self._inherited = {}
+        self._dependents = {}
+
+    def _inherited_values(self, site):
+        """Look up a site's config values, including those it inherits.
+
+        The merged values are memoized until ``_invalidate`` is called for the
+        site or a site it inherits from. Subclasses provide a site's own
+        values through ``_site_values``.
+        """
+
+        return resolve_inherited(site, self._site_values, self._inherited, self._dependents)
+
+    def _invalidate(self, site=None):
+        """Forget the merged config values of a site and every site inheriting
+        from it, or of every site if no site is given."""
+
+        if site is None:
+            self._inherited.clear()
+            self._dependents.clear()
+            return
+        stale = [site]
+        while stale:
+            site = stale.pop()
+            self._inherited.pop(site, None)
+            stale.extend(self._dependents.pop(site, ()))
+
+    def _config_of_values(self, values):
+        config = self.defaults.copy()
+        config.update(values)
+        self.fill_out_config(config)
+        return config
 
     def load_words_file(self, path):
         if path is None:
@@ -56,10 +204,22 @@ class ConfigBase(object):
         self.word_list_path = os.path.expanduser(path)
 
     def multibase_of_schema(self, schema):
-        ret = multibase_of_schema(schema)
-        if self.word_list_path is not None:
-            ret['words'] = {'source': {'filePath': self.word_list_path}}
-        return ret
+        """Compile a schema to a multibase, reusing a previous compilation.
+
+        Multibases are cached by the schema's canonical JSON and the words
+        file, and shared by every site with that schema, so they must not be
+        modified.
+        """
+
+        word_list_path = self.word_list_path
+
+        def compile():
+            ret = multibase_of_schema(schema)
+            if word_list_path is not None:
+                ret['words'] = {'source': {'filePath': word_list_path}}
+            return ret
+
+        return multibase_cache.get_or_create((jdumps(schema), word_list_path), compile)
 
     def fill_out_config(self, config):
         config['multibase'] = self.multibase_of_schema(config['schema'])
@@ -88,8 +248,33 @@ class ConfigBase(object):
             config = self.defaults
         return config
 
-    def generate_for_site(self, username, password, site, override=()):
-        config = self.get_site(site, password)
+    def get_sites_by_schema(self):
+        """Group every site by its schema.
+
+        Returns a list of ``(schema, site_names)`` pairs. Sites with the same
+        schema are usually, but not always, in the same group.
+        """
+
+        groups = {}
+        for site, config in self.get_all_sites().items():
+            key = json.dumps(config['schema'], sort_keys=True)
+            groups.setdefault(key, (config['schema'], []))[1].append(site)
+        return list(groups.values())
+
+    def get_site_without_password(self, site):
+        """Look up a site's config if that doesn't need the password.
+
+        Returns ``None`` if the site isn't found under its plain name, or if
+        site names are always hashed.
+        """
+
+        if self.site_hashing['enabled'] == 'always' and site != 'default':
+            return None
+        return self._get_site(site)
+
+    def generate_for_site(self, username, password, site, override=(), config=None):
+        if config is None:
+            config = self.get_site(site, password)
         if override:
             config.update(override)
             for k, v in list(config.items()):
@@ -99,30 +284,123 @@ class ConfigBase(object):
         return generator.generate(username, password, site, config)
 
 
+def yaml_loader(yaml):
+    "The fastest safe loader ``yaml`` has: libyaml's if it was built with it."
+    return getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def _yaml_cache_key(path, data):
+    st = os.stat(path)
+    return {
+        'mtime': st.st_mtime,
+        'size': st.st_size,
+        'sha256': hashlib.sha256(data).hexdigest(),
+    }
+
+
+def _read_yaml_cache(cache_path, key):
+    try:
+        with open(cache_path) as infile:
+            cached = json.load(infile)
+    except (EnvironmentError, ValueError):
+        return None
+    # Anything else in the cache file is treated as a miss, not an error.
+    if not (isinstance(cached, dict) and sorted(cached) == ['key', 'parsed']
+            and isinstance(cached['parsed'], dict)):
+        return None
+    if cached['key'] != key:
+        return None
+    return cached['parsed']
+
+
+def _has_only_string_keys(value):
+    if isinstance(value, dict):
+        return all(
+            isinstance(k, string_types) and _has_only_string_keys(v)
+            for k, v in value.items())
+    if isinstance(value, list):
+        return all(_has_only_string_keys(v) for v in value)
+    return True
+
+
+def _write_yaml_cache(cache_path, key, parsed):
+    # JSON would turn other mapping keys, like YAML's integers, into strings.
+    if not _has_only_string_keys(parsed):
+        return
+    try:
+        serialized = json.dumps({'key': key, 'parsed': parsed})
+    except (TypeError, ValueError):
+        # Something YAML can represent and JSON can't; don't cache it.
+        return
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            prefix='.' + os.path.basename(cache_path), dir=os.path.dirname(cache_path))
+        with os.fdopen(fd, 'w') as outfile:
+            outfile.write(serialized)
+        os.rename(tmp_path, cache_path)
+    except EnvironmentError:
+        pass
+
+
 class YAMLConfig(ConfigBase):
+    """A config stored in a YAML file.
+
+    The file is parsed with libyaml when it's available. If ``read`` is asked
+    to ``cache``, the parsed file is also kept as JSON next to it, in a file
+    with ``.cache`` appended to the name; it's used instead of the YAML as
+    long as the YAML file's mtime, size and SHA-256 are unchanged. Sites are
+    filled out the first time they're looked up.
+    """
+
     @features.yaml.check
-    def read(self, infile):
+    def read(self, infile, cache=False):
         "Load site configuration from a YAML file object."
-        import yaml
-        parsed = yaml.load(infile)
+        parsed = self._parse(infile, cache)
         sites = parsed.pop('sites', {})
-        self.set_defaults(sites.get('default', {}))
+        self._raw_sites = sites
+        self._sites = {}
+        check_inheritance(dict(
+            (site, inherits_of(values)) for site, values in sites.items()), sites)
+        self.set_defaults(self._inherited_values('default') or {})
         self.load_words_file(parsed.pop('words-file', None))
 
-        self.sites = {}
-        for site, additional_config in sites.items():
-            site_config = self.sites[site] = self.defaults.copy()
-            site_config.update(additional_config)
-            self.fill_out_config(site_config)
-
         self.site_hashing.update(parsed.pop('site-hashing', {}))
         self.global_config = parsed
 
+    def _parse(self, infile, cache):
+        import yaml
+        data = infile.read()
+        path = getattr(infile, 'name', None)
+        if not (cache and isinstance(path, string_types) and os.path.isfile(path)):
+            return yaml.load(data, Loader=yaml_loader(yaml))
+        key = _yaml_cache_key(path, data)
+        cache_path = path + '.cache'
+        parsed = _read_yaml_cache(cache_path, key)
+        if parsed is None:
+            parsed = yaml.load(data, Loader=yaml_loader(yaml))
+            _write_yaml_cache(cache_path, key, parsed)
+        return parsed
+
+    def _site_values(self, site):
+        return self._raw_sites.get(site)
+
     def _get_site(self, site, password=None):
-        return self.sites.get(site)
+        config = self._sites.get(site)
+        if config is None:
+            values = self._inherited_values(site)
+            if values is not None:
+                config = self._sites[site] = self._config_of_values(values)
+        return config
 
     def get_all_sites(self):
-        return self.sites
+        for site in self._raw_sites:
+            self._get_site(site)
+        return self._sites
+
+    @property
+    def sites(self):
+        "Every site, filled out; the same as ``get_all_sites()``."
+        return self.get_all_sites()
 
     def _no_config_modification(self, *a, **kw):
         raise NotImplementedError("YAMLConfig doesn't implement configuration modification.")
@@ -136,94 +414,542 @@ class YAMLConfig(ConfigBase):
     get_schema = get_all_schemata
 
 
+compiled_config_magic = b'passacre-config\x00'
+
+# Config values stored as fields of a compiled site rather than in its extra
+# JSON.
+_compiled_site_keys = set("""
+method
+iterations
+scrypt
+yubikey-slot
+schema
+schema-name
+multibase
+""".split())
+
+
+def write_compiled_config(config, outfile):
+    """Write every site of ``config``, filled out, as a compiled config.
+
+    The result can be loaded with ``load``; see ``CompiledConfig``.
+    """
+
+    from passacre import _passacre_capnp
+    sites = []
+    for name, site_config in sorted(config.get_all_sites().items()):
+        derivation = {
+            'method': site_config['method'],
+            'increment': site_config['iterations'],
+            'kdf': {'nulls': 0},
+        }
+        if 'scrypt' in site_config:
+            derivation['kdf'] = {'scrypt': site_config['scrypt']}
+        configuration = {
+            'derivation': derivation,
+            'schema': site_config['multibase'],
+        }
+        if site_config.get('yubikey-slot'):
+            configuration['yubikey'] = {'yubikeySlot': site_config['yubikey-slot']}
+        extra = dict(
+            (k, v) for k, v in site_config.items() if k not in _compiled_site_keys)
+        sites.append({
+            'name': name,
+            'configuration': configuration,
+            'schema': jdumps(site_config['schema']),
+            'schemaName': site_config.get('schema-name', ''),
+            'extra': jdumps(extra) if extra else '',
+        })
+    global_config = dict(config.global_config, **{'site-hashing': config.site_hashing})
+    if config.word_list_path is not None:
+        global_config['words-file'] = config.word_list_path
+    message = _passacre_capnp.CompiledConfig.new_message(
+        sites=sites, globalConfig=jdumps(global_config))
+    outfile.write(compiled_config_magic)
+    outfile.write(message.to_bytes())
+
+
+class CompiledConfig(ConfigBase):
+    """A config written by ``write_compiled_config``.
+
+    The file is memory-mapped and its sites are read in place. They're sorted
+    by name, so looking one up is a binary search that only parses the JSON of
+    the site it finds: its schema and any extra config values.
+    """
+
+    # Each lookup reads through a reader of its own, so capnp's traversal
+    # limit bounds what one lookup can read to a few times the file's size,
+    # however the file is malformed.
+    traversal_limit_factor = 4
+
+    def read(self, infile):
+        import mmap
+        self._mmap = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        with self._message() as message:
+            config = json.loads(message.globalConfig)
+        self.load_words_file(config.pop('words-file', None))
+        self.set_defaults(self._get_site('default'))
+        self.site_hashing.update(config.pop('site-hashing', {}))
+        self.global_config = config
+
+    @contextlib.contextmanager
+    def _message(self):
+        from passacre import _passacre_capnp
+        message = _passacre_capnp.CompiledConfig.from_bytes(
+            memoryview(self._mmap)[len(compiled_config_magic):],
+            traversal_limit_in_words=(
+                len(self._mmap) // 8 * self.traversal_limit_factor + 1024))
+        if hasattr(message, '__enter__'):
+            # Newer pycapnp only hands out readers inside a context.
+            with message as message:
+                yield message
+        else:
+            yield message
+
+    def _find_site(self, sites, site):
+        lo, hi = 0, len(sites)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if sites[mid].name < site:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(sites) and sites[lo].name == site:
+            return sites[lo]
+        return None
+
+    def _get_site(self, site):
+        with self._message() as message:
+            compiled = self._find_site(message.sites, site)
+            if compiled is None:
+                return None
+            return self._config_of_compiled(compiled)
+
+    def _config_of_compiled(self, compiled):
+        config = json.loads(compiled.extra) if compiled.extra else {}
+        configuration = compiled.configuration
+        derivation = configuration.derivation
+        config['method'] = str(derivation.method)
+        config['iterations'] = derivation.increment
+        if derivation.kdf.which() == 'scrypt':
+            scrypt = derivation.kdf.scrypt
+            config['scrypt'] = {'n': scrypt.n, 'r': scrypt.r, 'p': scrypt.p}
+        if configuration.yubikey.which() == 'yubikeySlot':
+            config['yubikey-slot'] = configuration.yubikey.yubikeySlot
+        # Newer pycapnp shadows fields named ``schema`` with the struct's
+        # own schema, so they're read with ``_get``.
+        config['schema'] = json.loads(compiled._get('schema'))
+        if compiled.schemaName:
+            config['schema-name'] = compiled.schemaName
+        config['multibase'] = configuration._get('schema').to_dict()
+        return config
+
+    def get_all_sites(self):
+        with self._message() as message:
+            return dict(
+                (compiled.name, self._config_of_compiled(compiled))
+                for compiled in message.sites)
+
+    def _no_config_modification(self, *a, **kw):
+        raise NotImplementedError("CompiledConfig doesn't implement configuration modification.")
+
+    add_site = remove_site = set_site_schema = _no_config_modification
+    add_schema = remove_schema = set_schema_value = set_schema_name = _no_config_modification
+
+    def get_all_schemata(self, *a, **kw):
+        raise NotImplementedError("CompiledConfig doesn't have a way to list schemata.")
+
+    get_schema = get_all_schemata
+
+
 def jsonmini_dict(pairs):
     return dict((k, jloads(v)) for k, v in pairs)
 
+
+class _SqliteSnapshot(object):
+    """Every site's resolved config, read from the database in one pass.
+
+    ``data_version`` is sqlite's ``PRAGMA data_version`` at the time the
+    snapshot was taken. ``schemata`` is as returned by
+    ``SqliteConfig._all_site_values``.
+    """
+
+    def __init__(self, data_version, schemata, sites):
+        self.data_version = data_version
+        self.schemata = schemata
+        self.sites = sites
+
+
 class SqliteConfig(ConfigBase):
+    """A config stored in an sqlite database.
+
+    ``read`` takes a ``mode`` for the connection: ``'read'`` opens the
+    database read-only, and ``'write'`` or ``None`` open it for writing. The
+    journal mode is left as it is, unless the ``sqlite-wal`` global option is
+    set and the mode is ``'write'``; then the database is switched to
+    write-ahead logging so that readers and a writer don't block each other.
+    That switch is stored in the database file itself, and lasts even if the
+    option is unset later. In every mode, a connection waits up to
+    ``busy_timeout`` seconds for a lock, reads through up to ``mmap_size``
+    bytes of memory-mapped I/O, and keeps up to ``cached_statements``
+    prepared statements for reuse.
+    """
+
     is_mutable_config = True
+    use_snapshot = False
+    _snapshot = None
 
-    def read(self, infile):
-        import sqlite3
-        self._db = sqlite3.connect(infile.name)
+    busy_timeout = 5.0
+    mmap_size = 64 * 1024 * 1024
+    cached_statements = 256
+
+    def read(self, infile, mode=None):
+        self._db = self._connect(infile.name, mode)
+        self._lookup_curs = self._db.cursor()
         curs = self._db.cursor()
 
         curs.execute(
             'SELECT config_values.name, value FROM config_values WHERE site_name IS NULL')
         config = jsonmini_dict(curs)
+        if mode == 'write' and config.get('sqlite-wal'):
+            self._db.execute('PRAGMA journal_mode = WAL')
         self.load_words_file(config.pop('words-file', None))
+        check_inheritance(self._inheritance_graph())
         self.set_defaults(self._get_site('default'))
         self.site_hashing.update(config.pop('site-hashing', {}))
         self.global_config = config
 
-    def get_site_config(self, site):
+    def _connect(self, path, mode):
+        import sqlite3
+        kwargs = dict(
+            timeout=self.busy_timeout, cached_statements=self.cached_statements,
+            # The config can be loaded on a background thread while the
+            # password is being prompted for; it's only ever used by one
+            # thread at a time.
+            check_same_thread=False)
+        if mode == 'read':
+            uri = 'file:%s?mode=ro' % (pathname2url(os.path.abspath(path)),)
+            try:
+                db = sqlite3.connect(uri, uri=True, **kwargs)
+            except TypeError:  # pragma: nocover
+                # sqlite URIs can't be used before python 3.4.
+                db = sqlite3.connect(path, **kwargs)
+                db.execute('PRAGMA query_only = ON')
+        elif mode in ('write', None):
+            db = sqlite3.connect(path, **kwargs)
+        else:
+            raise ValueError('unknown sqlite connection mode %r' % (mode,))
+        db.execute('PRAGMA mmap_size = %d' % (self.mmap_size,))
+        return db
+
+    def enable_snapshot(self):
+        """Serve site lookups from an in-memory snapshot of the database.
+
+        The snapshot is rebuilt whenever the database changes, whether through
+        this config or another connection. This is worth it for long-running
+        processes and commands that look up many sites.
+        """
+
+        self.use_snapshot = True
+        self._snapshot = None
+
+    def _commit(self, site=None):
+        """Commit, then forget what's cached about ``site`` and the sites
+        inheriting from it, or about every site if no site is given."""
+
+        self._db.commit()
+        self._snapshot = None
+        self._invalidate(site)
+
+    def _data_version(self):
+        curs = self._db.cursor()
+        curs.execute('PRAGMA data_version')
+        return curs.fetchone()[0]
+
+    _inherited_data_version = None
+
+    def _check_data_version(self):
+        "Forget every site's merged config values if another connection changed them."
+        data_version = self._data_version()
+        if data_version != self._inherited_data_version:
+            self._invalidate()
+            self._inherited_data_version = data_version
+
+    def _get_snapshot(self):
+        data_version = self._data_version()
+        if self._snapshot is None or self._snapshot.data_version != data_version:
+            self._snapshot = self._load_snapshot(data_version)
+        return self._snapshot
+
+    def _load_snapshot(self, data_version):
+        schemata, site_values = self._all_site_values()
+        return _SqliteSnapshot(data_version, schemata, self._configs_of_site_values(site_values))
+
+    def _all_site_values(self):
+        """Read every site's own config values in one pass.
+
+        Returns a ``(schemata, site_values)`` pair. ``schemata`` maps schema
+        IDs to ``(name, schema)`` pairs, whose schema objects are shared by
+        every site using them, and ``site_values`` maps site names to their
+        config values.
+        """
+
+        curs = self._db.cursor()
+        curs.execute('SELECT schema_id, name, value FROM schemata')
+        schemata = dict(
+            (schema_id, (name, json.loads(value))) for schema_id, name, value in curs)
+
+        site_values = collections.defaultdict(dict)
+        curs.execute('SELECT site_name, schema_id FROM sites')
+        for site, schema_id in curs:
+            values = site_values[site]
+            values['schema-name'], values['schema'] = schemata[schema_id]
+        curs.execute(
+            'SELECT site_name, name, value FROM config_values WHERE site_name IS NOT NULL')
+        for site, k, v in curs:
+            site_values[site][k] = jloads(v)
+        return schemata, dict(site_values)
+
+    def _configs_of_site_values(self, site_values):
+        check_inheritance(dict(
+            (site, inherits_of(values)) for site, values in site_values.items()))
+        memo = {}
+        return dict(
+            (site, self._config_of_values(resolve_inherited(site, site_values.get, memo)))
+            for site in site_values)
+
+    def _inheritance_graph(self):
+        curs = self._db.cursor()
+        curs.execute("SELECT site_name, value FROM config_values WHERE name = 'inherits'")
+        return dict(
+            (site, inherits_of({'inherits': jloads(value)})) for site, value in curs)
+
+    def _check_inheritance(self):
+        """Raise ``ValueError`` if the sites, as of the current transaction,
+        inherit in a cycle or from a site that doesn't exist."""
+
         curs = self._db.cursor()
+        curs.execute(
+            'SELECT site_name FROM sites UNION '
+            'SELECT site_name FROM config_values WHERE site_name IS NOT NULL')
+        check_inheritance(self._inheritance_graph(), set(site for site, in curs))
+
+    def get_site_config(self, site):
+        curs = self._lookup_curs
         curs.execute(
             'SELECT name, value FROM config_values WHERE site_name IS ?',
             (site,))
         return jsonmini_dict(curs)
 
-    def _get_site(self, site):
-        site_config = self.get_site_config(site)
-        curs = self._db.cursor()
+    def _site_values(self, site):
+        values = self.get_site_config(site)
+        curs = self._lookup_curs
         curs.execute(
-            'SELECT value FROM sites JOIN schemata USING (schema_id) WHERE site_name = ?',
+            'SELECT name, value FROM sites JOIN schemata USING (schema_id) WHERE site_name = ?',
             (site,))
         results = curs.fetchall()
-        if not (results or site_config):
+        if not (results or values):
             return None
-
-        config = self.defaults.copy()
         if results:
-            config['schema'] = json.loads(results[0][0])
-        config.update(site_config)
+            # The default site's schema name would end up in the defaults,
+            # and so in every site without a schema of its own.
+            if site != 'default':
+                values.setdefault('schema-name', results[0][0])
+            values.setdefault('schema', json.loads(results[0][1]))
+        return values
 
-        self.fill_out_config(config)
-        return config
+    def _get_site(self, site):
+        if self.use_snapshot:
+            config = self._get_snapshot().sites.get(site)
+            return None if config is None else config.copy()
+        self._check_data_version()
+        values = self._inherited_values(site)
+        if values is None:
+            return None
+        return self._config_of_values(values)
 
     def add_site(self, name, schema_id):
         curs = self._db.cursor()
         curs.execute(
             'INSERT INTO sites (site_name, schema_id) VALUES (?, ?)',
             (name, schema_id))
-        self._db.commit()
+        self._commit(name)
 
     def set_site_schema(self, name, schema_id):
         curs = self._db.cursor()
         curs.execute(
             'UPDATE sites SET schema_id = ? WHERE site_name = ?',
             (schema_id, name))
-        self._db.commit()
+        self._commit(name)
 
     def remove_site(self, name):
         curs = self._db.cursor()
-        curs.execute('DELETE FROM sites WHERE site_name = ?', (name,))
-        curs.execute('DELETE FROM config_values WHERE site_name = ?', (name,))
-        self._db.commit()
+        try:
+            curs.execute('DELETE FROM sites WHERE site_name = ?', (name,))
+            curs.execute('DELETE FROM config_values WHERE site_name = ?', (name,))
+            self._check_inheritance()
+        except:
+            self._db.rollback()
+            raise
+        self._commit(name)
 
     def rename_site(self, name, newname):
         curs = self._db.cursor()
-        curs.execute('UPDATE OR REPLACE sites SET site_name = ? WHERE site_name = ?', (newname, name))
-        curs.execute('UPDATE OR REPLACE config_values SET site_name = ? WHERE site_name = ?', (newname, name))
-        self._db.commit()
+        try:
+            curs.execute('UPDATE OR REPLACE sites SET site_name = ? WHERE site_name = ?', (newname, name))
+            curs.execute('UPDATE OR REPLACE config_values SET site_name = ? WHERE site_name = ?', (newname, name))
+            self._check_inheritance()
+        except:
+            self._db.rollback()
+            raise
+        self._commit()
+
+    def rename_sites(self, renames):
+        """Rename many sites in a single transaction.
+
+        ``renames`` is an iterable of ``(name, newname)`` pairs.
+        """
 
-    def get_all_sites(self):
         curs = self._db.cursor()
         curs.execute(
-            'SELECT site_name, name, value FROM config_values WHERE site_name IS NOT NULL')
-        sites = collections.defaultdict(self.defaults.copy)
-        for site, k, v in curs:
-            sites[site][k] = jloads(v)
+            'CREATE TEMP TABLE renames (site_name TEXT PRIMARY KEY, new_name TEXT NOT NULL)')
+        try:
+            curs.executemany(
+                'INSERT INTO renames (site_name, new_name) VALUES (?, ?)', renames)
+            for table in ['sites', 'config_values']:
+                curs.execute(
+                    'UPDATE OR REPLACE %s SET site_name = '
+                    '(SELECT new_name FROM renames WHERE renames.site_name = %s.site_name) '
+                    'WHERE site_name IN (SELECT site_name FROM renames)' % (table, table))
+            curs.execute('DROP TABLE renames')
+            self._check_inheritance()
+            self._commit()
+        except:
+            self._db.rollback()
+            curs.execute('DROP TABLE IF EXISTS renames')
+            raise
 
-        curs.execute(
-            'SELECT site_name, name, value FROM sites JOIN schemata USING (schema_id) WHERE site_name IS NOT NULL')
-        for site, schema_name, schema in curs:
-            sites[site]['schema-name'] = schema_name
-            sites[site]['schema'] = json.loads(schema)
+    bulk_load_chunk_size = 1000
 
-        for config in sites.values():
-            self.fill_out_config(config)
+    def bulk_load(self, records):
+        """Add or replace many sites in a single transaction.
+
+        ``records`` is an iterable of dicts. Each has a ``site`` key, and
+        optionally a ``schema`` key: either a schema value or the name of an
+        existing schema. Sites without a schema use the default site's. A new
+        schema value is added under its ``schema-name`` key if there is one,
+        or under a generated name otherwise; schema values already in the
+        config are reused instead of added again. Every other key is set as a
+        config value for the site, replacing any config values it had before.
+
+        Returns the number of sites loaded.
+        """
 
-        return dict(sites)
+        curs = self._db.cursor()
+        curs.execute('SELECT schema_id, name, value FROM schemata')
+        schema_ids_by_name = {}
+        schema_ids_by_value = {}
+        for schema_id, name, value in curs.fetchall():
+            schema_ids_by_name[name] = schema_id
+            schema_ids_by_value.setdefault(jdumps(json.loads(value)), schema_id)
+        curs.execute("SELECT schema_id FROM sites WHERE site_name = 'default'")
+        default = curs.fetchall()
+        default_schema_id = default[0][0] if default else None
+        schema_names = ('schema_%d' % e for e in itertools.count())
+
+        def schema_id_of(record):
+            schema = record.pop('schema', None)
+            name = record.pop('schema-name', None)
+            if schema is None:
+                if name is None:
+                    return default_schema_id
+                schema = name
+            if not isinstance(schema, list):
+                if schema not in schema_ids_by_name:
+                    raise ValueError('there is no schema by the name %r' % (schema,))
+                return schema_ids_by_name[schema]
+            value = jdumps(schema)
+            schema_id = schema_ids_by_value.get(value)
+            if schema_id is None:
+                verify_multibase_schema(schema)
+                while name is None or name in schema_ids_by_name:
+                    name = next(schema_names)
+                curs.execute(
+                    'INSERT INTO schemata (name, value) VALUES (?, ?)', (name, value))
+                schema_id = schema_ids_by_name[name] = schema_ids_by_value[value] = curs.lastrowid
+            return schema_id
+
+        n_sites = 0
+        records = iter(records)
+        try:
+            while True:
+                chunk = list(itertools.islice(records, self.bulk_load_chunk_size))
+                if not chunk:
+                    break
+                site_rows = []
+                config_rows = []
+                for record in chunk:
+                    record = dict(record)
+                    site = record.pop('site')
+                    schema_id = schema_id_of(record)
+                    if schema_id is None:
+                        raise ValueError('no schema for %r and no default schema' % (site,))
+                    site_rows.append((site, schema_id))
+                    config_rows.extend(
+                        (site, k, jdumps(v)) for k, v in record.items())
+                curs.executemany(
+                    'INSERT OR REPLACE INTO sites (site_name, schema_id) VALUES (?, ?)',
+                    site_rows)
+                curs.executemany(
+                    'DELETE FROM config_values WHERE site_name = ?',
+                    [(site,) for site, _ in site_rows])
+                curs.executemany(
+                    'INSERT OR REPLACE INTO config_values (site_name, name, value) VALUES (?, ?, ?)',
+                    config_rows)
+                n_sites += len(site_rows)
+            self._check_inheritance()
+            self._commit()
+        except:
+            self._db.rollback()
+            raise
+        return n_sites
+
+    def get_all_sites(self):
+        if self.use_snapshot:
+            return dict(self._get_snapshot().sites)
+        _, site_values = self._all_site_values()
+        return self._configs_of_site_values(site_values)
+
+    # Sites whose schema can differ from their row in the sites table.
+    _own_schema_query = (
+        "SELECT site_name FROM config_values "
+        "WHERE site_name IS NOT NULL AND name IN ('schema', 'inherits')")
+
+    def get_sites_by_schema(self):
+        curs = self._db.cursor()
+        curs.execute('SELECT schema_id, value FROM schemata')
+        schemata = dict((schema_id, json.loads(value)) for schema_id, value in curs)
+        curs.execute(
+            'SELECT schema_id, site_name FROM sites '
+            'WHERE site_name NOT IN (%s) ORDER BY schema_id' % (self._own_schema_query,))
+        ret = [
+            (schemata[schema_id], [site for _, site in rows])
+            for schema_id, rows in itertools.groupby(curs, operator.itemgetter(0))]
+
+        # Sites with only config values get their schema from there or from
+        # the defaults, and sites with a schema or parents in their config
+        # values don't use the sites table's schema, so they have to be looked
+        # up one by one.
+        curs.execute(
+            'SELECT DISTINCT site_name FROM config_values '
+            'WHERE site_name IS NOT NULL AND (site_name NOT IN (SELECT site_name FROM sites) '
+            'OR site_name IN (%s))' % (self._own_schema_query,))
+        groups = {}
+        for site, in curs.fetchall():
+            schema = self._get_site(site)['schema']
+            groups.setdefault(json.dumps(schema, sort_keys=True), (schema, []))[1].append(site)
+        ret.extend(groups.values())
+        return ret
 
     def get_all_schemata(self):
         curs = self._db.cursor()
@@ -244,7 +970,7 @@ class SqliteConfig(ConfigBase):
         curs.execute(
             'INSERT INTO schemata (name, value) VALUES (?, ?)',
             (name, jdumps(value)))
-        self._db.commit()
+        self._commit()
 
     def remove_schema(self, schema_id):
         curs = self._db.cursor()
@@ -254,12 +980,12 @@ class SqliteConfig(ConfigBase):
             raise ValueError(
                 "can't delete this schema; at least one site is using it: %r" % (sites,))
         curs.execute('DELETE FROM schemata WHERE schema_id = ?', (schema_id,))
-        self._db.commit()
+        self._commit()
 
     def set_schema_name(self, schema_id, newname):
         curs = self._db.cursor()
         curs.execute('UPDATE schemata SET name = ? WHERE schema_id = ?', (newname, schema_id))
-        self._db.commit()
+        self._commit()
 
     def set_schema_value(self, schema_id, value):
         verify_multibase_schema(value)
@@ -267,7 +993,7 @@ class SqliteConfig(ConfigBase):
         curs.execute(
             'UPDATE schemata SET value = ? WHERE schema_id = ?',
             (jdumps(value), schema_id))
-        self._db.commit()
+        self._commit()
 
     def get_config(self, site, name):
         curs = self._db.cursor()
@@ -291,21 +1017,44 @@ class SqliteConfig(ConfigBase):
         else:
             new_value = value
         curs = self._db.cursor()
-        curs.execute(
-            'DELETE FROM config_values WHERE site_name IS ? AND name = ?',
-            (site, name,))
-        if new_value is not None:
+        try:
             curs.execute(
-                'INSERT INTO config_values (site_name, name, value) VALUES (?, ?, ?)',
-                (site, name, jdumps(new_value)))
-        self._db.commit()
+                'DELETE FROM config_values WHERE site_name IS ? AND name = ?',
+                (site, name,))
+            if new_value is not None:
+                curs.execute(
+                    'INSERT INTO config_values (site_name, name, value) VALUES (?, ?, ?)',
+                    (site, name, jdumps(new_value)))
+            # Removing a site's last config value can remove the site.
+            if site is not None and (name == 'inherits' or new_value is None):
+                self._check_inheritance()
+        except:
+            self._db.rollback()
+            raise
+        self._commit(site)
 
 
-def load(infile):
-    if infile.read(16) == b'SQLite format 3\x00':
-        config = SqliteConfig()
-    else:
-        config = YAMLConfig()
+def load(infile, snapshot=False, mode=None, cache=False):
+    """Load a YAML or sqlite config from a file object.
+
+    Compiled configs, as written by ``write_compiled_config``, are loaded too.
+    ``snapshot`` and ``mode`` only apply to sqlite configs; see
+    ``SqliteConfig.enable_snapshot`` and ``SqliteConfig``. ``cache`` only
+    applies to YAML configs; see ``YAMLConfig``.
+    """
+
+    magic = infile.read(16)
     infile.seek(0)
-    config.read(infile)
+    if magic == b'SQLite format 3\x00':
+        config = SqliteConfig()
+        config.read(infile, mode=mode)
+        if snapshot:
+            config.enable_snapshot()
+        return config
+    elif magic == compiled_config_magic:
+        config = CompiledConfig()
+        config.read(infile)
+        return config
+    config = YAMLConfig()
+    config.read(infile, cache=cache)
     return config
@@ -3,16 +3,15 @@
 
 import string
 
-from passacre._backend_capnp import default_client
 from passacre.compat import hexlify
 from passacre.schema import multibase_of_schema
-from passacre import features, signing_uuid
+from passacre import _backend_capnp, features, signing_uuid
 
 
 _site_multibase = multibase_of_schema([string.ascii_letters + string.digits + '-_'] * 48)
 
 
-def generate(username, password, site, options, client=default_client):
+def generate(username, password, site, options, client=None, kdf_session=None):
     """Generate a password with the passacre method.
 
     1. A string is generated from ``username:`` (if a username is specified),
@@ -24,14 +23,87 @@ def generate(username, password, site, options, client=default_client):
        ``multibase`` can encode.
     4. That integer is encoded with
        ``multibase`` and the encoded value is returned.
+
+    The derivation is done by ``client``, or by ``_backend_capnp.default_client``
+    if no client is passed. If a ``KdfSession`` is passed as ``kdf_session``,
+    the scrypt step is taken from it instead of being run again.
+    """
+
+    if client is None:
+        client = _backend_capnp.default_client
+    return client.derive(*derivation_request(
+        username, password, site, options, kdf_session=kdf_session))
+
+
+def generate_many(requests, client=None, kdf_session=None):
+    """Generate a batch of passwords with the passacre method.
+
+    ``requests`` is an iterable of ``(username, password, site, options)``
+    tuples, each taking the same values as the arguments to ``generate``. The
+    derivations are pipelined through ``client`` and the passwords are
+    returned as a list in the same order as ``requests``. ``kdf_session`` is
+    as for ``generate``.
+    """
+
+    if client is None:
+        client = _backend_capnp.default_client
+    return client.derive_many([
+        derivation_request(username, password, site, options, kdf_session=kdf_session)
+        for username, password, site, options in requests])
+
+
+class KdfSession(object):
+    """Run each distinct scrypt KDF once and reuse its output.
+
+    The scrypt step only depends on the username, password and scrypt
+    parameters, never on the site, so a batch of derivations sharing them only
+    needs to run it once. The outputs are kept in memory only, and ``wipe``
+    overwrites them with zeros; it's called on leaving a ``with`` block::
+
+        with KdfSession() as session:
+            generate_many(requests, kdf_session=session)
+
+    The KDF is run by ``client``, or by ``_backend_capnp.default_client`` if no
+    client is passed.
     """
 
+    def __init__(self, client=None):
+        self._client = client
+        self._keys = {}
+
+    def derived_key(self, username, password, scrypt):
+        key = username, password, scrypt['n'], scrypt['r'], scrypt['p']
+        derived = self._keys.get(key)
+        if derived is None:
+            client = self._client
+            if client is None:
+                client = _backend_capnp.default_client
+            derived = self._keys[key] = bytearray(client.derive_key(username, password, scrypt))
+        return derived
+
+    def wipe(self):
+        for derived in self._keys.values():
+            derived[:] = b'\0' * len(derived)
+        self._keys.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wipe()
+
+
+def derivation_request(username, password, site, options, kdf_session=None):
+    "Build the ``(site, user_input)`` pair that a backend client derives from."
     if options.get('yubikey-slot'):
         password = extend_password_with_yubikey(password, options)
     kdf = {}
-    if 'scrypt' in options:
+    if 'scrypt' in options and kdf_session is not None:
+        kdf['precomputed'] = memoryview(
+            kdf_session.derived_key(username or '', password, options['scrypt']))
+    elif 'scrypt' in options:
         kdf['scrypt'] = options['scrypt']
-    return client.derive({
+    return {
         'derivation': {
             'method': options['method'],
             'kdf': kdf,
@@ -42,7 +114,7 @@ def generate(username, password, site, options, client=default_client):
         'username': username or '',
         'password': password,
         'sitename': site,
-    })
+    }
 
 
 @features.yubikey.check
@@ -55,6 +127,18 @@ def extend_password_with_yubikey(password, options, YubiKey=None):
     return hexlify(response) + ':' + password
 
 
-def hash_site(password, site, options):
+def hash_site(password, site, options, client=None, kdf_session=None):
+    options = dict(options, multibase=_site_multibase)
+    return generate(None, password, site, options, client=client, kdf_session=kdf_session)
+
+
+def hash_sites(password, sites, options, client=None, kdf_session=None):
+    """Hash a batch of site names, as ``hash_site`` would hash each one.
+
+    The hashed names are returned as a list in the same order as ``sites``.
+    """
+
     options = dict(options, multibase=_site_multibase)
-    return generate(None, password, site, options)
+    return generate_many(
+        [(None, password, site, options) for site in sites],
+        client=client, kdf_session=kdf_session)
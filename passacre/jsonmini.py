@@ -14,7 +14,29 @@ jsonmini_parser = createParserClass(
     OMetaBase, {'unichr': unichr, 'unicodedata': unicodedata})
 
 
+def _reject_constant(name):
+    raise ValueError('%s is not a jsonmini constant' % (name,))
+
+
+# NaN and Infinity are identifiers in jsonmini, i.e. strings.
+_json_decoder = json.JSONDecoder(parse_constant=_reject_constant)
+
+
 def parse(s):
+    """Parse a jsonmini value.
+
+    jsonmini is a superset of JSON, and almost every stored value is plain
+    JSON, so the C JSON decoder is tried first. Only the input it rejects goes
+    through the jsonmini grammar.
+    """
+
+    try:
+        return _json_decoder.decode(s)
+    except ValueError:
+        return _parse_grammar(s)
+
+
+def _parse_grammar(s):
     grammar = jsonmini_parser(unicode(s))
     try:
         ret, err = grammar.apply('top')
@@ -29,55 +51,33 @@ def parse(s):
     raise err
 
 
-_unparsers = {}
-
-
-def unparser(*types):
-    def deco(f):
-        for typ in types:
-            _unparsers[typ] = f
-        return f
-    return deco
-
-
 _unicode_identifier_regexp = re.compile('[^a-zA-Z0-9_-]')
 
 
-@unparser(unicode)
-def _unparse_unicode(u, is_top):
+def _unparse_unicode(u):
     if _unicode_identifier_regexp.search(u):
         return json.dumps(u)
     else:
         return u
 
 
-@unparser(dict)
 def _unparse_dict(d, is_top):
-    ret = [] if is_top else ['{']
-    for k, v in sorted(d.items()):
-        ret.append(_unparse_unicode(k, False))
-        ret.append(': ')
-        ret.append(_unparse(v))
-        ret.append(', ')
-    if is_top:
-        ret.pop()
-    else:
-        ret[-1] = '}'
-    return ''.join(ret)
-
-
-@unparser(list)
-def _unparse_list(l, is_top):
-    return '[%s]' % ', '.join(_unparse(x) for x in l)
-
-
-@unparser(int, long, float, bool, type(None))
-def _unparse_the_rest(x, is_top):
-    return json.dumps(x)
+    ret = ', '.join(
+        '%s: %s' % (_unparse_unicode(k), _unparse(v)) for k, v in sorted(d.items()))
+    return ret if is_top else '{%s}' % (ret,)
 
 
 def _unparse(j, _is_top=False):
-    return _unparsers[type(j)](j, _is_top)
+    typ = type(j)
+    if typ is unicode:
+        return _unparse_unicode(j)
+    elif typ is dict:
+        return _unparse_dict(j, _is_top)
+    elif typ is list:
+        return '[%s]' % ', '.join(_unparse(x) for x in j)
+    elif typ in (int, long, float, bool, type(None)):
+        return json.dumps(j)
+    raise TypeError("can't unparse %r as jsonmini" % (j,))
 
 
 def unparse(j):
@@ -3,6 +3,13 @@
 
 from __future__ import unicode_literals
 
+import math
+
+
+class DomainError(ValueError):
+    "Raised when an integer is outside the range a multibase can encode."
+
+
 class MultiBase(object):
     """Represents a base where not every digit has the same possible values.
 
@@ -16,24 +23,100 @@ class MultiBase(object):
     encoded with this base.
     """
 
+    __slots__ = ('bases', 'max_encodable_value', '_encoders', '_decoders', '_products')
+
+    # Above this many digits, encoding and decoding split the integer in
+    # halves by the product of each half's digits' lengths, instead of going
+    # one digit at a time. Ranges of at most ``leaf_size`` digits are still
+    # done one digit at a time.
+    divide_threshold = 256
+    leaf_size = 128
+
     def __init__(self, bases):
         self.bases = bases
+        lengths = [len(base) for base in bases]
+        self._products = None
+        if len(lengths) > self.divide_threshold:
+            self._products = {}
+            max_encodable_value = self._product(lengths, 0, len(lengths))
+        else:
+            max_encodable_value = 1
+            for length in lengths:
+                max_encodable_value *= length
+        self.max_encodable_value = max_encodable_value - 1
+
+        self._encoders = list(zip(lengths, bases))
+        self._decoders = None
+
+    def _build_decoders(self):
+        # Bases are usually repeated, so each distinct base only gets one
+        # table mapping its digits back to their values. The tables are only
+        # built once something is decoded, since a base can be a word list
+        # that's never read as a whole otherwise.
+        indexes = {}
+        for _, base in self._encoders:
+            if id(base) not in indexes:
+                index = indexes[id(base)] = {}
+                for e, d in enumerate(base):
+                    index.setdefault(d, e)
+        self._decoders = [(length, indexes[id(base)]) for length, base in self._encoders]
+
+    def _product(self, lengths, lo, hi):
+        "Multiply the lengths of digits ``lo`` to ``hi``, remembering each half."
+        if hi - lo <= self.leaf_size:
+            ret = 1
+            for length in lengths[lo:hi]:
+                ret *= length
+        else:
+            mid = (lo + hi) // 2
+            ret = self._product(lengths, lo, mid) * self._product(lengths, mid, hi)
+        self._products[lo, hi] = ret
+        return ret
+
+    def _encode_range(self, n, lo, hi, ret):
+        if hi - lo <= self.leaf_size:
+            for e in range(hi - 1, lo - 1, -1):
+                length, base = self._encoders[e]
+                n, d = divmod(n, length)
+                ret[e] = base[d]
+            return
+        mid = (lo + hi) // 2
+        high, low = divmod(n, self._products[mid, hi])
+        self._encode_range(high, lo, mid, ret)
+        self._encode_range(low, mid, hi, ret)
+
+    def _decode_range(self, x, lo, hi):
+        if hi - lo <= self.leaf_size:
+            ret = 0
+            for e in range(lo, hi):
+                length, index = self._decoders[e]
+                ret = (ret * length) + index[x[e]]
+            return ret
+        mid = (lo + hi) // 2
+        return (self._decode_range(x, lo, mid) * self._products[mid, hi]
+                + self._decode_range(x, mid, hi))
 
     def encode(self, n):
         """Encode an integer to a string, using this base.
 
         The ``n`` parameter must be an integer. Returns the encoded string, or
-        raises ``ValueError`` if ``n`` is greater than the largest encodable
-        integer.
+        raises ``DomainError`` if ``n`` is negative or greater than the largest
+        encodable integer.
         """
 
+        if n < 0:
+            raise DomainError('%d is negative' % (n,))
         if n > self.max_encodable_value:
-            raise ValueError(
+            raise DomainError(
                 '%d is greater than the largest encodable integer (%d)' % (
                     n, self.max_encodable_value))
+        if self._products is not None:
+            ret = [None] * len(self._encoders)
+            self._encode_range(n, 0, len(ret), ret)
+            return ''.join(ret)
         ret = []
-        for base in reversed(self.bases):
-            n, d = divmod(n, len(base))
+        for length, base in reversed(self._encoders):
+            n, d = divmod(n, length)
             ret.append(base[d])
         ret.reverse()
         return ''.join(ret)
@@ -51,14 +134,130 @@ class MultiBase(object):
             raise ValueError(
                 "the length of %r (%d) doesn't match the number of bases (%d)" % (
                     x, len(x), len(self.bases)))
-        ret = 0
-        for base, d in zip(self.bases, x):
-            ret = (ret * len(base)) + base.index(d)
+        if self._decoders is None:
+            self._build_decoders()
+        try:
+            if self._products is not None:
+                return self._decode_range(x, 0, len(x))
+            ret = 0
+            for (length, index), d in zip(self._decoders, x):
+                ret = (ret * length) + index[d]
+        except KeyError as e:
+            raise ValueError('%r is not a valid digit in %r' % (e.args[0], x))
         return ret
 
-    @property
-    def max_encodable_value(self):
-        ret = 1
-        for base in self.bases:
-            ret *= len(base)
-        return ret - 1
+    def encode_many(self, ns):
+        "Encode each integer in ``ns``, returning a list of strings."
+        return [self.encode(n) for n in ns]
+
+    def decode_many(self, xs):
+        "Decode each string in ``xs``, returning a list of integers."
+        return [self.decode(x) for x in xs]
+
+
+class SchemaMultiBase(object):
+    """A multibase built straight from a schema, as built by
+    ``passacre.schema.multibase_of_schema``.
+
+    This encodes exactly like the backend's multibase. Repeated items aren't
+    expanded: each run of an item is one digit in a base of the item's length
+    to the power of the run's length, and is only split into its own digits
+    when it's encoded. Word lists are read with ``read_words``, which is
+    passed the path of the schema's words file.
+    """
+
+    __slots__ = ('max_encodable_value', 'shuffle', '_runs', '_multibases', '_key')
+
+    def __init__(self, schema, read_words=None):
+        words = None
+        runs = []
+        keys = []
+        for item in schema['value']:
+            value = item['value']
+            # Like the backend, a repeat of 0 still adds the item once.
+            repeat = max(item.get('repeat', 1), 1)
+            if 'characters' in value:
+                base = list(value['characters'])
+                key = 'characters', tuple(base)
+                length = len(base)
+            elif 'separator' in value:
+                base = value['separator']
+                key = 'separator', base
+                length = 1
+            elif 'words' in value:
+                if words is None:
+                    source = schema.get('words', {}).get('source', {})
+                    if 'filePath' not in source or read_words is None:
+                        raise ValueError('word schemata need a words file')
+                    words = read_words(source['filePath'])
+                base = words
+                key = 'words',
+                length = len(words)
+            elif 'subschema' in value:
+                base = SchemaMultiBase(value['subschema'], read_words)
+                key = 'subschema', base._key
+                length = base.max_encodable_value + 1
+            else:
+                raise ValueError('unsupported schema item %r' % (value,))
+            runs.append((key[0], base, length, repeat, length ** repeat))
+            keys.append((key, repeat))
+
+        length_product = 1
+        for _, _, _, _, run_product in runs:
+            length_product *= run_product
+        self.shuffle = bool(schema.get('shuffle'))
+        if self.shuffle:
+            repeats = {}
+            for key, repeat in keys:
+                repeats[key] = repeats.get(key, 0) + repeat
+            length_product *= math.factorial(sum(repeats.values()))
+            for repeat in repeats.values():
+                length_product //= math.factorial(repeat)
+        self.max_encodable_value = length_product - 1
+        self._runs = runs
+        self._multibases = {}
+        self._key = tuple(keys), self.shuffle
+
+    def entropy_bits(self):
+        return (self.max_encodable_value + 1).bit_length()
+
+    def required_bytes(self):
+        return (self.max_encodable_value.bit_length() + 7) // 8
+
+    def _encode_run(self, e, n):
+        kind, base, length, repeat, _ = self._runs[e]
+        if kind == 'subschema':
+            ret = []
+            for _ in range(repeat):
+                n, d = divmod(n, length)
+                ret.append(base.encode(d))
+            ret.reverse()
+            return ''.join(ret)
+        mb = self._multibases.get(e)
+        if mb is None:
+            mb = self._multibases[e] = MultiBase([base] * repeat)
+        return mb.encode(n)
+
+    def encode(self, n):
+        """Encode an integer to a string, using this base.
+
+        Raises ``DomainError`` if ``n`` is negative or greater than the largest
+        encodable integer.
+        """
+
+        if not 0 <= n <= self.max_encodable_value:
+            raise DomainError(
+                '%d is outside the range of encodable integers (0 to %d)' % (
+                    n, self.max_encodable_value))
+        if self.shuffle:
+            raise NotImplementedError("shuffled schemata can't be encoded")
+        ret = []
+        for e in range(len(self._runs) - 1, -1, -1):
+            kind, base, _, repeat, run_product = self._runs[e]
+            if kind == 'separator':
+                ret.append(base * repeat)
+                continue
+            n, d = divmod(n, run_product)
+            ret.append(self._encode_run(e, d))
+        ret.reverse()
+        return ''.join(ret)
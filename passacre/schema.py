@@ -1,7 +1,6 @@
 # Copyright (c) Aaron Gallagher <_@habnab.it>
 # See COPYING for details.
 
-import itertools
 import string
 
 
@@ -76,14 +75,48 @@ def parse_character_set(x):
     x = parse_type(x, string_types, 'a string')
     return character_classes.get(x, x)
 
+def _extend_runs(runs, more):
+    "Append the runs in ``more`` to ``runs``, merging the runs where they meet."
+    for item, count in more:
+        if runs and runs[-1][0] == item:
+            runs[-1] = item, runs[-1][1] + count
+        else:
+            runs.append((item, count))
+    return runs
+
+def _repeat_runs(runs, count, delimiter):
+    """Repeat ``runs`` ``count`` times, with ``delimiter`` between each
+    repetition.
+
+    If the repetitions merge into a single run, its count is multiplied out
+    instead of repeating anything.
+    """
+
+    if count <= 0:
+        return []
+    delimiter_runs = [([delimiter], 1)] if delimiter else []
+    if not runs:
+        # Only the delimiters between the empty repetitions are left.
+        return [([delimiter], count - 1)] if delimiter and count > 1 else []
+    unit = _extend_runs(list(runs), delimiter_runs)
+    if len(unit) == 1:
+        item, n = unit[0]
+        return [(item, n * count - len(delimiter_runs))]
+    ret = []
+    for e in range(count):
+        if e != 0:
+            _extend_runs(ret, delimiter_runs)
+        _extend_runs(ret, runs)
+    return ret
+
 @trace_parse('character sets')
 def parse_character_sets(x):
     if x == 'word':
-        return [_word]
+        return [(_word, 1)]
     elif isinstance(x, list):
-        return [''.join(parse_character_set(y, _index=e) for e, y in enumerate(x))]
+        return [(''.join(parse_character_set(y, _index=e) for e, y in enumerate(x)), 1)]
     else:
-        return [parse_character_set(x)]
+        return [(parse_character_set(x), 1)]
 
 @trace_parse('a count and items array')
 def parse_counted_item(x):
@@ -95,15 +128,10 @@ def parse_counted_item(x):
         delimiter = parse_type(x[0], string_types, 'a string', _index=0)
         count = parse_type(x[1], int, 'a number', _index=1)
         start = 2
-    each_item = [z
-                 for e, y in enumerate(x[start:], start=start)
-                 for z in parse_item(y, _index=e)]
-    items = []
-    for e in range(count):
-        if e != 0 and delimiter:
-            items.append([delimiter])
-        items.extend(each_item)
-    return items
+    each_item = []
+    for e, y in enumerate(x[start:], start=start):
+        _extend_runs(each_item, parse_item(y, _index=e))
+    return _repeat_runs(each_item, count, delimiter)
 
 @trace_parse('an item')
 def parse_item(x):
@@ -116,15 +144,22 @@ def parse_item(x):
 
 @trace_parse('the items')
 def parse_items(x):
-    items = [parse_item(y, _index=e) for e, y in enumerate(parse_type(x, list, 'an array'))]
-    return [y for subitems in items for y in subitems]
+    """Parse a password schema into ``(item, count)`` runs.
+
+    Counts are kept as numbers, so the size of the result follows the size of
+    the schema rather than the length of the password it describes.
+    """
+
+    runs = []
+    for e, y in enumerate(parse_type(x, list, 'an array')):
+        _extend_runs(runs, parse_item(y, _index=e))
+    return runs
 
 
 def multibase_of_schema(schema):
     "Convert a password schema from decoded YAML to a ``MultiBase``."
-    items = parse_items(schema)
     ret = []
-    for item, iteritems in itertools.groupby(items):
+    for item, count in parse_items(schema):
         if item is _word:
             item = {'words': None}
         elif len(item) == 1:
@@ -133,6 +168,27 @@ def multibase_of_schema(schema):
             item = {'characters': list(item)}
         ret.append({
             'value': item,
-            'repeat': sum(1 for _ in iteritems),
+            'repeat': count,
         })
     return {'value': ret}
+
+
+def entropy_bits_of_multibase(multibase):
+    """Compute the entropy of a ``MultiBase`` as built by
+    ``multibase_of_schema`` without asking the backend.
+
+    Returns ``None`` if the ``MultiBase`` has words in it, since the size of a
+    word list is only known once the words file has been read.
+    """
+
+    n_values = 1
+    for item in multibase['value']:
+        value = item['value']
+        if 'characters' in value:
+            length = len(value['characters'])
+        elif 'separator' in value:
+            length = 1
+        else:
+            return None
+        n_values *= length ** item.get('repeat', 1)
+    return n_values.bit_length()
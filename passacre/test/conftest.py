@@ -0,0 +1,9 @@
+# Copyright (c) Aaron Gallagher <_@habnab.it>
+# See COPYING for details.
+
+import sys
+
+
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.append('test_backend_asyncio.py')
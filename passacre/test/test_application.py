@@ -8,7 +8,8 @@ import traceback
 
 import capnp
 
-from passacre import application, features
+from passacre import _backend_capnp, application, features
+from passacre._backend_python import PythonClient, read_words
 
 
 _shush_pyflakes = [features]
@@ -20,6 +21,7 @@ datadir = py.path.local(__file__).dirpath('data')
 def create_application():
     app = application.Passacre()
     app.environ = {}
+    app.yaml_cache = False
     return app
 
 
@@ -340,6 +342,13 @@ schema_3: [[", ", 4, word]]
 schema_4: [[16, [alphanumeric, "\\"%'()+,-/:;<=>?\\\\ ^_|"]]]
 """
 
+def test_init_from_yaml_progress(tmpdir, capsys):
+    app = create_application()
+    app.main(['-v', 'init', '-y', datadir.join('keccak.yaml').strpath,
+              tmpdir.join('test.db').strpath])
+    out, err = capsys.readouterr()
+    assert err == 'converted 11 sites\n'
+
 def test_init_from_yaml_sites(yaml2sqlite_app, capsys):
     app = yaml2sqlite_app
     assert read_out(capsys, app, 'site') == """gN7y2jQ72IbdvQZxrZLNmC4hrlDmB-KZnGJiGpoB4VEcOCn4: schema_1
@@ -666,6 +675,139 @@ def test_always_confirm_site_config(always_confirm_app):
     app.main(['config', '-a', '-s', 'hashed.example.com'])
     assert app._confirmed_password
 
+def test_always_confirm_generate(always_confirm_app, python_client):
+    app = always_confirm_app
+    app.main(['generate', 'example.com'])
+    assert app._confirmed_password
+
+
+@pytest.fixture
+def python_client(monkeypatch):
+    client = PythonClient()
+    monkeypatch.setattr(_backend_capnp, 'default_client', client)
+    return client
+
+def test_site_hash_all(mutable_app, python_client, capsys):
+    app = mutable_app
+    app.hash_all_chunk_size = 4
+    app.main(['site', 'hash-all', '-j', '1'])
+    out, err = capsys.readouterr()
+    assert not out
+    progress = err.splitlines()
+    assert [line.split(' (')[0] for line in progress[:3]] == [
+        'hashed 4/9 sites', 'hashed 8/9 sites', 'hashed 9/9 sites']
+    assert progress[3].startswith('renamed 9 sites in ')
+    sites = read_out(capsys, app, 'site')
+    assert 'gN7y2jQ72IbdvQZxrZLNmC4hrlDmB-KZnGJiGpoB4VEcOCn4: schema_7' in sites
+    assert 'schwab.com' not in sites
+    assert '\ndefault: schema_5\n' in sites
+
+def test_compile_config(app, tmpdir, capsys):
+    path = tmpdir.join('compiled')
+    app.main(['compile-config', path.strpath])
+    expected = read_out(capsys, app, 'site')
+    compiled_app = create_application()
+    compiled_app.load_config(path.open('rb'))
+    assert read_out(capsys, compiled_app, 'site') == expected
+
+def comparable_sites(config):
+    sites = config.get_all_sites()
+    for site_config in sites.values():
+        site_config['multibase'] = site_config['multibase']['value']
+    return sites
+
+@pytest.mark.parametrize('config_file', ['keccak.yaml', 'keccak.sqlite'])
+def test_compile_config_sites(config_file, tmpdir):
+    datadir.chdir()
+    path = tmpdir.join('compiled')
+    app = create_application()
+    app.load_config(datadir.join(config_file).open('rb'))
+    app.main(['compile-config', path.strpath])
+    compiled_app = create_application()
+    compiled_app.load_config(path.open('rb'))
+    assert comparable_sites(compiled_app.config) == comparable_sites(app.config)
+
+def test_words(app, capsys):
+    assert read_out(capsys, app, 'words') == 'words: 100 words\n'
+
+def test_words_compile(app, tmpdir, capsys):
+    path = tmpdir.join('words.compiled')
+    assert not read_out(capsys, app, 'words', 'compile', 'words', path.strpath)
+    assert list(read_words(path.strpath)) == read_words('words')
+
+def test_site_import_csv(mutable_app, tmpdir, capsys):
+    app = mutable_app
+    infile = tmpdir.join('sites.csv')
+    infile.write(
+        'site,schema,increment\n'
+        'example.org,schema_0,\n'
+        'example.net,"[[21, printable]]",5\n')
+    app.main(['site', 'import', infile.strpath])
+    out, err = capsys.readouterr()
+    assert err.startswith('imported 2 sites in ')
+    sites = read_out(capsys, app, 'site').splitlines()
+    assert 'example.org: schema_0' in sites
+    assert 'example.net: schema_8' in sites
+    assert app.config.get_config('example.net', 'increment') == 5
+
+def test_site_import_csv_numeric_schema_name(mutable_app, tmpdir, capsys):
+    app = mutable_app
+    app.config.add_schema('5', [[5, 'digit']])
+    infile = tmpdir.join('sites.csv')
+    infile.write('site,schema\nexample.org,5\n')
+    app.main(['site', 'import', infile.strpath])
+    capsys.readouterr()
+    assert 'example.org: 5' in read_out(capsys, app, 'site').splitlines()
+
+def test_site_import_jsonl_hashed(mutable_app, python_client, tmpdir, capsys):
+    app = mutable_app
+    infile = tmpdir.join('sites')
+    infile.write('{"site": "example.org", "schema": "schema_0"}\n\n')
+    app.main(['site', '-a', 'import', '-j', '1', infile.strpath])
+    capsys.readouterr()
+    assert 'KE76ybZ-sO7o4iS944E_mo_jTQPCjzifFjyRELZS-RuDbcGu: schema_0\n' in read_out(
+        capsys, app, 'site')
+
+def test_generate_reports_startup(app, python_client, capsys):
+    app._prompt_password = lambda confirm: 'passacre'
+    app.main(['-v', 'generate', 'schwab.com'])
+    out, err = capsys.readouterr()
+    assert out == 'jRWs2Wzl\n'
+    assert err.startswith('startup: loading config ')
+    assert 'hidden behind the password prompt' in err
+
+class CountingClient(PythonClient):
+    def __init__(self):
+        PythonClient.__init__(self)
+        self.entropy_calls = 0
+
+    def entropy_bits(self, schema):
+        self.entropy_calls += 1
+        return PythonClient.entropy_bits(self, schema)
+
+def test_entropy_only_asks_backend_about_words(app, monkeypatch, capsys):
+    client = CountingClient()
+    monkeypatch.setattr(_backend_capnp, 'default_client', client)
+    out = read_out(capsys, app, 'entropy')
+    out = '\n'.join(line.rstrip() for line in out.splitlines())
+    assert out == """
+                      site                         entropy (bits)
+
+default                                                       210
+becu.org                                                      191
+fidelity.com                                                  102
+schwab.com                                                     48
+still.further.example.com                                      40
+further.example.com                                            27
+example.com                                                    27
+gN7y2jQ72IbdvQZxrZLNmC4hrlDmB-KZnGJiGpoB4VEcOCn4               14"""
+    assert client.entropy_calls == 4
+
+def test_generate_always_hashed_site(always_hash_app, python_client, capsys):
+    app = always_hash_app
+    out = read_out(capsys, app, 'generate', 'hashed.example.com')
+    assert out == 'Abasgi abatement\n'
+
 
 @pytest.fixture
 def nonextant_words_app(app, tmpdir):
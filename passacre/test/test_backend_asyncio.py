@@ -0,0 +1,220 @@
+# Copyright (c) Aaron Gallagher <_@habnab.it>
+# See COPYING for details.
+
+import asyncio
+import os
+import socket
+
+import capnp
+import pytest
+
+from passacre import _backend_asyncio
+from passacre._backend_capnp import SubprocessClient
+from passacre.generator import derivation_request
+from passacre.schema import multibase_of_schema
+
+
+class FakeResult(object):
+    def __init__(self, derived):
+        self.derived = derived
+
+
+class FakePromise(object):
+    cancelled = False
+
+    def __init__(self, site):
+        self.site = site
+
+    def then(self, resolved, failed):
+        self.resolved = resolved
+        self.failed = failed
+        return self
+
+    def resolve(self):
+        self.resolved(FakeResult(self.site.upper()))
+
+    def fail(self, exc):
+        self.failed(exc)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeCompiledSchema(object):
+    def __init__(self, client, schema):
+        self.client = client
+        self.schema = schema
+
+    def derive(self, derivation, user_input):
+        promise = FakePromise(self.schema['name'])
+        self.client.sent.append(promise)
+        return promise
+
+
+class FakeCompileSchemaResult(object):
+    def __init__(self, compiled):
+        self.compiled = compiled
+
+
+class FakeCapnpClient(object):
+    def __init__(self):
+        self.sent = []
+        self.compiled = []
+
+    def compileSchema(self, schema):
+        self.compiled.append(schema['name'])
+        return FakeCompileSchemaResult(FakeCompiledSchema(self, schema))
+
+
+class FakeSubprocessClient(SubprocessClient):
+    _active_client = None
+
+    def __init__(self):
+        self._sock, self._remote = socket.socketpair()
+        self._active_client = FakeCapnpClient()
+        self._compiled_schemata = {}
+
+
+@pytest.fixture
+def loop(monkeypatch):
+    monkeypatch.setattr(capnp, 'poll_once', lambda: None, raising=False)
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+def fake_site(name):
+    return {'schema': {'name': name, 'value': []}, 'derivation': None}
+
+
+def make_client(loop, **kw):
+    client = _backend_asyncio.AsyncioClient(loop=loop, client=FakeSubprocessClient(), **kw)
+    return client, client._client._active_client.sent
+
+
+def test_derive_concurrently(loop):
+    client, sent = make_client(loop)
+
+    async def run():
+        tasks = [loop.create_task(client.derive(fake_site(site), None)) for site in ['spam', 'eggs']]
+        await asyncio.sleep(0)
+        assert [promise.site for promise in sent] == ['spam', 'eggs']
+        for promise in reversed(sent):
+            promise.resolve()
+        return await asyncio.gather(*tasks)
+
+    assert loop.run_until_complete(run()) == ['SPAM', 'EGGS']
+    client.close()
+
+
+def test_back_pressure(loop):
+    client, sent = make_client(loop, max_in_flight=1)
+
+    async def run():
+        tasks = [loop.create_task(client.derive(fake_site(site), None)) for site in ['spam', 'eggs']]
+        await asyncio.sleep(0)
+        assert len(sent) == 1
+        sent[0].resolve()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert len(sent) == 2
+        sent[1].resolve()
+        return await asyncio.gather(*tasks)
+
+    assert loop.run_until_complete(run()) == ['SPAM', 'EGGS']
+
+
+def test_semaphore_created_in_running_loop(loop):
+    client, sent = make_client(loop, max_in_flight=1)
+    assert client._in_flight is None
+
+    async def run():
+        task = loop.create_task(client.derive(fake_site('spam'), None))
+        await asyncio.sleep(0)
+        sent[0].resolve()
+        return await task
+
+    assert loop.run_until_complete(run()) == 'SPAM'
+    assert client._in_flight is not None
+
+
+def test_cancellation(loop):
+    client, sent = make_client(loop)
+
+    async def run():
+        task = loop.create_task(client.derive(fake_site('spam'), None))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    loop.run_until_complete(run())
+    assert sent[0].cancelled
+
+
+def test_compiled_schemata_are_shared(loop):
+    client, sent = make_client(loop)
+    capnp_client = client._client._active_client
+
+    async def run():
+        tasks = [loop.create_task(client.derive(fake_site(site), None))
+                 for site in ['spam', 'spam', 'eggs']]
+        await asyncio.sleep(0)
+        for promise in sent:
+            promise.resolve()
+        return await asyncio.gather(*tasks)
+
+    assert loop.run_until_complete(run()) == ['SPAM', 'SPAM', 'EGGS']
+    assert capnp_client.compiled == ['spam', 'eggs']
+
+
+def test_failed_call_forgets_compiled_schema(loop):
+    client, sent = make_client(loop)
+    capnp_client = client._client._active_client
+
+    async def run():
+        task = loop.create_task(client.derive(fake_site('spam'), None))
+        await asyncio.sleep(0)
+        sent[0].fail(ValueError('no words'))
+        with pytest.raises(ValueError):
+            await task
+        task = loop.create_task(client.derive(fake_site('spam'), None))
+        await asyncio.sleep(0)
+        sent[1].resolve()
+        return await task
+
+    assert loop.run_until_complete(run()) == 'SPAM'
+    assert capnp_client.compiled == ['spam', 'spam']
+
+
+def backend_on_path():
+    return any(
+        os.access(os.path.join(d, SubprocessClient._backend), os.X_OK)
+        for d in os.environ.get('PATH', '').split(os.pathsep))
+
+
+@pytest.mark.skipif(
+    not hasattr(capnp, 'poll_once'), reason="this pycapnp doesn't have poll_once")
+@pytest.mark.skipif(not backend_on_path(), reason='the backend is not installed')
+def test_real_subprocess_client():
+    loop = asyncio.new_event_loop()
+    subprocess_client = SubprocessClient()
+    client = _backend_asyncio.AsyncioClient(loop=loop, client=subprocess_client)
+    site, user_input = derivation_request(None, 'passacre', 'example.com', {
+        'method': 'keccak',
+        'iterations': 1000,
+        'multibase': multibase_of_schema([[8, 'alphanumeric']]),
+    })
+
+    async def run():
+        return await asyncio.gather(
+            client.derive(site, user_input), client.derive(site, user_input),
+            client.entropy_bits(site['schema']))
+
+    try:
+        first, second, bits = loop.run_until_complete(run())
+    finally:
+        client.close()
+        loop.close()
+    assert first == second == subprocess_client.derive(site, user_input)
+    assert bits == subprocess_client.entropy_bits(site['schema'])
@@ -0,0 +1,253 @@
+# Copyright (c) Aaron Gallagher <_@habnab.it>
+# See COPYING for details.
+
+import os
+
+import capnp
+import pytest
+
+from passacre import _backend_capnp
+from passacre._backend_python import PythonClient
+from passacre.generator import derivation_request
+from passacre.schema import multibase_of_schema
+
+
+class FakeResult(object):
+    def __init__(self, derived):
+        self.derived = derived
+
+
+class FakePromise(object):
+    def __init__(self, worker, derived):
+        self.worker = worker
+        self.derived = derived
+
+    def wait(self):
+        if self.worker.dying:
+            self.worker.dying = False
+            self.worker.is_dead = True
+            raise capnp.KjException('disconnected')
+        return FakeResult(self.derived)
+
+
+class FakeWorker(object):
+    is_dead = dying = False
+
+    def __init__(self, name):
+        self.name = name
+        self.sent = []
+
+    def _send_derives(self, requests):
+        self.sent.append(list(requests))
+        return [FakePromise(self, '%s:%s' % (self.name, site)) for site, _ in requests]
+
+    def derive_many(self, requests):
+        self.is_dead = False
+        return [promise.wait().derived for promise in self._send_derives(requests)]
+
+    def derive(self, site, user_input):
+        return self.derive_many([(site, user_input)])[0]
+
+
+def fake_pool(size):
+    names = iter('abcdefgh')
+    return _backend_capnp.PooledClient(size, client_factory=lambda: FakeWorker(next(names)))
+
+
+def test_pool_derive_many_spreads_and_keeps_order():
+    pool = fake_pool(3)
+    results = pool.derive_many((site, None) for site in 'stuvwxy')
+    assert results == ['a:s', 'b:t', 'c:u', 'a:v', 'b:w', 'c:x', 'a:y']
+    assert [len(worker.sent[0]) for worker in pool._workers] == [3, 2, 2]
+
+
+def test_pool_derive_many_only_uses_needed_workers():
+    pool = fake_pool(4)
+    assert pool.derive_many([]) == []
+    assert pool.derive_many((site, None) for site in 'st') == ['a:s', 'b:t']
+    assert [len(worker.sent) for worker in pool._workers] == [1, 1, 0, 0]
+
+
+def test_pool_derive_round_robin():
+    pool = fake_pool(2)
+    assert [pool.derive(site, None) for site in 'stu'] == ['a:s', 'b:t', 'a:u']
+
+
+def test_pool_retries_dead_worker():
+    pool = fake_pool(2)
+    pool._workers[1].dying = True
+    assert pool.derive_many((site, None) for site in 'stuv') == ['a:s', 'b:t', 'a:u', 'b:v']
+    assert len(pool._workers[1].sent) == 2
+
+
+def test_pool_needs_a_worker():
+    with pytest.raises(ValueError):
+        _backend_capnp.PooledClient(0)
+
+
+def test_pool_word_cache_covers_every_worker(tmpdir):
+    words = tmpdir.join('words')
+    words.write('spam\neggs\n')
+    pool = _backend_capnp.PooledClient(3, client_factory=PythonClient)
+    assert pool.preload_words(words.strpath) == 2
+    assert pool.word_cache_stats() == {'hits': 0, 'misses': 3, 'entries': 3}
+    pool.invalidate_words(words.strpath)
+    assert pool.word_cache_stats()['entries'] == 0
+
+
+class FakeCompileResult(object):
+    def __init__(self, schema):
+        self.compiled = FakeCompiledSchema(schema)
+
+
+class FakeCompiledSchema(object):
+    def __init__(self, schema, failing=False):
+        self.schema = schema
+        self.failing = failing
+        # Like the backend, the words are read when the schema is compiled.
+        self.words = None
+        if 'words' in schema:
+            with open(schema['words']['source']['filePath']) as infile:
+                self.words = infile.read().strip()
+
+    def derive(self, derivation, user_input):
+        worker = FakeWorker(None)
+        worker.dying = self.failing
+        derived = '%s:%s' % (self.schema['name'], derivation)
+        if self.words is not None:
+            derived += ':' + self.words
+        return FakePromise(worker, derived)
+
+
+class FakeWait(object):
+    def wait(self):
+        pass
+
+
+class FakeToplevel(object):
+    fail_next = False
+
+    def __init__(self):
+        self.compiled = []
+        self.invalidated = []
+
+    def compileSchema(self, schema):
+        self.compiled.append(schema)
+        result = FakeCompileResult(schema)
+        result.compiled.failing, self.fail_next = self.fail_next, False
+        return result
+
+    def invalidateWords(self, path):
+        self.invalidated.append(path)
+        return FakeWait()
+
+
+class FakeToplevelClient(_backend_capnp.SubprocessClient):
+    def __init__(self):
+        self.toplevel = FakeToplevel()
+        self._compiled_schemata = {}
+
+    @property
+    def _active_client(self):
+        return self.toplevel
+
+
+def test_derive_compiles_each_schema_once():
+    client = FakeToplevelClient()
+    requests = [
+        ({'schema': {'name': name, 'value': []}, 'derivation': derivation}, None)
+        for name, derivation in [('a', 1), ('b', 2), ('a', 3), ('a', 4)]]
+    assert client.derive_many(requests) == ['a:1', 'b:2', 'a:3', 'a:4']
+    assert client.derive(*requests[1]) == 'b:2'
+    assert client.toplevel.compiled == [{'name': 'a', 'value': []}, {'name': 'b', 'value': []}]
+
+
+def test_failed_schema_is_compiled_again():
+    client = FakeToplevelClient()
+    client.toplevel.fail_next = True
+    site = {'schema': {'name': 'a', 'value': []}, 'derivation': 1}
+    with pytest.raises(capnp.KjException):
+        client.derive(site, None)
+    assert client.derive(site, None) == 'a:1'
+    assert client.derive(site, None) == 'a:1'
+    assert client.toplevel.compiled == [{'name': 'a', 'value': []}] * 2
+
+
+def words_site(name, path):
+    return {
+        'schema': {'name': name, 'value': [], 'words': {'source': {'filePath': path}}},
+        'derivation': 1,
+    }
+
+
+def test_invalidated_words_are_used_after_recompiling(tmpdir):
+    spam = tmpdir.join('spam')
+    spam.write('spam\n')
+    eggs = tmpdir.join('eggs')
+    eggs.write('eggs\n')
+    client = FakeToplevelClient()
+    spam_site = words_site('a', spam.strpath)
+    eggs_site = words_site('b', eggs.strpath)
+    plain_site = {'schema': {'name': 'c', 'value': []}, 'derivation': 1}
+    nested_site = {
+        'schema': {'name': 'd', 'value': [
+            {'value': {'subschema': words_site('e', spam.strpath)['schema']}, 'repeat': 1}]},
+        'derivation': 1,
+    }
+    sites = [spam_site, eggs_site, plain_site, nested_site]
+    for site in sites:
+        client.derive(site, None)
+    spam.write('ham\n')
+    assert client.derive(spam_site, None) == 'a:1:spam'
+
+    client.invalidate_words(spam.strpath)
+    assert client.toplevel.invalidated == [spam.strpath]
+    assert client.derive(spam_site, None) == 'a:1:ham'
+    for site in sites:
+        client.derive(site, None)
+    assert [schema['name'] for schema in client.toplevel.compiled] == [
+        'a', 'b', 'c', 'd', 'a', 'd']
+
+    client.invalidate_words()
+    for site in sites:
+        client.derive(site, None)
+    assert len(client.toplevel.compiled) == 10
+
+
+def test_daemon_socket_path(tmpdir):
+    runtime_dir = tmpdir.join('runtime')
+    runtime_dir.mkdir()
+    runtime_dir.chmod(0o700)
+    environ = {'XDG_RUNTIME_DIR': runtime_dir.strpath}
+    assert _backend_capnp.daemon_socket_path(environ) == (
+        runtime_dir.join('passacre-backend.sock').strpath)
+    runtime_dir.chmod(0o750)
+    with pytest.raises(ValueError):
+        _backend_capnp.daemon_socket_path(environ)
+
+
+def backend_on_path():
+    return any(
+        os.access(os.path.join(d, _backend_capnp.SubprocessClient._backend), os.X_OK)
+        for d in os.environ.get('PATH', '').split(os.pathsep))
+
+
+@pytest.mark.skipif(not backend_on_path(), reason='the backend is not installed')
+def test_daemon_derive(tmpdir):
+    socket_path = tmpdir.join('backend.sock').strpath
+    site, user_input = derivation_request(None, 'passacre', 'example.com', {
+        'method': 'keccak',
+        'iterations': 1000,
+        'multibase': multibase_of_schema([[8, 'alphanumeric']]),
+    })
+    expected = _backend_capnp.SubprocessClient().derive(site, user_input)
+    first = _backend_capnp.DaemonClient(socket_path, idle_timeout=1)
+    assert first.derive(site, user_input) == expected
+    # A second client connects to the daemon the first one started.
+    second = _backend_capnp.DaemonClient(socket_path, idle_timeout=1)
+    assert second.derive(site, user_input) == expected
+    assert second._proc is None
+    first._sock.close()
+    second._sock.close()
+    first._proc.wait()
+    assert not os.path.exists(socket_path)
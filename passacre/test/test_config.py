@@ -2,7 +2,10 @@
 # See COPYING for details.
 
 import itertools
+import json
 import os
+import shutil
+import sqlite3
 
 import capnp
 import pytest
@@ -35,6 +38,7 @@ class ConfigTestCaseMixin(object):
     password = 'passacre'
     config_file = None
     method = None
+    snapshot = False
 
     expected_passwords = {}
     expected_username_passwords = {}
@@ -80,7 +84,7 @@ class ConfigTestCaseMixin(object):
     @pytest.fixture
     def config_obj(self):
         os.chdir(datadir)
-        return config.load(open(self.config_file, 'rb'))
+        return config.load(open(self.config_file, 'rb'), snapshot=self.snapshot)
 
     @uses('expected_passwords', 'site', 'expected')
     def test_expected_passwords(self, config_obj, site, expected):
@@ -142,6 +146,11 @@ class TestKeccakSqlite(KeccakTestCaseMixin):
     config_file = 'keccak.sqlite'
 
 
+class TestKeccakSqliteSnapshot(KeccakTestCaseMixin):
+    config_file = 'keccak.sqlite'
+    snapshot = True
+
+
 class SkeinTestCaseMixin(ConfigTestCaseMixin):
     method = 'skein'
     expected_passwords = {
@@ -177,6 +186,11 @@ class TestSkeinSqlite(SkeinTestCaseMixin):
     config_file = 'skein.sqlite'
 
 
+class TestSkeinSqliteSnapshot(SkeinTestCaseMixin):
+    config_file = 'skein.sqlite'
+    snapshot = True
+
+
 def test_no_words_file():
     # using sqlite for lazy-loading of site data, otherwise the `load` call
     # will fail too.
@@ -184,3 +198,338 @@ def test_no_words_file():
     assert c.word_list_path is None
     with pytest.raises(capnp.KjException):
         c.generate_for_site(None, 'passacre', 'example.com')
+
+
+@pytest.fixture
+def sqlite_path(tmpdir):
+    path = str(tmpdir.join('keccak.sqlite'))
+    shutil.copy(os.path.join(datadir, 'keccak.sqlite'), path)
+    return path
+
+
+@pytest.fixture
+def mutable_config(sqlite_path):
+    return config.load(open(sqlite_path, 'rb'))
+
+
+def test_snapshot_invalidation(sqlite_path):
+    c = config.load(open(sqlite_path, 'rb'), snapshot=True)
+    assert c.get_site('schwab.com')['schema'] == [[8, 'alphanumeric']]
+    assert c.get_site('becu.org')['multibase'] is c.get_site('becu.org')['multibase']
+
+    db = sqlite3.connect(sqlite_path)
+    db.execute(
+        'UPDATE sites SET schema_id = (SELECT schema_id FROM sites WHERE site_name = ?) '
+        'WHERE site_name = ?', ('becu.org', 'schwab.com'))
+    db.commit()
+    assert c.get_site('schwab.com')['schema'] == [[32, 'alphanumeric']]
+
+    schema_id, _ = c.get_schema('schema_5')
+    c.add_site('new.example.com', schema_id)
+    assert c.get_site('new.example.com')['schema'] == [[32, 'printable']]
+    assert 'new.example.com' in c.get_all_sites()
+
+
+def test_bulk_load(mutable_config):
+    c = mutable_config
+    c.bulk_load_chunk_size = 2
+    assert c.bulk_load([
+        {'site': 'a.example.com', 'schema': [[8, 'alphanumeric']]},
+        {'site': 'b.example.com', 'schema': [[9, 'alphanumeric']], 'increment': 3},
+        {'site': 'c.example.com', 'schema': [[9, 'alphanumeric']]},
+        {'site': 'd.example.com', 'schema': 'schema_0'},
+        {'site': 'e.example.com'},
+        {'site': 'f.example.com', 'schema': [[10, 'alphanumeric']], 'schema-name': 'ten'},
+    ]) == 6
+    sites = c.get_all_sites()
+    assert sites['a.example.com']['schema-name'] == 'schema_1'
+    assert sites['b.example.com']['schema-name'] == 'schema_8'
+    assert sites['b.example.com']['iterations'] == 13
+    assert sites['c.example.com']['schema-name'] == 'schema_8'
+    assert sites['d.example.com']['schema-name'] == 'schema_0'
+    assert sites['e.example.com']['schema-name'] == 'schema_5'
+    assert sites['f.example.com']['schema'] == [[10, 'alphanumeric']]
+    assert c.get_all_schemata()['ten'] == [[10, 'alphanumeric']]
+
+
+def test_bulk_load_replaces_config_values(mutable_config):
+    c = mutable_config
+    c.bulk_load([{'site': 'a.example.com', 'increment': 3, 'method': 'skein'}])
+    c.bulk_load([{'site': 'a.example.com', 'increment': 4}])
+    assert c.get_site_config('a.example.com') == {'increment': 4}
+
+
+def test_bulk_load_rolls_back(mutable_config):
+    c = mutable_config
+    with pytest.raises(ValueError):
+        c.bulk_load([
+            {'site': 'a.example.com', 'schema': [[11, 'alphanumeric']]},
+            {'site': 'b.example.com', 'schema': 'nonexistent'},
+        ])
+    assert 'a.example.com' not in c.get_all_sites()
+    assert [[11, 'alphanumeric']] not in c.get_all_schemata().values()
+
+
+def test_read_only_mode(sqlite_path):
+    c = config.load(open(sqlite_path, 'rb'), mode='read')
+    assert c.get_site('schwab.com')['schema'] == [[8, 'alphanumeric']]
+    with pytest.raises(sqlite3.OperationalError):
+        c.set_config('schwab.com', 'increment', 1)
+
+
+def test_write_mode(sqlite_path):
+    c = config.load(open(sqlite_path, 'rb'), mode='write')
+    c.set_config('schwab.com', 'increment', 1)
+    assert c.get_site('schwab.com')['iterations'] == 11
+    assert c._db.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    reader = config.load(open(sqlite_path, 'rb'), mode='read')
+    assert reader.get_site('schwab.com')['iterations'] == 11
+
+
+def test_write_mode_wal(sqlite_path):
+    c = config.load(open(sqlite_path, 'rb'))
+    c.set_config(None, 'sqlite-wal', True)
+    assert c._db.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    c = config.load(open(sqlite_path, 'rb'), mode='write')
+    assert c._db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    c.set_config('schwab.com', 'increment', 1)
+    reader = config.load(open(sqlite_path, 'rb'), mode='read')
+    assert reader.get_site('schwab.com')['iterations'] == 11
+    # The file itself was converted, so it stays in WAL mode even after the
+    # option is unset.
+    c.set_config(None, 'sqlite-wal', None)
+    c = config.load(open(sqlite_path, 'rb'))
+    assert c._db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        config.load(open(os.path.join(datadir, 'keccak.sqlite'), 'rb'), mode='spam')
+
+
+def test_sites_share_multibases():
+    c = config.load(open(os.path.join(datadir, 'keccak.sqlite'), 'rb'))
+    sites = c.get_all_sites()
+    assert sites['default']['multibase'] is sites['fhcrc.org']['multibase']
+    assert sites['default']['multibase'] is not sites['becu.org']['multibase']
+
+
+def test_yaml_cache(tmpdir):
+    path = tmpdir.join('keccak.yaml')
+    path.write_binary(open(os.path.join(datadir, 'keccak.yaml'), 'rb').read())
+    cache_path = tmpdir.join('keccak.yaml.cache')
+    c = config.load(path.open('rb'), cache=True)
+    assert cache_path.check()
+    expected = c.get_all_sites()
+
+    cache = json.loads(cache_path.read())
+    cache['parsed']['sites']['schwab.com']['schema'] = [[9, 'alphanumeric']]
+    cache_path.write(json.dumps(cache))
+    cached = config.load(path.open('rb'), cache=True)
+    assert cached.get_site('schwab.com')['schema'] == [[9, 'alphanumeric']]
+
+    path.write_binary(path.read_binary() + b'\n')
+    reparsed = config.load(path.open('rb'), cache=True)
+    assert reparsed.get_all_sites() == expected
+
+
+@pytest.mark.parametrize('cache_contents', [
+    '[]', '{"key": null}', '{"key": null, "parsed": [], "spam": 1}', '"spam"'])
+def test_yaml_cache_with_bad_structure(tmpdir, cache_contents):
+    path = tmpdir.join('keccak.yaml')
+    path.write_binary(open(os.path.join(datadir, 'keccak.yaml'), 'rb').read())
+    tmpdir.join('keccak.yaml.cache').write(cache_contents)
+    c = config.load(path.open('rb'), cache=True)
+    assert c.get_site('schwab.com')['schema'] == [[8, 'alphanumeric']]
+
+
+def test_yaml_cache_matches_uncached_load(tmpdir):
+    path = tmpdir.join('numeric.yaml')
+    path.write_binary(b"""
+sites:
+  default:
+    schema: [[32, printable]]
+  12345:
+    nested: {1: spam, eggs: 2}
+""")
+    uncached = config.load(path.open('rb')).get_all_sites()
+    assert config.load(path.open('rb'), cache=True).get_all_sites() == uncached
+    assert config.load(path.open('rb'), cache=True).get_all_sites() == uncached
+    assert not tmpdir.join('numeric.yaml.cache').check()
+
+
+def test_yaml_sites_alias():
+    c = config.load(open(os.path.join(datadir, 'keccak.yaml'), 'rb'))
+    assert c.sites == c.get_all_sites()
+
+
+def test_yaml_without_cache(tmpdir):
+    path = tmpdir.join('keccak.yaml')
+    path.write_binary(open(os.path.join(datadir, 'keccak.yaml'), 'rb').read())
+    config.load(path.open('rb'))
+    assert not tmpdir.join('keccak.yaml.cache').check()
+
+
+@pytest.mark.parametrize('config_file', ['keccak.yaml', 'keccak.sqlite'])
+def test_compiled_config(tmpdir, config_file):
+    os.chdir(datadir)
+    source = config.load(open(config_file, 'rb'))
+    path = tmpdir.join('compiled')
+    with path.open('wb') as outfile:
+        config.write_compiled_config(source, outfile)
+    compiled = config.load(path.open('rb'))
+    assert isinstance(compiled, config.CompiledConfig)
+    assert compiled.site_hashing == source.site_hashing
+    assert compiled.word_list_path == source.word_list_path
+    for site in ['becu.org', 'fhcrc.org', 'scrypt.example.com']:
+        expected = source.get_site(site)
+        actual = compiled.get_site(site)
+        assert actual.pop('multibase')['value'] == expected.pop('multibase')['value']
+        expected.pop('schema-name', None)
+        actual.pop('schema-name', None)
+        assert actual == expected
+    assert compiled.get_site_without_password('nonexistent.example.com') is None
+    assert sorted(compiled.get_all_sites()) == sorted(source.get_all_sites())
+    assert compiled.generate_for_site(None, 'passacre', 'schwab.com') == 'jRWs2Wzl'
+
+
+def test_compiled_config_traversal_limit(tmpdir, monkeypatch):
+    source = config.load(open(os.path.join(datadir, 'keccak.yaml'), 'rb'))
+    path = tmpdir.join('compiled')
+    with path.open('wb') as outfile:
+        config.write_compiled_config(source, outfile)
+    compiled = config.load(path.open('rb'))
+    expected = compiled.get_all_sites()
+    # Every lookup gets its own limit, so reading the whole file over and over
+    # never runs out of it.
+    for x in range(2 * config.CompiledConfig.traversal_limit_factor + 1):
+        assert compiled.get_all_sites() == expected
+    # But the limit is sized from the file, and reading more than it raises.
+    monkeypatch.setattr(config.CompiledConfig, 'traversal_limit_factor', 0)
+    with pytest.raises(Exception) as excinfo:
+        compiled.get_all_sites()
+    assert 'traversal limit' in str(excinfo.value).lower()
+
+
+inheriting_yaml = b"""
+sites:
+  default:
+    schema: [[32, printable]]
+    iterations: 10
+    method: keccak
+  base.example.com:
+    schema: [[8, alphanumeric]]
+    increment: 2
+  mid.example.com:
+    inherits: base.example.com
+    method: skein
+  leaf.example.com:
+    inherits: [mid.example.com]
+    increment: 3
+"""
+
+
+def test_yaml_inheritance(tmpdir):
+    path = tmpdir.join('inherits.yaml')
+    path.write_binary(inheriting_yaml)
+    c = config.load(path.open('rb'))
+    leaf = c.get_site('leaf.example.com')
+    assert leaf['schema'] == [[8, 'alphanumeric']]
+    assert leaf['method'] == 'skein'
+    assert leaf['iterations'] == 13
+    assert 'inherits' not in leaf
+
+
+def test_yaml_inheritance_cycle(tmpdir):
+    path = tmpdir.join('inherits.yaml')
+    path.write_binary(inheriting_yaml + b"""
+    inherits: leaf.example.com
+""")
+    with pytest.raises(ValueError):
+        config.load(path.open('rb'))
+
+
+def test_yaml_inheritance_missing_parent(tmpdir):
+    path = tmpdir.join('inherits.yaml')
+    path.write_binary(inheriting_yaml + b"""
+  orphan.example.com:
+    inherits: nonextant.example.com
+""")
+    with pytest.raises(ValueError):
+        config.load(path.open('rb'))
+
+
+def test_sites_by_schema_with_schema_override(mutable_config):
+    c = mutable_config
+    c.set_config('example.com', 'schema', [[3, 'digit']])
+    c.set_config('scrypt.example.com', 'inherits', 'example.com')
+    groups = c.get_sites_by_schema()
+    schemata = dict(
+        (site, schema) for schema, sites in groups for site in sites)
+    assert sorted(schemata) == sorted(c.get_all_sites())
+    for site, site_config in c.get_all_sites().items():
+        assert schemata[site] == site_config['schema']
+    assert schemata['example.com'] == schemata['scrypt.example.com'] == [[3, 'digit']]
+
+
+def test_sqlite_inheritance(mutable_config):
+    c = mutable_config
+    c.set_config('child.example.com', 'inherits', 'fhcrc.org')
+    c.set_config('grandchild.example.com', 'inherits', ['child.example.com'])
+    grandchild = c.get_site('grandchild.example.com')
+    assert grandchild['schema'] == [[32, 'printable']]
+    assert grandchild['iterations'] == 15
+
+    c.set_config('child.example.com', 'schema', [[8, 'alphanumeric']])
+    c.set_config('fhcrc.org', 'increment', 7)
+    grandchild = c.get_site('grandchild.example.com')
+    assert grandchild['schema'] == [[8, 'alphanumeric']]
+    assert grandchild['iterations'] == 17
+    assert c.get_all_sites()['grandchild.example.com']['iterations'] == 17
+
+    with pytest.raises(ValueError):
+        c.set_config('fhcrc.org', 'inherits', 'grandchild.example.com')
+    with pytest.raises(ValueError):
+        c.get_config('fhcrc.org', 'inherits')
+
+
+def test_sqlite_inheritance_missing_parent(mutable_config):
+    c = mutable_config
+    with pytest.raises(ValueError):
+        c.set_config('fhcrc.org', 'inherits', 'nonextant.example.org')
+    with pytest.raises(ValueError):
+        c.get_config('fhcrc.org', 'inherits')
+    c.set_config('child.example.com', 'inherits', 'scrypt.example.com')
+    with pytest.raises(ValueError):
+        c.set_config('scrypt.example.com', 'scrypt', None)
+    assert 'child.example.com' in c.get_all_sites()
+
+
+def test_sqlite_inheritance_checked_on_every_change(mutable_config):
+    c = mutable_config
+    c.set_config('child.example.com', 'inherits', 'fhcrc.org')
+
+    with pytest.raises(ValueError):
+        c.bulk_load([{'site': 'fhcrc.org', 'inherits': 'child.example.com'}])
+    with pytest.raises(ValueError):
+        c.bulk_load([{'site': 'a.example.com', 'inherits': 'nonextant.example.org'}])
+    assert 'inherits' not in c.get_site_config('fhcrc.org')
+    assert 'a.example.com' not in c.get_all_sites()
+
+    with pytest.raises(ValueError):
+        c.rename_sites([('fhcrc.org', 'renamed.example.com')])
+    with pytest.raises(ValueError):
+        c.rename_site('fhcrc.org', 'renamed.example.com')
+    with pytest.raises(ValueError):
+        c.remove_site('fhcrc.org')
+    sites = c.get_all_sites()
+    assert 'fhcrc.org' in sites
+    assert 'renamed.example.com' not in sites
+    assert c.get_site('child.example.com')['iterations'] == 15
+
+
+def test_find_inheritance_cycle():
+    assert config.find_inheritance_cycle({'a': ['b'], 'b': ['c'], 'c': []}) is None
+    assert config.find_inheritance_cycle({'a': ['b'], 'b': ['c'], 'c': ['a']}) == [
+        'a', 'b', 'c', 'a']
+    assert config.find_inheritance_cycle({'a': ['a']}) == ['a', 'a']
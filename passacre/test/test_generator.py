@@ -5,6 +5,7 @@ import string
 
 import pytest
 
+from passacre._backend_python import PythonClient
 from passacre.schema import multibase_of_schema
 from passacre import features, generator, signing_uuid
 
@@ -32,7 +33,7 @@ def test_extend_password_with_yubikey(monkeypatch):
     assert yk.slot == 1
 
 
-@pytest.mark.parametrize(('username', 'password', 'site', 'options', 'expected'), [
+scrypt_vectors = [
     (None, '', 'scrypt.example.com',
      {'method': 'keccak', 'iterations': 10, 'scrypt': {'n': 16, 'r': 1, 'p': 1}},
      'c43ca39ad66469184a4023fa7acb64c6263a252318c976ffe7fd1da9cf0ae507'),
@@ -45,7 +46,113 @@ def test_extend_password_with_yubikey(monkeypatch):
     ('NaCl', 'password', 'scrypt2.example.com',
      {'method': 'skein', 'iterations': 10, 'scrypt': {'n': 1024, 'r': 8, 'p': 16}},
      'cff7a6fc473cb6523c413047f8e26d1e23ffc96b9d7b1fe2008b95469ef2eed1'),
-])
+]
+
+@pytest.mark.parametrize(('username', 'password', 'site', 'options', 'expected'), scrypt_vectors)
 def test_scrypt_vectors(username, password, site, options, expected):
     options = dict(options, multibase=hex_multibase)
     assert generator.generate(username, password, site, options) == expected
+
+@pytest.mark.parametrize(('username', 'password', 'site', 'options', 'expected'), scrypt_vectors)
+def test_python_client_scrypt_vectors(username, password, site, options, expected):
+    options = dict(options, multibase=hex_multibase)
+    assert generator.generate(username, password, site, options, client=PythonClient()) == expected
+
+class CountingKdfClient(PythonClient):
+    def __init__(self):
+        PythonClient.__init__(self)
+        self.derived_keys = 0
+
+    def derive_key(self, username, password, scrypt):
+        self.derived_keys += 1
+        return PythonClient.derive_key(self, username, password, scrypt)
+
+def test_kdf_session_reuses_scrypt():
+    client = CountingKdfClient()
+    requests = [
+        (username, password, site, dict(options, multibase=hex_multibase))
+        for username, password, site, options, _ in scrypt_vectors] * 3
+    with generator.KdfSession(client) as session:
+        results = generator.generate_many(requests, client=client, kdf_session=session)
+        keys = list(session._keys.values())
+    assert results == [expected for _, _, _, _, expected in scrypt_vectors] * 3
+    assert client.derived_keys == 2
+    assert all(key == bytearray(64) for key in keys)
+    assert session._keys == {}
+
+def test_kdf_session_key_is_not_copied():
+    username, password, site, options, _ = scrypt_vectors[0]
+    options = dict(options, multibase=hex_multibase)
+    with generator.KdfSession(PythonClient()) as session:
+        derivation, _ = generator.derivation_request(
+            username, password, site, options, kdf_session=session)
+        precomputed = derivation['derivation']['kdf']['precomputed']
+        assert precomputed.tobytes() != bytes(bytearray(64))
+    assert precomputed.tobytes() == bytes(bytearray(64))
+
+@pytest.mark.parametrize(('method', 'expected'), [
+    ('keccak', 'gN7y2jQ72IbdvQZxrZLNmC4hrlDmB-KZnGJiGpoB4VEcOCn4'),
+    ('skein', 'UYfDoAN9nYMdxCYtgKenzjhbc9eonu3w92ec3SAA5UbT1J3L'),
+])
+def test_python_client_hash_site(method, expected):
+    options = {'method': method, 'iterations': 10}
+    assert generator.hash_site(
+        'passacre', 'hashed.example.com', options, client=PythonClient()) == expected
+
+def test_python_client_hash_sites():
+    options = {'method': 'keccak', 'iterations': 10}
+    sites = ['hashed.example.com', 'example.com', 'hashed.example.com']
+    client = PythonClient()
+    assert generator.hash_sites('passacre', sites, options, client=client) == [
+        generator.hash_site('passacre', site, options, client=client) for site in sites]
+
+def test_python_client_entropy_bits():
+    assert PythonClient().entropy_bits(multibase_of_schema([[32, 'printable']])) == 210
+
+def word_schema(path, n_words):
+    schema = multibase_of_schema([[n_words, 'word']])
+    schema['words'] = {'source': {'filePath': path}}
+    return schema
+
+def test_python_client_word_cache(tmpdir):
+    words = tmpdir.join('words')
+    words.write('spam\neggs\n')
+    client = PythonClient()
+    assert client.entropy_bits(word_schema(words.strpath, 4)) == 5
+    assert client.entropy_bits(word_schema(words.strpath, 4)) == 5
+    assert client.word_cache_stats() == {'hits': 1, 'misses': 1, 'entries': 1}
+    words.write('spam\neggs\nsausage\nbacon\n')
+    assert client.entropy_bits(word_schema(words.strpath, 4)) == 9
+    assert client.word_cache_stats() == {'hits': 1, 'misses': 2, 'entries': 1}
+    client.invalidate_words()
+    assert client.word_cache_stats()['entries'] == 0
+    assert client.preload_words(words.strpath) == 4
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.batches = []
+
+    def derive_many(self, requests):
+        self.batches.append(requests)
+        return [user_input['sitename'].upper() for _, user_input in requests]
+
+
+def test_generate_many():
+    client = FakeClient()
+    options = {'method': 'keccak', 'iterations': 10, 'multibase': hex_multibase}
+    passwords = generator.generate_many([
+        (None, 'spam', 'example.com', options),
+        ('eggs', 'spam', 'example.org', dict(options, scrypt={'n': 16, 'r': 1, 'p': 1})),
+    ], client=client)
+    assert passwords == ['EXAMPLE.COM', 'EXAMPLE.ORG']
+    [batch] = client.batches
+    assert batch == [
+        ({'derivation': {'method': 'keccak', 'kdf': {}, 'increment': 10},
+          'schema': hex_multibase},
+         {'username': '', 'password': 'spam', 'sitename': 'example.com'}),
+        ({'derivation': {'method': 'keccak', 'kdf': {'scrypt': {'n': 16, 'r': 1, 'p': 1}},
+                         'increment': 10},
+          'schema': hex_multibase},
+         {'username': 'eggs', 'password': 'spam', 'sitename': 'example.org'}),
+    ]
@@ -9,7 +9,7 @@ import json
 import pytest
 import py.path
 
-from passacre.jsonmini import parse
+from passacre.jsonmini import parse, unparse, _parse_grammar
 from passacre._ometa import ParseError
 
 
@@ -51,3 +51,27 @@ def test_parse_successes():
         # can't do much else because of float equality
         assert (json.dumps(parse(data), sort_keys=True)
                 == json.dumps(json.loads(data), sort_keys=True))
+
+@pytest.mark.parametrize('data', ['NaN', 'Infinity', '-Infinity'])
+def test_json_constants_are_identifiers(data):
+    assert parse(data) == data
+
+@pytest.mark.parametrize('data', [
+    '{"spam": [1, 2.5, -3e2, true, false, null, "eggs\\n"]}',
+    '[[32, "printable"]]',
+    '"\\u00ff"',
+    '12',
+])
+def test_json_fast_path_matches_grammar(data):
+    assert parse(data) == _parse_grammar(data)
+
+@pytest.mark.parametrize(('value', 'expected'), [
+    ({'spam': 'eggs', 'eggs': [1, None, True]}, 'eggs: [1, null, true], spam: eggs'),
+    ({'spam': {}}, 'spam: {}'),
+    ([[32, 'printable']], '[[32, printable]]'),
+    ('spam eggs', '"spam eggs"'),
+    (1.5, '1.5'),
+])
+def test_unparse(value, expected):
+    assert unparse(value) == expected
+    assert parse(unparse(value)) == value
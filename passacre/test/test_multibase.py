@@ -3,7 +3,7 @@
 
 import pytest
 
-from passacre.multibase import MultiBase
+from passacre.multibase import DomainError, MultiBase, SchemaMultiBase
 
 digits = '0123456789'
 hexdigits = '0123456789abcdef'
@@ -90,3 +90,127 @@ def test_encoding_failures(mb, encoding_failure):
 def test_decoding_failures(mb, decoding_failure):
     with pytest.raises(ValueError):
         mb.decode(decoding_failure)
+
+
+def test_encode_many_and_decode_many():
+    mb = MultiBase(['abcd', 'abc', 'ab'])
+    assert mb.encode_many([0, 5, 23]) == ['aaa', 'acb', 'dcb']
+    assert mb.decode_many(['aaa', 'acb', 'dcb']) == [0, 5, 23]
+
+
+def test_duplicate_digits_decode_to_the_first():
+    mb = MultiBase(['aab', 'ab'])
+    assert mb.decode('ab') == 1
+    assert mb.decode('bb') == 5
+
+
+def test_word_bases():
+    words = ['foo', 'bar', 'baz']
+    mb = MultiBase([words, [' '], words])
+    assert mb.max_encodable_value == 8
+    assert mb.encode(5) == 'bar baz'
+    assert mb.decode(['bar', ' ', 'baz']) == 5
+
+
+class DividingMultiBase(MultiBase):
+    __slots__ = ()
+    divide_threshold = 4
+    leaf_size = 2
+
+
+@pytest.mark.parametrize('n_digits', [5, 7, 16, 33])
+def test_divide_and_conquer_matches_digit_by_digit(n_digits):
+    bases = [(hexdigits, digits, 'ab')[e % 3] for e in range(n_digits)]
+    mb, dividing_mb = MultiBase(bases), DividingMultiBase(bases)
+    assert dividing_mb.max_encodable_value == mb.max_encodable_value
+    for n in [0, 1, 12345, mb.max_encodable_value // 3, mb.max_encodable_value]:
+        encoded = mb.encode(n)
+        assert dividing_mb.encode(n) == encoded
+        assert dividing_mb.decode(encoded) == n
+    with pytest.raises(ValueError):
+        dividing_mb.encode(mb.max_encodable_value + 1)
+    with pytest.raises(ValueError):
+        dividing_mb.decode('z' * n_digits)
+
+
+words = ['spam', 'eggs', 'sausage']
+
+
+def characters(cs, repeat=1):
+    return {'value': {'characters': list(cs)}, 'repeat': repeat}
+
+
+def separator(s, repeat=1):
+    return {'value': {'separator': s}, 'repeat': repeat}
+
+
+def word(repeat=1):
+    return {'value': {'words': None}, 'repeat': repeat}
+
+
+def schema_multibase(*items, **kw):
+    schema = dict(kw, value=list(items), words={'source': {'filePath': 'words.txt'}})
+    return SchemaMultiBase(schema, {'words.txt': words}.__getitem__)
+
+
+schema_bases = [
+    (schema_multibase(characters(digits, 2)), 99, 1, [
+        (5, '05'), (36, '36'), (94, '94')]),
+    (schema_multibase(characters('abcd'), characters('abc'), characters('ab')), 23, 1, [
+        (0, 'aaa'), (5, 'acb'), (11, 'bcb'), (23, 'dcb')]),
+    (schema_multibase(word(), separator(' '), word()), 8, 1, [
+        (0, 'spam spam'), (3, 'eggs spam'), (8, 'sausage sausage')]),
+    (schema_multibase(
+        word(), characters(digits), separator(' '), characters(digits), word()), 899, 2, [
+        (0, 'spam0 0spam'), (29, 'spam0 9sausage'), (100, 'spam3 3eggs'),
+        (300, 'eggs0 0spam'), (899, 'sausage9 9sausage')]),
+    (schema_multibase(characters(digits, 0), separator('-', 3)), 9, 1, [
+        (0, '0---'), (9, '9---')]),
+    (schema_multibase(
+        {'value': {'subschema': {'value': [characters('ab'), characters(digits)]}},
+         'repeat': 2}), 399, 2, [
+        (0, 'a0a0'), (31, 'a1b1'), (399, 'b9b9')]),
+]
+
+
+@pytest.mark.parametrize(('mb', 'max_encodable_value', 'required_bytes', 'decoded_encoded'),
+                         schema_bases)
+def test_schema_multibase(mb, max_encodable_value, required_bytes, decoded_encoded):
+    assert mb.max_encodable_value == max_encodable_value
+    assert mb.entropy_bits() == (max_encodable_value + 1).bit_length()
+    assert mb.required_bytes() == required_bytes
+    for decoded, encoded in decoded_encoded:
+        assert mb.encode(decoded) == encoded
+    for n in [-1, max_encodable_value + 1]:
+        with pytest.raises(DomainError):
+            mb.encode(n)
+
+
+def test_schema_multibase_matches_multibase():
+    bases = [hexdigits] * 300 + ['-'] + ['abc'] * 5 + [digits] * 2
+    mb = MultiBase(bases)
+    schema_mb = schema_multibase(
+        characters(hexdigits, 300), separator('-'), characters('abc', 5),
+        characters(digits, 2))
+    assert schema_mb.max_encodable_value == mb.max_encodable_value
+    for n in [0, 12345, mb.max_encodable_value // 7, mb.max_encodable_value]:
+        assert schema_mb.encode(n) == mb.encode(n)
+
+
+def test_schema_multibase_does_not_expand_repeats():
+    mb = schema_multibase(characters('ab', 10 ** 6), separator('-', 10 ** 6))
+    assert mb.entropy_bits() == 10 ** 6 + 1
+    assert mb._multibases == {}
+
+
+def test_schema_multibase_shuffle():
+    mb = schema_multibase(
+        characters('abcd'), characters('efg'), characters('hi'), shuffle=True)
+    assert mb.max_encodable_value == 143
+    with pytest.raises(NotImplementedError):
+        mb.encode(0)
+
+
+def test_schema_multibase_words_without_a_file():
+    with pytest.raises(ValueError):
+        SchemaMultiBase({'value': [word()]})
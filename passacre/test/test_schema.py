@@ -63,3 +63,44 @@ whilst parsing character sets:   [{0}' ', None]
 whilst parsing a character set:   {1}     None
 whilst parsing the value:         {1}     None
 expected a string; got None""".format(string_prefix, string_padding)
+
+
+@pytest.mark.parametrize(('value', 'expected'), [
+    ([[32, 'printable']], 210),
+    ([[8, 'alphanumeric']], 48),
+    ([[2, 'digit'], '-', [2, 'digit']], 14),
+    (['word'], None),
+])
+def test_entropy_bits_of_multibase(value, expected):
+    assert schema.entropy_bits_of_multibase(schema.multibase_of_schema(value)) == expected
+
+
+@pytest.mark.parametrize(('value', 'expected'), [
+    ([[100000, 'digit']], [('characters', 100000)]),
+    ([[1000, [1000, 'digit']]], [('characters', 1000000)]),
+    ([[2, 'digit'], 'digit'], [('characters', 3)]),
+    ([['-', 3, [2, 'digit']]], [
+        ('characters', 2), ('separator', 1), ('characters', 2), ('separator', 1), ('characters', 2)]),
+    ([[2, 'digit', 'word']], [('characters', 1), ('word', 1), ('characters', 1), ('word', 1)]),
+    ([[0, 'digit'], 'word'], [('word', 1)]),
+])
+def test_multibase_of_schema_runs(value, expected):
+    def kind(item):
+        if 'words' in item:
+            return 'word'
+        elif 'separator' in item:
+            return 'separator'
+        return 'characters'
+    multibase = schema.multibase_of_schema(value)
+    assert [(kind(x['value']), x['repeat']) for x in multibase['value']] == expected
+
+@pytest.mark.parametrize(('value', 'expected'), [
+    ([[' ', 4, [0, 'digit']]], [[' '], [' '], [' ']]),
+    ([[' ', 1, [0, 'digit']]], []),
+    ([[3, [0, 'digit']]], []),
+    ([['-', 2, [' ', 3, [0, 'digit']]]], [[' '], [' '], ['-'], [' '], [' ']]),
+    ([[1, 'digit'], [' ', 3, [0, 'digit']], [1, 'digit']], [
+        '0123456789', [' '], [' '], '0123456789']),
+])
+def test_parse_items_empty_repetitions(value, expected):
+    assert [item for item, count in schema.parse_items(value) for _ in range(count)] == expected
@@ -0,0 +1,25 @@
+# Copyright (c) Aaron Gallagher <_@habnab.it>
+# See COPYING for details.
+
+from passacre.util import LRUCache
+
+
+def test_lru_cache_reuses_values():
+    cache = LRUCache(2)
+    calls = []
+    create = lambda: calls.append(None) or object()
+    value = cache.get_or_create('a', create)
+    assert cache.get_or_create('a', create) is value
+    assert len(calls) == 1
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.get_or_create('a', object)
+    cache.get_or_create('b', object)
+    cache.get_or_create('a', object)
+    cache.get_or_create('c', object)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+    assert len(cache) == 2
@@ -0,0 +1,57 @@
+# Copyright (c) Aaron Gallagher <_@habnab.it>
+# See COPYING for details.
+
+import io
+
+import pytest
+
+from passacre._backend_python import read_words
+from passacre.multibase import SchemaMultiBase
+from passacre.words import CompiledWords, compile_words
+
+
+def compiled(data):
+    outfile = io.BytesIO()
+    compile_words(io.BytesIO(data), outfile)
+    return outfile.getvalue()
+
+
+def test_compiled_words_format():
+    assert compiled(b'spam\neggs\n') == (
+        b'passacre-words\x00\x00' + b'\x02' + b'\x00' * 7
+        + b'\x00' * 8 + b'\x04' + b'\x00' * 7 + b'\x08' + b'\x00' * 7
+        + b'spameggs')
+
+
+def test_compiled_words_lookup():
+    words = CompiledWords(compiled(u'spam\r\neggs\nsauságe'.encode('utf-8')))
+    assert len(words) == 3
+    assert words[0] == 'spam'
+    assert words[2] == u'sauságe'
+    assert words[-1] == u'sauságe'
+    assert list(words) == ['spam', 'eggs', u'sauságe']
+    with pytest.raises(IndexError):
+        words[3]
+
+
+def test_compiled_words_recompile():
+    data = compiled(b'spam\neggs\n')
+    assert compiled(data) == data
+
+
+@pytest.mark.parametrize('data', [b'not a word list', b'passacre-words\x00\x00\xff'])
+def test_not_compiled_words(data):
+    with pytest.raises(ValueError):
+        CompiledWords(data)
+
+
+def test_read_compiled_words(tmpdir):
+    path = tmpdir.join('words.compiled')
+    path.write_binary(compiled(b'spam\neggs\nsausage\n'))
+    words = read_words(path.strpath)
+    assert isinstance(words, CompiledWords)
+    assert list(words) == ['spam', 'eggs', 'sausage']
+    mb = SchemaMultiBase(
+        {'value': [{'value': {'words': None}, 'repeat': 2}],
+         'words': {'source': {'filePath': path.strpath}}}, read_words)
+    assert mb.encode(5) == 'eggssausage'
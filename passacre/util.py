@@ -3,6 +3,11 @@
 
 import json
 
+try:
+    from collections import OrderedDict
+except ImportError:  # pragma: nocover
+    from passacre._ordereddict import OrderedDict
+
 from passacre.compat import crochet_setup, wait_for_reactor
 from passacre import jsonmini
 
@@ -89,6 +94,38 @@ def jdumps(val):
     return json.dumps(val, sort_keys=True)
 
 
+class LRUCache(object):
+    """A mapping holding at most ``maxsize`` items, evicting the least recently
+    used item first.
+
+    ``get_or_create`` returns the value for a key, calling ``create`` to make
+    it on a miss.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def get_or_create(self, key, create):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            value = create()
+            if len(self._items) >= self.maxsize:
+                self._items.popitem(last=False)
+        self._items[key] = value
+        return value
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def clear(self):
+        self._items.clear()
+
+
 def lazily_wait_for_reactor(f):
     f = wait_for_reactor(f)
     def wrap(*a, **kw):
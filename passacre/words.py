@@ -0,0 +1,92 @@
+# Copyright (c) Aaron Gallagher <_@habnab.it>
+# See COPYING for details.
+
+"""Compiled word lists.
+
+A compiled word list is ``compiled_words_magic``, the number of words as a
+little-endian unsigned 64-bit integer, a table of one more offset than there
+are words in the same format, and then every word's UTF-8 back to back. The
+i-th word runs from the i-th offset to the next, counted from the end of the
+offset table.
+"""
+
+import struct
+
+
+compiled_words_magic = b'passacre-words\x00\x00'
+_header = struct.Struct('<Q')
+_offsets = struct.Struct('<QQ')
+
+
+def split_words(data):
+    "Split a word file's bytes into words the same way the backend does."
+    lines = data.split(b'\n')
+    if not lines[-1]:
+        lines.pop()
+    return [line[:-1] if line.endswith(b'\r') else line for line in lines]
+
+
+def compile_words(infile, outfile):
+    """Compile the word file ``infile`` to ``outfile``.
+
+    ``infile`` may itself be a compiled word list. Returns the number of words
+    written.
+    """
+
+    data = infile.read()
+    if data.startswith(compiled_words_magic):
+        words = [word.encode('utf-8') for word in CompiledWords(data)]
+    else:
+        data.decode('utf-8')
+        words = split_words(data)
+    offsets = [0]
+    for word in words:
+        offsets.append(offsets[-1] + len(word))
+    outfile.write(compiled_words_magic)
+    outfile.write(_header.pack(len(words)))
+    outfile.write(struct.pack('<%dQ' % (len(offsets),), *offsets))
+    outfile.write(b''.join(words))
+    return len(words)
+
+
+class CompiledWords(object):
+    """A compiled word list, read in place.
+
+    ``buf`` is the whole compiled word list, as anything that can be sliced to
+    bytes; usually an ``mmap``, as opened by ``open``. Words are only decoded
+    when they're looked up, so the size of the list doesn't matter.
+    """
+
+    def __init__(self, buf):
+        if buf[:len(compiled_words_magic)] != compiled_words_magic:
+            raise ValueError('not a compiled word list')
+        self._buf = buf
+        self._table = len(compiled_words_magic) + _header.size
+        if self._table > len(buf):
+            raise ValueError('truncated compiled word list')
+        self._count, = _header.unpack_from(buf, len(compiled_words_magic))
+        self._blob = self._table + _header.size * (self._count + 1)
+        if self._blob > len(buf):
+            raise ValueError('truncated compiled word list')
+
+    @classmethod
+    def open(cls, path):
+        "Memory-map the compiled word list at ``path``."
+        import mmap
+        with open(path, 'rb') as infile:
+            return cls(mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError('word index out of range')
+        start, end = _offsets.unpack_from(self._buf, self._table + _header.size * i)
+        return self._buf[self._blob + start:self._blob + end].decode('utf-8')
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
@@ -7,43 +7,161 @@ import sqlite3
 from passacre import features
 
 
-def main(yaml_file, sqlite_file):
+batch_size = 1000
+
+
+def streaming_loader(yaml):
+    """Make a YAML loader class that can compose one node at a time.
+
+    It parses with libyaml when that's available; only composing nodes and
+    constructing values happen in Python.
+    """
+
+    from yaml.composer import Composer
+    from yaml.constructor import SafeConstructor
+    from yaml.resolver import Resolver
+    try:
+        from yaml.cyaml import CParser
+    except ImportError:
+        return yaml.SafeLoader
+
+    class StreamingCLoader(Composer, CParser, SafeConstructor, Resolver):
+        def __init__(self, stream):
+            CParser.__init__(self, stream)
+            Composer.__init__(self)
+            SafeConstructor.__init__(self)
+            Resolver.__init__(self)
+
+    return StreamingCLoader
+
+
+def _construct_next(loader):
+    value = loader.construct_object(loader.compose_node(None, None), deep=True)
+    # Nothing constructed is needed again, apart from anchors, which are kept
+    # as nodes.
+    loader.constructed_objects = {}
+    return value
+
+
+def _iter_top_level(loader, events):
+    "Yield each key of the top-level mapping, with a loader positioned at its value."
+    loader.get_event()
+    loader.get_event()
+    if not loader.check_event(events.MappingStartEvent):
+        raise ValueError('the top level of a YAML config must be a mapping')
+    loader.get_event()
+    while not loader.check_event(events.MappingEndEvent):
+        yield _construct_next(loader)
+
+
+def _iter_sites(loader, events):
+    "Yield each ``(site, site_config)`` pair of the ``sites`` mapping."
+    if not loader.check_event(events.MappingStartEvent):
+        raise ValueError('sites must be a mapping')
+    loader.get_event()
+    while not loader.check_event(events.MappingEndEvent):
+        site = _construct_next(loader)
+        yield site, _construct_next(loader)
+    loader.get_event()
+
+
+class _Converter(object):
+    def __init__(self, loader, curs):
+        self.loader = loader
+        self.curs = curs
+        self.schema_ids = {}
+        self.site_rows = []
+        self.config_rows = []
+        self.sites_without_schema = []
+        self.default_schema = None
+        self.n_sites = 0
+
+    def schema_id(self, schema):
+        value = json.dumps(schema)
+        schema_id = self.schema_ids.get(value)
+        if schema_id is None:
+            schema_id = self.schema_ids[value] = len(self.schema_ids) + 1
+        return schema_id
+
+    def add_site(self, site, site_config):
+        schema = site_config.pop('schema', None)
+        if site == 'default':
+            self.default_schema = schema
+        if schema is None:
+            self.sites_without_schema.append(site)
+        else:
+            self.site_rows.append((site, self.schema_id(schema)))
+        self.config_rows.extend(
+            (site, k, json.dumps(v)) for k, v in site_config.items())
+        self.n_sites += 1
+        if self.n_sites % batch_size == 0:
+            self.flush()
+
+    def flush(self):
+        self.curs.executemany(
+            'INSERT INTO sites (site_name, schema_id) VALUES (?, ?)', self.site_rows)
+        self.curs.executemany(
+            'INSERT INTO config_values (site_name, name, value) VALUES (?, ?, ?)',
+            self.config_rows)
+        self.site_rows = []
+        self.config_rows = []
+
+    def finish(self):
+        if self.default_schema is None:
+            raise ValueError('the default site must have a schema')
+        default_schema_id = self.schema_id(self.default_schema)
+        self.site_rows.extend(
+            (site, default_schema_id) for site in self.sites_without_schema)
+        self.flush()
+
+        # Sequences with anchors name the schemata with the same value. Like
+        # the sites, the schemata's values are compared by their JSON.
+        used_by_sites = sorted(self.schema_ids)
+        schema_names = {}
+        for name, node in self.loader.anchors.items():
+            value = self.loader.construct_object(node, deep=True)
+            if isinstance(value, list):
+                schema_names[json.dumps(value)] = name
+                self.schema_id(value)
+        for e, value in enumerate(used_by_sites):
+            schema_names.setdefault(value, 'schema_%d' % e)
+        self.curs.executemany(
+            'INSERT INTO schemata (schema_id, name, value) VALUES (?, ?, ?)',
+            ((schema_id, schema_names[value], value)
+             for value, schema_id in self.schema_ids.items()))
+
+
+def main(yaml_file, sqlite_file, progress=None):
+    """Convert a YAML config to an sqlite config.
+
+    The YAML is read as a stream, one site at a time, and the sites are
+    inserted in batches in a single transaction. If ``progress`` is passed,
+    it's called with the number of sites converted so far after every batch,
+    and once more at the end.
+    """
+
     features.yaml.check()
     import yaml
-    with open(yaml_file) as infile:
-        loader = yaml.SafeLoader(infile)
-        loader.check_node()
-        loader.get_event()
-        node = loader.compose_node(None, None)
-        schema_names = dict(
-            (json.dumps(list(map(loader.construct_sequence, v.value))), k)
-            for k, v in loader.anchors.items())
-        config = loader.construct_document(node)
+    from yaml import events
     db = sqlite3.connect(sqlite_file)
-    sites = config.pop('sites', {})
-    config.pop('schemata', None)
-    default_schema = sites['default']['schema']
-    schemata = {}
-    config_rows = [
-        (None, k, json.dumps(v)) for k, v in config.items()]
-    for site, site_config in sites.items():
-        schema = json.dumps(site_config.pop('schema', default_schema))
-        schemata.setdefault(schema, []).append(site)
-        config_rows.extend(
-            (site, k, json.dumps(v)) for k, v in site_config.items())
-    for e, schema in enumerate(sorted(schemata)):
-        schema_names.setdefault(schema, 'schema_%d' % e)
     curs = db.cursor()
-    curs.executemany(
-        'INSERT INTO schemata (name, value) VALUES (?, ?)',
-        ((name, schema) for schema, name in schema_names.items()))
-    curs.executemany(
-        'INSERT INTO sites (site_name, schema_id) SELECT ?, schema_id FROM schemata WHERE value = ?',
-        ((site, value)
-         for value, sites in schemata.items()
-         for site in sites))
-    curs.executemany('INSERT INTO config_values (site_name, name, value) VALUES (?, ?, ?)', config_rows)
+    with open(yaml_file, 'rb') as infile:
+        loader = streaming_loader(yaml)(infile)
+        converter = _Converter(loader, curs)
+        for key in _iter_top_level(loader, events):
+            if key == 'sites':
+                for site, site_config in _iter_sites(loader, events):
+                    converter.add_site(site, site_config)
+                    if progress is not None and converter.n_sites % batch_size == 0:
+                        progress(converter.n_sites)
+            else:
+                value = _construct_next(loader)
+                if key != 'schemata':
+                    converter.config_rows.append((None, key, json.dumps(value)))
+        converter.finish()
     db.commit()
+    if progress is not None:
+        progress(converter.n_sites)
 
 
 if __name__ == '__main__':  # pragma: nocover
@@ -2,8 +2,10 @@
 # See COPYING for details.
 
 import os
+import sys
 
 from setuptools import setup
+from setuptools.command.build_py import build_py
 
 import versioneer
 
@@ -27,6 +29,24 @@ extras_require['all'] = [
     for extra, reqs in extras_require.items() if not extra.startswith(':')
     for req in reqs]
 
+# These use ``async def``, so they'd fail to byte-compile on older Pythons.
+py35_modules = set(['_backend_asyncio', 'test_backend_asyncio'])
+
+cmdclass = versioneer.get_cmdclass()
+_build_py = cmdclass.get('build_py', build_py)
+
+
+class build_py_without_py35_modules(_build_py):
+    def find_package_modules(self, package, package_dir):
+        modules = _build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info < (3, 5):
+            modules = [m for m in modules if m[1] not in py35_modules]
+        return modules
+
+
+cmdclass['build_py'] = build_py_without_py35_modules
+
+
 entry_points = {'console_scripts': []}
 if os.environ.get('PASSACRE_LIBRARY_TESTING_ONLY') != 'yes':
     entry_points['console_scripts'].append(
@@ -65,5 +85,5 @@ setup(
     extras_require=extras_require,
     entry_points=entry_points,
     version=versioneer.get_version(),
-    cmdclass=versioneer.get_cmdclass(),
+    cmdclass=cmdclass,
 )